@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+
+# Benchmark of the gdbx.py commands without gdb
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Benchmark the gdbx.py commands without gdb
+
+usage: python2 bench/bench_gdbx.py [OPTION...]
+
+  --sizes LIST      sizes of the synthetic memory (default: 1K,64K,1M,16M),
+                    e.g. --sizes 1K,1M,1G
+  --repeat N        run each case N times (default: 3)
+  --filter REGEX    run only the cases whose names match REGEX
+  --warm            keep the gdbx memory cache between the runs; by
+                    default, the inferior is "resumed" before each run
+  --rss SIZE        grow the benchmark to SIZE of private memory first,
+                    as gdb with a large inferior, which makes fork(2)
+                    slow, e.g. --rss 2G
+  --save FILE       save the results into FILE as JSON
+  --compare FILE    compare the results with the results saved in FILE
+
+The gdb module is replaced by bench/gdb.py, whose inferior memory is
+generated on demand, so even the 1G cases do not hold the memory.
+Each case runs in a forked process, which reports the latency of every
+run, the throughput, the peak RSS, and the time of each phase taken
+from 'gdbx stats'.  The output of the commands is discarded."""
+
+import sys
+import os
+import re
+import imp
+import json
+import time
+import resource
+import tempfile
+import platform
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GDBX_PATH = os.path.join(os.path.dirname(BENCH_DIR), "gdbx.py")
+
+sys.path.insert(0, BENCH_DIR)
+import gdb
+
+DEFAULT_SIZES = "1K,64K,1M,16M"
+
+# Elements of 'hexdump each' at most
+EACH_ELEMENTS = 1000
+
+# Encodings of the 'iconv tools' cases
+POOL_ENCODINGS = 4
+
+TEXT_UNIT = ("The quick brown fox jumps over the lazy dog. 0123456789\n"
+             "\xeb\x8b\xa4\xeb\x9e\x8c\xec\xa5\x90 \xed\x97\x8c "
+             "\xec\xb3\x87\xeb\xb0\x94\xed\x80\xb4\xec\x97\x90 "
+             "\xed\x83\x80\xea\xb3\xa0\xed\x8c\x8c.\n" +
+             "\0" * 48 + "\x01\x02\x03\x04\x7f\n")
+XML_UNIT = "<item id=\"42\"><name>fox</name><text>lazy dog</text></item>\n"
+JSON_UNIT = ("{\"id\": 42, \"name\": \"fox\", \"tags\": [\"lazy\", \"dog\"], "
+             "\"score\": -1.5e3, \"ok\": true, \"next\": null},\n")
+
+def parse_size(text):
+    m = re.match(r"^(\d+)([KMG]?)$", text.strip().upper())
+    if m == None:
+        raise ValueError("invalid size, '%s'" % text)
+    return int(m.group(1)) * { "": 1, "K": 1024, "M": 1024 ** 2,
+                               "G": 1024 ** 3 }[m.group(2)]
+
+def format_size(size):
+    for (unit, scale) in (("G", 1024 ** 3), ("M", 1024 ** 2), ("K", 1024)):
+        if size >= scale and size % scale == 0:
+            return "%d%s" % (size / scale, unit)
+    return "%d" % size
+
+class Memory(object):
+    """The synthetic inferior memory of a size
+
+'text' is a region of text with some binary bytes, which is also the
+array 'text_SIZE' of char, and the array 'msgs_SIZE' of 'struct msg'
+of 64 bytes each.  'xml' is a region of a well-formed XML document,
+and 'json' is a region of a valid JSON text."""
+    def __init__(self, index, size):
+        self.size = size
+        self.name = format_size(size)
+        base = (index + 1) << 32
+        self.text = gdb.add_region(base, size, TEXT_UNIT)
+        self.xml = gdb.add_region(base + (1 << 31), size, XML_UNIT,
+                                  "<?xml version=\"1.0\"?>\n<items>\n",
+                                  "</items>\n")
+        self.json = gdb.add_region(base + (3 << 30), size, JSON_UNIT,
+                                   "[\n", "{}]\n")
+
+        char = gdb.types["char"]
+        gdb.symbols["text_%s" % self.name] = \
+            gdb.Value(self.text.base, char.array(self.text.size))
+        nmsgs = max(1, self.text.size / 64)
+        gdb.symbols["msgs_%s" % self.name] = \
+            gdb.Value(self.text.base, gdb.types["struct msg"].array(nmsgs))
+        self.nmsgs = nmsgs
+
+    def text_range(self):
+        return "0x%x 0x%x" % (self.text.base, self.text.base + self.text.size)
+
+    def xml_range(self):
+        return "0x%x 0x%x" % (self.xml.base, self.xml.base + self.xml.size)
+
+    def json_range(self):
+        return "0x%x 0x%x" % (self.json.base,
+                              self.json.base + self.json.size)
+
+def define_types():
+    char = gdb.Type("char", 1)
+    gdb.types["char"] = char
+    gdb.types["int"] = gdb.Type("int", 4)
+    gdb.types["long"] = gdb.Type("long", 8)
+    gdb.types["struct msg"] = gdb.Type(
+        "struct msg", 64, gdb.TYPE_CODE_STRUCT,
+        fields = [ gdb.Field("id", gdb.types["int"], 0),
+                   gdb.Field("buf", char.array(60), 32) ])
+
+class Case(object):
+    """A benchmark case
+
+'func(gdbx, mem)' returns (commands, bytes), where 'commands' is a
+list of the command lines or a function to run for a single run, and
+'bytes' is the number of bytes processed by a run.  If 'sized' is
+False, the case is run only once, regardless of the sizes.  'needs' is
+a function of gdbx that returns False if the case cannot run."""
+    def __init__(self, name, func, sized = True, needs = None, setup = None):
+        self.name = name
+        self.func = func
+        self.sized = sized
+        self.needs = needs
+        self.setup = setup
+
+def tool_exists(path):
+    return lambda gdbx: os.access(getattr(gdbx, path), os.X_OK)
+
+def iconv_only_encodings(gdbx, count):
+    """COUNT encoding aliases that are supported by iconv(1) only"""
+    encodings = gdbx.IconvEncodings()
+    aliases = list()
+    for alias in sorted(gdbx.IconvEncodings.table().iterkeys()):
+        if re.match(r"^[a-z0-9_]+$", alias) and \
+           encodings.codec(alias) == None:
+            aliases.append(alias)
+            if len(aliases) == count:
+                return aliases
+    return None
+
+def iconv_only_encoding(gdbx):
+    """An encoding alias that is supported by iconv(1) only"""
+    aliases = iconv_only_encodings(gdbx, 1)
+    return aliases and aliases[0]
+
+def iconv_tools(gdbx, m):
+    """'iconv memory' of POOL_ENCODINGS encodings, all by iconv(1)"""
+    encodings = iconv_only_encodings(gdbx, POOL_ENCODINGS)
+    return ([ "iconv memory %s %s" % (m.text_range(),
+                                      " ".join([ "#" + e
+                                                 for e in encodings ])) ],
+            m.text.size * len(encodings))
+
+def iconv_tools_exist(gdbx):
+    return tool_exists("ICONV_PATH")(gdbx) and \
+           iconv_only_encodings(gdbx, POOL_ENCODINGS) != None
+
+def start_pool(gdbx, mem):
+    """Start the workers, which live as long as gdb"""
+    gdbx.POOL_SIZE = 4
+    gdbx.run_tools([ ([ "true" ], None) ] * gdbx.POOL_SIZE)
+
+def no_pool(gdbx, mem):
+    gdbx.POOL_SIZE = 0
+
+def reload_gdbx(gdbx, mem):
+    def run():
+        imp.load_source("gdbx_reloaded", GDBX_PATH)
+    return (run, 0)
+
+def cold_encodings(gdbx, mem):
+    def run():
+        gdbx.IconvEncodings.table(rebuild = True)
+    return (run, 0)
+
+def sample_stride(gdbx, mem):
+    gdbx.MAX_BYTES = 64 * 1024
+    gdbx.SAMPLING = "stride"
+
+def make_threads(gdbx, mem):
+    """A thread per message of 'msgs_SIZE', up to EACH_ELEMENTS, where
+'req' is the message"""
+    msgs = gdb.symbols["msgs_%s" % mem.name]
+    gdb.threads[:] = [ gdb.InferiorThread(i + 1, { "req": msgs[i] })
+                       for i in xrange(min(mem.nmsgs, EACH_ELEMENTS)) ]
+
+CASES = [
+    Case("load gdbx.py", reload_gdbx, sized = False),
+    Case("iconv encodings (cold)", cold_encodings, sized = False,
+         needs = tool_exists("ICONV_PATH")),
+    Case("hexdump memory",
+         lambda gdbx, m: ([ "hexdump memory %s" % m.text_range() ],
+                          m.text.size)),
+    Case("hexdump memory -x",
+         lambda gdbx, m: ([ "hexdump memory %s ## -x" % m.text_range() ],
+                          m.text.size)),
+    Case("hexdump memory (tool)",
+         lambda gdbx, m: ([ "hexdump memory %s ## -e '16/1 \"%%02x\" \"\\n\"'"
+                            % m.text_range() ], m.text.size),
+         needs = tool_exists("HEXDUMP_PATH")),
+    Case("hexdump memory (sampled)",
+         lambda gdbx, m: ([ "hexdump memory %s" % m.text_range() ],
+                          min(m.text.size, gdbx.SAMPLE_BYTES)),
+         setup = sample_stride),
+    Case("hexdump value",
+         lambda gdbx, m: ([ "hexdump value text_%s" % m.name ],
+                          m.text.size)),
+    Case("hexdump value --fields",
+         lambda gdbx, m: ([ "hexdump value msgs_%s ## --fields" % m.name ],
+                          m.nmsgs * 64)),
+    Case("hexdump search",
+         lambda gdbx, m: ([ "hexdump search %s ## lazy --max 100"
+                            % m.text_range() ], m.text.size)),
+    Case("hexdump search (multi)",
+         lambda gdbx, m: ([ "hexdump search %s ## -s fox -x 7f0a "
+                            "-r 'j[a-z]+s' --max 100" % m.text_range() ],
+                          m.text.size)),
+    Case("hexdump profile",
+         lambda gdbx, m: ([ "hexdump profile %s" % m.text_range() ],
+                          m.text.size)),
+    Case("hexdump snapshot",
+         lambda gdbx, m: ([ "hexdump snapshot bench %s" % m.text_range(),
+                            "hexdump snapshot -d bench" ], m.text.size)),
+    Case("hexdump diff",
+         lambda gdbx, m: ([ "hexdump diff bench" ], m.text.size),
+         setup = lambda gdbx, m: gdb.invoke("hexdump snapshot bench %s" %
+                                            m.text_range())),
+    Case("hexdump watch (stop)",
+         lambda gdbx, m: (gdb.events.stop.fire, m.text.size),
+         setup = lambda gdbx, m: gdb.invoke("hexdump watch %s" %
+                                            m.text_range())),
+    Case("hexdump each",
+         lambda gdbx, m: ([ "hexdump each msgs_%s[0..%d].buf" %
+                            (m.name, min(m.nmsgs, EACH_ELEMENTS) - 1) ],
+                          min(m.nmsgs, EACH_ELEMENTS) * 60)),
+    Case("hexdump each (tool)",
+         lambda gdbx, m: ([ "hexdump each msgs_%s[0..%d].buf ## "
+                            "-e '16/1 \"%%02x\" \"\\n\"'" %
+                            (m.name, min(m.nmsgs, EACH_ELEMENTS) - 1) ],
+                          min(m.nmsgs, EACH_ELEMENTS) * 60),
+         needs = tool_exists("HEXDUMP_PATH")),
+    Case("iconv each (tool)",
+         lambda gdbx, m: ([ "iconv each msgs_%s[0..%d].buf #%s" %
+                            (m.name, min(m.nmsgs, EACH_ELEMENTS) - 1,
+                             iconv_only_encoding(gdbx)) ],
+                          min(m.nmsgs, EACH_ELEMENTS) * 60),
+         needs = lambda gdbx: tool_exists("ICONV_PATH")(gdbx) and
+                              iconv_only_encoding(gdbx) != None),
+    Case("gdbx foreach-thread",
+         lambda gdbx, m: ([ "gdbx foreach-thread req.buf -- hexdump" ],
+                          min(m.nmsgs, EACH_ELEMENTS) * 60),
+         setup = make_threads),
+    Case("iconv memory",
+         lambda gdbx, m: ([ "iconv memory %s #utf_8" % m.text_range() ],
+                          m.text.size)),
+    Case("iconv memory (tool)",
+         lambda gdbx, m: ([ "iconv memory %s #%s" %
+                            (m.text_range(), iconv_only_encoding(gdbx)) ],
+                          m.text.size),
+         needs = lambda gdbx: tool_exists("ICONV_PATH")(gdbx) and
+                              iconv_only_encoding(gdbx) != None),
+    Case("iconv tools (pool)", iconv_tools,
+         needs = iconv_tools_exist,
+         setup = start_pool),
+    Case("iconv tools (direct)", iconv_tools,
+         needs = iconv_tools_exist,
+         setup = no_pool),
+    Case("iconv detect",
+         lambda gdbx, m: ([ "iconv detect %s --top 3 #utf_8 #euc_kr "
+                            "#cp949 #iso8859_1 #shift_jis" % m.text_range() ],
+                          min(m.text.size, gdbx.DETECT_MAX_BYTES))),
+    Case("iconv strings",
+         lambda gdbx, m: ([ "iconv strings %s --max 1000000000"
+                            % m.text_range() ], m.text.size)),
+    Case("xmllint --wellformed",
+         lambda gdbx, m: ([ "xmllint memory %s ## --wellformed"
+                            % m.xml_range() ], m.xml.size)),
+    Case("xmllint memory (tool)",
+         lambda gdbx, m: ([ "xmllint memory %s ## --noout" % m.xml_range() ],
+                          m.xml.size),
+         needs = tool_exists("XMLLINT_PATH")),
+    Case("jsonlint memory",
+         lambda gdbx, m: ([ "jsonlint memory %s" % m.json_range() ],
+                          m.json.size)),
+]
+
+def run_case(gdbx, case, mem, repeat, warm):
+    """Run CASE in a forked process, and return the result dictionary"""
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 0
+        try:
+            result = run_child(gdbx, case, mem, repeat, warm)
+        except BaseException as e:
+            result = { "error": "%s: %s" % (type(e).__name__, e) }
+            status = 1
+        os.write(wfd, json.dumps(result))
+        os._exit(status)
+
+    os.close(wfd)
+    chunks = list()
+    while True:
+        data = os.read(rfd, 65536)
+        if not data:
+            break
+        chunks.append(data)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    result = json.loads("".join(chunks) or "{\"error\": \"no result\"}")
+    result["case"] = case.name
+    result["size"] = case.sized and mem.size or 0
+    return result
+
+def run_child(gdbx, case, mem, repeat, warm):
+    # Discard the output of the commands and the tools.
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    if case.setup != None:
+        case.setup(gdbx, mem)
+    (commands, nbytes) = case.func(gdbx, mem)
+    if callable(commands):
+        run = commands
+    else:
+        run = lambda: [ gdb.invoke(line) for line in commands ]
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    gdbx.stats.clear()
+    latencies = list()
+    for i in xrange(repeat):
+        if not warm:
+            gdb.events.cont.fire()
+        start = time.time()
+        run()
+        latencies.append(time.time() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The process exits by os._exit(), without the atexit handlers.
+    gdbx.close_tool_pool()
+
+    phases = dict()
+    for agg in gdbx.stats.commands.itervalues():
+        for (name, elapsed) in agg["phases"].iteritems():
+            phases[name] = phases.get(name, 0.0) + elapsed
+    total = sum(phases.values())
+    if total > 0:
+        for name in phases:
+            phases[name] /= total
+
+    median = sorted(latencies)[len(latencies) / 2]
+    return { "bytes": nbytes, "latencies": latencies, "median": median,
+             "min": min(latencies),
+             "throughput": median > 0 and nbytes / median or 0.0,
+             "peak_rss_kb": peak, "rss_delta_kb": peak - baseline,
+             "phases": phases }
+
+def result_key(result):
+    return "%s/%s" % (result["case"], format_size(result["size"]))
+
+def print_results(results, baseline = None):
+    old = dict()
+    if baseline != None:
+        old = dict([ (result_key(r), r) for r in baseline["results"] ])
+
+    sys.stdout.write("%-24s %5s %10s %10s %10s %10s%s\n" %
+                     ("case", "size", "median(ms)", "min(ms)", "MB/s",
+                      "rss(KB)", baseline != None and "     change" or ""))
+    for r in results:
+        size = r["size"] and format_size(r["size"]) or "-"
+        if "error" in r:
+            sys.stdout.write("%-24s %5s  error: %s\n" %
+                             (r["case"], size, r["error"]))
+            continue
+        sys.stdout.write("%-24s %5s %10.2f %10.2f %10.1f %10d" %
+                         (r["case"], size, r["median"] * 1000,
+                          r["min"] * 1000, r["throughput"] / 1048576,
+                          r["rss_delta_kb"]))
+        prev = old.get(result_key(r))
+        if prev != None and "median" in prev and prev["median"] > 0:
+            sys.stdout.write(" %+9.1f%%" %
+                             ((r["median"] / prev["median"] - 1) * 100))
+        elif baseline != None:
+            sys.stdout.write(" %10s" % "new")
+        sys.stdout.write("\n")
+
+    sys.stdout.write("\n%-24s %5s" % ("case", "size"))
+    phases = ("parse", "read", "tool", "output", "process")
+    for name in phases:
+        sys.stdout.write(" %8s" % name)
+    sys.stdout.write("\n")
+    for r in results:
+        if "error" in r or not r["phases"]:
+            continue
+        sys.stdout.write("%-24s %5s" %
+                         (r["case"], r["size"] and format_size(r["size"])
+                          or "-"))
+        for name in phases:
+            sys.stdout.write(" %7.1f%%" % (r["phases"].get(name, 0) * 100))
+        sys.stdout.write("\n")
+
+def usage():
+    sys.stderr.write(__doc__.split("\n\n")[1] + "\n")
+    sys.exit(2)
+
+def main(argv):
+    opts = { "sizes": DEFAULT_SIZES, "repeat": "3", "filter": None,
+             "save": None, "compare": None, "warm": False, "rss": None }
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--warm":
+            opts["warm"] = True
+        elif arg.startswith("--") and arg[2:] in opts and args:
+            opts[arg[2:]] = args.pop(0)
+        else:
+            usage()
+
+    sizes = [ parse_size(s) for s in opts["sizes"].split(",") ]
+    repeat = int(opts["repeat"])
+    baseline = None
+    if opts["compare"] != None:
+        with open(opts["compare"]) as f:
+            baseline = json.load(f)
+
+    # Keep the iconv encoding cache of the user intact.
+    os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix = "gdbx-bench-")
+
+    if opts["rss"] != None:
+        ballast = bytearray(parse_size(opts["rss"]))
+        # Touch every page.
+        ballast[::4096] = "x" * len(xrange(0, len(ballast), 4096))
+
+    define_types()
+    memories = [ Memory(i, size) for (i, size) in enumerate(sizes) ]
+    gdbx = imp.load_source("gdbx", GDBX_PATH)
+    # Process the whole regions, even of the 1G cases.
+    gdbx.MAX_BYTES = 0
+
+    results = list()
+    for case in CASES:
+        if opts["filter"] != None and not re.search(opts["filter"],
+                                                    case.name):
+            continue
+        if case.needs != None and not case.needs(gdbx):
+            sys.stderr.write("skipped %s\n" % case.name)
+            continue
+        for mem in case.sized and memories or memories[:1]:
+            results.append(run_case(gdbx, case, mem, repeat, opts["warm"]))
+            r = results[-1]
+            sys.stderr.write("%s/%s: %s\n" %
+                             (case.name, r["size"] and format_size(r["size"])
+                              or "-",
+                              "error" in r and r["error"] or
+                              "%.2f ms" % (r["median"] * 1000)))
+
+    sys.stdout.write("\n")
+    print_results(results, baseline)
+
+    if opts["save"] != None:
+        with open(opts["save"], "w") as f:
+            json.dump({ "time": time.time(), "python": platform.python_version(),
+                        "machine": platform.platform(), "sizes": sizes,
+                        "repeat": repeat, "warm": opts["warm"],
+                        "rss": opts["rss"],
+                        "results": results }, f, indent = 1, sort_keys = True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+# A stand-in for the gdb module, to run gdbx.py outside of gdb
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Fake 'gdb' module for bench_gdbx.py
+
+Only the parts of the gdb Python API that gdbx.py uses are provided.
+The inferior memory is a set of synthetic regions, see Region; their
+contents are generated on demand, so a region can be as large as 1 GB
+without holding it in memory.
+
+The commands are registered in 'commands' by name, and invoke() runs
+a command line as gdb would."""
+
+import sys
+import re
+import shlex
+
+COMMAND_NONE=-1
+COMMAND_RUNNING=0
+COMMAND_DATA=1
+COMMAND_STACK=2
+COMMAND_FILES=3
+COMMAND_SUPPORT=4
+COMMAND_STATUS=5
+COMMAND_BREAKPOINTS=6
+COMMAND_TRACEPOINTS=7
+COMMAND_OBSCURE=8
+COMMAND_MAINTENANCE=9
+COMMAND_USER=13
+
+COMPLETE_NONE=0
+COMPLETE_FILENAME=1
+COMPLETE_LOCATION=2
+COMPLETE_COMMAND=3
+COMPLETE_SYMBOL=4
+COMPLETE_EXPRESSION=5
+
+PARAM_BOOLEAN=0
+PARAM_AUTO_BOOLEAN=1
+PARAM_UINTEGER=2
+PARAM_INTEGER=3
+PARAM_STRING=4
+PARAM_STRING_NOESCAPE=5
+PARAM_OPTIONAL_FILENAME=6
+PARAM_FILENAME=7
+PARAM_ZINTEGER=8
+PARAM_ZUINTEGER=9
+PARAM_ZUINTEGER_UNLIMITED=10
+PARAM_ENUM=11
+
+TYPE_CODE_PTR=1
+TYPE_CODE_ARRAY=2
+TYPE_CODE_STRUCT=3
+TYPE_CODE_UNION=4
+TYPE_CODE_ENUM=5
+TYPE_CODE_INT=8
+TYPE_CODE_TYPEDEF=22
+
+class GdbError(RuntimeError):
+    pass
+
+class MemoryError(RuntimeError):
+    pass
+
+# All registered commands and parameters, by name
+commands = dict()
+
+class Command(object):
+    def __init__(self, name, command_class, completer_class = -1,
+                 prefix = False):
+        commands[name] = self
+
+    def dont_repeat(self):
+        pass
+
+class Parameter(object):
+    def __init__(self, name, command_class, parameter_class, *enum):
+        commands["set " + name] = self
+        self.value = None
+
+def invoke(line):
+    """invoke(line) - run the command LINE, the longest name matched"""
+    words = line.split(" ")
+    for n in xrange(len(words), 0, -1):
+        cmd = commands.get(" ".join(words[:n]))
+        if cmd != None and isinstance(cmd, Command):
+            return cmd.invoke(" ".join(words[n:]), False)
+    raise GdbError("Undefined command: \"%s\"." % words[0])
+
+class Region(object):
+    """Synthetic memory of SIZE bytes at BASE
+
+The contents are PREFIX, followed by UNIT repeated, followed by SUFFIX.
+The size of the repeated part is rounded down to a multiple of UNIT,
+so that the region is always a whole document (e.g. XML)."""
+    def __init__(self, base, size, unit, prefix = "", suffix = ""):
+        body = max(0, size - len(prefix) - len(suffix))
+        body -= body % len(unit)
+        self.base = base
+        self.prefix = prefix
+        self.unit = unit
+        self.suffix = suffix
+        self.body = body
+        self.size = len(prefix) + body + len(suffix)
+
+    def read(self, offset, length):
+        parts = list()
+        end = offset + length
+        lp = len(self.prefix)
+        if offset < lp:
+            parts.append(self.prefix[offset:min(end, lp)])
+        start = max(offset, lp)
+        stop = min(end, lp + self.body)
+        if start < stop:
+            lu = len(self.unit)
+            idx = (start - lp) % lu
+            count = stop - start
+            parts.append((self.unit * ((idx + count) / lu + 1))
+                         [idx:idx + count])
+        if end > lp + self.body:
+            parts.append(self.suffix[max(0, offset - lp - self.body):
+                                     end - lp - self.body])
+        return "".join(parts)
+
+# The regions of the inferior memory, see add_region()
+regions = list()
+# Memory written by Inferior.write_memory(), by address
+patches = dict()
+
+def add_region(base, size, unit, prefix = "", suffix = ""):
+    region = Region(base, size, unit, prefix, suffix)
+    regions.append(region)
+    regions.sort(key = lambda r: r.base)
+    return region
+
+def read(address, length):
+    for r in regions:
+        if r.base <= address < r.base + r.size:
+            if address + length > r.base + r.size:
+                break
+            data = r.read(address - r.base, length)
+            if patches:
+                data = bytearray(data)
+                for (addr, byte) in patches.iteritems():
+                    if address <= addr < address + length:
+                        data[addr - address] = byte
+                data = str(data)
+            return data
+    raise MemoryError("Cannot access memory at address 0x%x" % address)
+
+class Inferior(object):
+    num = 1
+    pid = 4242
+
+    def read_memory(self, address, length):
+        return buffer(read(int(address), int(length)))
+
+    def write_memory(self, address, data):
+        for (i, byte) in enumerate(bytearray(str(data))):
+            patches[int(address) + i] = byte
+
+    def threads(self):
+        return threads
+
+class InferiorThread(object):
+    """A thread whose variables LOCALS are added to 'symbols' by switch()"""
+    def __init__(self, num, locals):
+        self.num = num
+        self.locals = locals
+
+    def switch(self):
+        global _selected
+        _selected = self
+        symbols.update(self.locals)
+
+    def is_valid(self):
+        return True
+
+class Frame(object):
+    """The only frame of every thread"""
+    def older(self):
+        return None
+
+    def select(self):
+        pass
+
+    def is_valid(self):
+        return True
+
+threads = list()
+_inferior = Inferior()
+_selected = None
+
+def selected_inferior():
+    return _inferior
+
+def inferiors():
+    return [ _inferior ]
+
+def selected_thread():
+    return _selected or (threads and threads[0] or None)
+
+def newest_frame():
+    return Frame()
+
+def selected_frame():
+    return Frame()
+
+class EventRegistry(object):
+    def __init__(self):
+        self.handlers = list()
+
+    def connect(self, handler):
+        self.handlers.append(handler)
+
+    def disconnect(self, handler):
+        self.handlers.remove(handler)
+
+    def fire(self, event = None):
+        for handler in list(self.handlers):
+            handler(event)
+
+class events(object):
+    cont = EventRegistry()
+    stop = EventRegistry()
+    exited = EventRegistry()
+    new_objfile = EventRegistry()
+    memory_changed = EventRegistry()
+    inferior_call = EventRegistry()
+    before_prompt = EventRegistry()
+
+def post_event(func):
+    func()
+
+def write(string, stream = None):
+    sys.stdout.write(string)
+
+def flush(stream = None):
+    sys.stdout.flush()
+
+class Type(object):
+    def __init__(self, name, sizeof, code = TYPE_CODE_INT, target = None,
+                 fields = ()):
+        self.name = name
+        self.tag = name
+        self.sizeof = sizeof
+        self.code = code
+        self._target = target
+        self._fields = list(fields)
+
+    def target(self):
+        return self._target
+
+    def fields(self):
+        return self._fields
+
+    def range(self):
+        return (0, self.sizeof / self._target.sizeof - 1)
+
+    def strip_typedefs(self):
+        return self
+
+    def unqualified(self):
+        return self
+
+    def pointer(self):
+        return Type("%s *" % self.name, 8, TYPE_CODE_PTR, self)
+
+    def array(self, count):
+        return Type("%s [%d]" % (self.name, count), self.sizeof * count,
+                    TYPE_CODE_ARRAY, self)
+
+    def __str__(self):
+        return self.name
+
+class Field(object):
+    def __init__(self, name, type, bitpos):
+        self.name = name
+        self.type = type
+        self.bitpos = bitpos
+        self.bitsize = 0
+        self.artificial = False
+        self.is_base_class = False
+
+class Value(object):
+    def __init__(self, address, type, value = None):
+        self.address = address
+        self.type = type
+        self.dynamic_type = type
+        self.is_optimized_out = False
+        self._value = value
+
+    def __int__(self):
+        if self._value != None:
+            return self._value
+        if self.type.code == TYPE_CODE_PTR or self.type.code == TYPE_CODE_INT:
+            data = bytearray(read(self.address, self.type.sizeof))
+            return sum([ b << (8 * i) for (i, b) in enumerate(data) ])
+        return self.address
+
+    __long__ = __int__
+    __index__ = __int__
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for f in self.type.fields():
+                if f.name == key:
+                    return Value(self.address + f.bitpos / 8, f.type)
+            raise GdbError("There is no member named %s." % key)
+        if self.type.code == TYPE_CODE_ARRAY:
+            return Value(self.address + int(key) * self.type.target().sizeof,
+                         self.type.target())
+        if self.type.code == TYPE_CODE_PTR:
+            return Value(int(self) + int(key) * self.type.target().sizeof,
+                         self.type.target())
+        raise GdbError("cannot subscript something of type `%s'" % self.type)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def dereference(self):
+        return Value(int(self), self.type.target())
+
+    def cast(self, type):
+        return Value(self.address, type, self._value)
+
+    def __add__(self, n):
+        return Value(None, self.type, int(self) + int(n))
+
+    def __sub__(self, n):
+        return Value(None, self.type, int(self) - int(n))
+
+# The variables of the inferior, by name
+symbols = dict()
+
+types = dict()
+
+def lookup_type(name):
+    if name not in types:
+        raise GdbError("No type named %s." % name)
+    return types[name]
+
+def parse_and_eval(expr):
+    """Evaluate EXPR with the variables in 'symbols' as Python"""
+    expr = expr.strip()
+    if expr in symbols:
+        return symbols[expr]
+    expr = re.sub(r"->", ".", expr)
+    try:
+        value = eval(expr, { "__builtins__": None }, symbols)
+    except Exception as e:
+        raise GdbError("No symbol in current context: %s (%s)" % (expr, e))
+    if isinstance(value, Value):
+        return value
+    return Value(None, types.get("long", Type("long", 8)), int(value))
+
+def string_to_argv(args):
+    return shlex.split(args)
+
+def execute(command, from_tty = False, to_string = False):
+    """Run the gdb commands that gdbx.py uses: 'dump' and 'info proc'"""
+    m = re.match(r"dump\s+(\w+)\s+(memory|value)\s+(\S+)\s+(.*)$", command)
+    if m != None:
+        (format, kind, filename, args) = m.groups()
+        if kind == "memory":
+            (start, end) = args.split()
+            start = int(parse_and_eval(start))
+            length = int(parse_and_eval(end)) - start
+        else:
+            value = parse_and_eval(args)
+            if value.address == None:
+                raise GdbError("Attempt to take address of value "
+                               "not located in memory.")
+            (start, length) = (value.address, value.type.sizeof)
+        with open(filename, "wb") as f:
+            pos = 0
+            while pos < length:
+                size = min(1024 * 1024, length - pos)
+                f.write(read(start + pos, size))
+                pos += size
+        return ""
+
+    if command == "info proc mappings":
+        lines = [ "process %d" % _inferior.pid,
+                  "Mapped address spaces:", "",
+                  "%18s %18s %10s %10s objfile" %
+                  ("Start Addr", "End Addr", "Size", "Offset") ]
+        for r in regions:
+            lines.append("%#18x %#18x %#10x %#10x [synthetic]" %
+                         (r.base, r.base + r.size, r.size, 0))
+        out = "\n".join(lines) + "\n"
+        if to_string:
+            return out
+        sys.stdout.write(out)
+        return None
+
+    raise GdbError("Undefined command: \"%s\"." % command)
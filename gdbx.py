@@ -17,20 +17,131 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import time
+_load_start = time.time()
+
 import sys
+import os
 import locale
 import gdb
 import subprocess
 import tempfile
 import re
+import contextlib
+# Loaded by the modules above anyway; the other modules are imported by
+# the commands that use them, to keep loading gdbx.py cheap.
+import codecs
+import collections
+import select
+import errno
+import fcntl
+import threading
+import signal
+import struct
+import math
 
 HEXDUMP_PATH="/usr/bin/hexdump"
 ICONV_PATH="/usr/bin/iconv"
 XMLLINT_PATH="/usr/bin/xmllint"
 
+# Cache of the encoding list of iconv(1), rebuilt when ICONV_PATH changes
+ICONV_CACHE_PATH=os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                             os.path.expanduser("~/.cache")),
+                              "gdbx", "iconv-encodings.json")
+
+# Number of bytes that are read from the inferior memory at once
+MEMORY_CHUNK_SIZE=256 * 1024
+
+# Snapshots larger than this are kept in a memory-mapped temporary file
+SNAPSHOT_SPILL_SIZE=64 * 1024 * 1024
+# Maximum number of lines that 'hexdump diff' shows for a changed range
+DIFF_MAX_LINES=8
+# Maximum number of changed lines that 'hexdump watch' shows at a stop
+WATCH_MAX_LINES=32
+
+# The value and memory commands of hexdump, iconv, xmllint and jsonlint do
+# not process a region larger than this many bytes as a whole (0 for no
+# limit); they refuse it or sample it, see SAMPLING
+MAX_BYTES=256 * 1024 * 1024
+# What to do with a region over MAX_BYTES; "error" to refuse it, or
+# "head", "tail", or "stride" to process SAMPLE_BYTES bytes of it
+SAMPLING="error"
+# Number of bytes that are processed of a sampled region
+SAMPLE_BYTES=64 * 1024
+# Number of evenly spaced pieces of the "stride" sampling
+SAMPLE_PIECES=16
+
+# Maximum number of elements of the 'each' commands by default
+EACH_MAX=10000
+# The 'each' commands read the elements in batches of this many bytes
+EACH_BATCH_SIZE=4 * 1024 * 1024
+# Elements closer than this are read together by the 'each' commands
+EACH_MERGE_GAP=4096
+
+# Arrays of structures in a type are flattened for 'hexdump value ... ##
+# --fields' only if the type has at most this many fields in total
+LAYOUT_MAX_FIELDS=65536
+
+# Default block size of 'hexdump profile'
+PROFILE_BLOCK_SIZE=4096
+# 'hexdump profile' reads the memory in chunks of about this many bytes
+PROFILE_CHUNK_SIZE=1024 * 1024
+# Maximum number of ranges that 'hexdump profile' lists
+PROFILE_MAX_RANGES=100
+
+# Maximum number of matches that 'hexdump search' reports by default
+SEARCH_MAX_HITS=1000
+# Bytes shared by adjacent chunks, so that a regular expression match
+# shorter than this is found even if it crosses a chunk boundary
+SEARCH_OVERLAP=4096
+
+# How the data is passed to the external tools; "memfd" for an anonymous
+# memory file, "pipe" for the standard input, "file" for a temporary file
+TOOL_TRANSPORT="memfd"
+# Number of the helper processes that run the external tools, see
+# ToolPool; 0 runs every tool directly from gdb, which is as fast unless
+# gdb has a large address space
+POOL_SIZE=0
+# The Python interpreter that runs the helper processes
+POOL_PYTHON=(os.path.basename(sys.executable).startswith("python") and
+             sys.executable or "python")
+# Seconds to wait for a helper process to start
+POOL_TIMEOUT=5
+
+# Maximum number of bytes kept in the memory cache (0 to disable)
+MEMORY_CACHE_SIZE=64 * 1024 * 1024
+# The memory cache keeps the inferior memory in pages of this size
+MEMORY_PAGE_SIZE=4096
+
+# Encodings that 'iconv strings' looks for by default
+STRINGS_ENCODINGS=[ "#ascii", "#utf_8", "#utf_16le", "#utf_16be" ]
+# Minimum number of characters of a string for 'iconv strings'
+STRINGS_MIN=4
+# 'iconv strings' scans the memory in chunks of this many bytes
+STRINGS_CHUNK_SIZE=1024 * 1024
+# A string longer than this many bytes is reported in pieces
+STRINGS_MAX_RUN=64 * 1024
+# Maximum number of strings that 'iconv strings' reports by default
+STRINGS_MAX_HITS=10000
+
+# A finished background job shows at most this many bytes of its output
+JOB_OUTPUT_MAX=64 * 1024
+
+# Number of the latest runs per command kept for 'gdbx stats'
+STATS_SAMPLES=1000
+
+# Encoding aliases that 'iconv detect' tries (None for all encodings)
+DETECT_ENCODINGS=None
+# Number of encodings that 'iconv detect' shows by default
+DETECT_TOP=5
+# 'iconv detect' scores at most this many bytes from the start of the region
+DETECT_MAX_BYTES=4 * 1024 * 1024
+
 DEBUG=False
 
 DEBUG_FD=sys.stderr
+# If not None, the timing of every command is written as a JSON line
+STATS_FD=None
 def error(message):
     sys.stderr.write("error: %s\n" % message)
 
@@ -39,19 +150,357 @@ def debug(message):
         DEBUG_FD.write("debug: %s\n" % message)
         DEBUG_FD.flush()
 
-def set_debug_file(pathname):
-    global DEBUG_FD
+def set_debug_file(pathname, stats = False):
+    """set_debug_file(pathname[, stats]) - redirect the debug messages
+
+If STATS is True, the timing of every command is also written to the
+file as a JSON line, see 'gdbx stats'."""
+    global DEBUG_FD, STATS_FD
     DEBUG_FD = open(pathname, "w")
+    if stats:
+        STATS_FD = DEBUG_FD
     
+# Seconds spent to initialize each deferred backend, see 'lazy'
+INIT_TIMES=dict()
+
+class lazy(object):
+    """Decorator for an attribute which is computed on the first access
+
+The heavy parts of the commands (encoding tables, regular expressions,
+and so on) are created by a 'lazy' method, so that loading gdbx.py
+stays cheap, and only the commands actually used pay for them."""
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj == None:
+            return self
+        start = time.time()
+        value = self.func(obj)
+        name = "%s.%s" % (cls.__name__, self.func.__name__)
+        INIT_TIMES[name] = INIT_TIMES.get(name, 0) + time.time() - start
+        debug("lazy: %s is initialized" % name)
+        # The instance attribute hides this descriptor from now on.
+        obj.__dict__[self.func.__name__] = value
+        return value
+
+class CommandStats(object):
+    """Per-phase timing of the commands
+
+A command run is started by begin() and finished by end(), see
+'timed'.  In between, the code wraps each phase of the work with
+
+    with stats.phase("read"):
+        ...
+
+The phases are "parse", "read" (the inferior memory, including 'dump'),
+"tool" (the external tools), and "output" (the writes to the standard
+output, timed by wrapping sys.stdout).  The time of a nested phase is
+charged to the inner phase only, and the rest of the run is charged to
+"process".  The runs are aggregated per command for 'gdbx stats'."""
+
+    PHASES = ("parse", "read", "tool", "output", "process")
+
+    def __init__(self):
+        self.commands = collections.OrderedDict()
+        self.current = None
+        self.stack = list()
+
+    def clear(self):
+        self.commands.clear()
+
+    def begin(self, name):
+        self.current = { "command": name, "start": time.time(),
+                         "bytes": 0, "phases": dict() }
+        self.thread = threading.current_thread()
+        self.stack = list()
+        self.stdout = sys.stdout
+        sys.stdout = TimedOutput(sys.stdout, self)
+
+    def end(self):
+        run = self.current
+        if run == None:
+            return
+        sys.stdout = self.stdout
+        self.current = None
+        run["elapsed"] = time.time() - run["start"]
+        phases = run["phases"]
+        phases["process"] = max(0.0, run["elapsed"] - sum(phases.values()))
+
+        agg = self.commands.get(run["command"])
+        if agg == None:
+            agg = { "count": 0, "total": 0.0, "bytes": 0,
+                    "phases": dict.fromkeys(self.PHASES, 0.0),
+                    "samples": collections.deque(maxlen = STATS_SAMPLES) }
+            self.commands[run["command"]] = agg
+        agg["count"] += 1
+        agg["total"] += run["elapsed"]
+        agg["bytes"] += run["bytes"]
+        agg["samples"].append(run["elapsed"])
+        for (name, elapsed) in phases.iteritems():
+            agg["phases"][name] = agg["phases"].get(name, 0.0) + elapsed
+
+        if STATS_FD != None:
+            import json
+            STATS_FD.write(json.dumps(run, sort_keys = True) + "\n")
+            STATS_FD.flush()
+
+    @contextlib.contextmanager
+    def phase(self, name, nbytes = 0):
+        """Charge the time of the 'with' body to the phase NAME
+
+NBYTES is added to the bytes processed by the command, unless this
+phase is nested in another phase of the same name."""
+        if self.current == None or \
+           threading.current_thread() is not self.thread:
+            # Background jobs are not timed.
+            yield
+            return
+        outer = self.stack and self.stack[-1] or None
+        frame = [ name, 0.0 ]
+        self.stack.append(frame)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.stack.pop()
+            phases = self.current["phases"]
+            phases[name] = phases.get(name, 0.0) + elapsed - frame[1]
+            if outer != None:
+                outer[1] += elapsed
+            if nbytes and not [ f for f in self.stack if f[0] == name ]:
+                self.current["bytes"] += nbytes
+
+    def add_bytes(self, nbytes):
+        """Add NBYTES to the bytes processed by the current command"""
+        if self.current != None and \
+           threading.current_thread() is self.thread:
+            self.current["bytes"] += nbytes
+
+stats = CommandStats()
+
+class TimedOutput(object):
+    """File object wrapper that charges the writes to the "output" phase"""
+    def __init__(self, fileobj, stats):
+        self.fileobj = fileobj
+        self.stats = stats
+
+    def write(self, data):
+        with self.stats.phase("output"):
+            self.fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fileobj, name)
+
+def timed(invoke):
+    """Decorator for Command.invoke() to record the run in 'stats'
+
+The command is recorded under 'self.stats_name', or the class name."""
+    def wrapper(self, *args):
+        if stats.current != None or \
+           threading.current_thread().name != "MainThread":
+            # Called from another command, which is timed already.
+            return invoke(self, *args)
+        name = getattr(self, "stats_name", type(self).__name__)
+        stats.begin(name)
+        try:
+            return invoke(self, *args)
+        finally:
+            stats.end()
+    wrapper.__name__ = invoke.__name__
+    wrapper.__doc__ = invoke.__doc__
+    return wrapper
+
 def cmd_dump(filename, args, format="binary", type="value"):
     cmd = "dump %s %s %s %s" % (format, type, filename, args)
     debug("cmd_dump: executing '%s'..." % cmd )
     try:
-        gdb.execute(cmd)
-    except RuntimeError as e:
+        with stats.phase("read"):
+            gdb.execute(cmd)
+        stats.add_bytes(os.path.getsize(filename))
+    except (RuntimeError, OSError) as e:
         error("%s" % e)
         #raise
 
+def read_inferior(address, length):
+    """read_inferior(address, length) - read the inferior memory, uncached"""
+    with stats.phase("read", length):
+        return str(gdb.selected_inferior().read_memory(address, length))
+
+class MemoryCache(object):
+    """Page-granular LRU cache of the inferior memory
+
+The pages are kept until MEMORY_CACHE_SIZE bytes are held, then the
+least recently used pages are dropped.  A read larger than
+MEMORY_CHUNK_SIZE or the cache itself bypasses the cache, so that a
+bulk read neither copies the data page by page nor evicts the pages
+that the small reads reuse.  The whole cache is dropped when
+the inferior resumes or exits, and the pages overlapping a memory write
+from gdb are dropped, see connect()."""
+
+    def __init__(self):
+        self.pages = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.invalidations = 0
+
+    def clear(self):
+        self.pages.clear()
+        self.size = 0
+
+    def invalidate(self, event = None):
+        debug("memory cache: invalidated by %s" % type(event).__name__)
+        self.invalidations += 1
+        self.clear()
+
+    def invalidate_range(self, event):
+        psize = MEMORY_PAGE_SIZE
+        inferior = gdb.selected_inferior().num
+        address = int(event.address)
+        page = address - address % psize
+        while page < address + event.length:
+            data = self.pages.pop((inferior, page), None)
+            if data != None:
+                self.size -= len(data)
+            page += psize
+        self.invalidations += 1
+
+    def connect(self):
+        gdb.events.cont.connect(self.invalidate)
+        gdb.events.exited.connect(self.invalidate)
+        if hasattr(gdb.events, "memory_changed"):
+            gdb.events.memory_changed.connect(self.invalidate_range)
+        if hasattr(gdb.events, "inferior_call"):
+            gdb.events.inferior_call.connect(self.invalidate)
+
+    def insert(self, key, data):
+        self.pages[key] = data
+        self.size += len(data)
+        while self.size > MEMORY_CACHE_SIZE and self.pages:
+            (k, old) = self.pages.popitem(last = False)
+            self.size -= len(old)
+
+    def bypass(self, length):
+        """Returns True if a read of LENGTH bytes skips the cache"""
+        return MEMORY_CACHE_SIZE <= 0 or length > MEMORY_CACHE_SIZE or \
+               length > MEMORY_CHUNK_SIZE
+
+    def read(self, address, length):
+        """Read LENGTH bytes from ADDRESS through the cache"""
+        if length <= 0:
+            return read_inferior(address, length)
+        if self.bypass(length):
+            if MEMORY_CACHE_SIZE > 0:
+                self.uncached += 1
+            return read_inferior(address, length)
+
+        psize = MEMORY_PAGE_SIZE
+        inferior = gdb.selected_inferior().num
+        first = address - address % psize
+        end = address + length
+        parts = list()
+        page = first
+        while page < end:
+            key = (inferior, page)
+            data = self.pages.get(key)
+            if data != None:
+                self.hits += 1
+                del self.pages[key]
+                self.pages[key] = data
+                parts.append(data)
+                page += psize
+                continue
+
+            # Read all consecutive missing pages at once.
+            last = page + psize
+            while last < end and (inferior, last) not in self.pages:
+                last += psize
+            try:
+                data = read_inferior(page, last - page)
+            except gdb.MemoryError:
+                # The whole pages may not be readable (e.g. a section of
+                # a core file); read the requested bytes only.
+                self.uncached += 1
+                return read_inferior(address, length)
+            self.misses += (last - page) / psize
+            for pos in xrange(0, len(data), psize):
+                self.insert((inferior, page + pos), data[pos:pos + psize])
+            parts.append(data)
+            page = last
+
+        if len(parts) == 1:
+            data = parts[0]
+        else:
+            data = "".join(parts)
+        return data[address - first:address - first + length]
+
+memory_cache = MemoryCache()
+
+def read_memory(address, length):
+    """read_memory(address, length) - read the inferior memory
+
+Return LENGTH bytes from the memory of the selected inferior, starting
+from ADDRESS, as a string.  The memory is read through the memory
+cache, 'memory_cache'."""
+    with stats.phase("read", length):
+        return memory_cache.read(address, length)
+
+def iter_memory(address, length, chunk_size = None):
+    """iter_memory(address, length[, chunk_size]) - read the memory in chunks
+
+Generate tuples of (address, data) that cover LENGTH bytes from
+ADDRESS, each 'data' is at most CHUNK_SIZE bytes.  Only one chunk is
+held at a time, so the memory usage is bounded by CHUNK_SIZE however
+large LENGTH is.  If the whole region would not fit in the memory
+cache, the chunks are read around the cache."""
+    if chunk_size == None:
+        chunk_size = MEMORY_CHUNK_SIZE
+    read = read_memory
+    if memory_cache.bypass(length):
+        read = read_inferior
+    end = address + length
+    while address < end:
+        size = min(chunk_size, end - address)
+        yield (address, read(address, size))
+        address += size
+
+def proc_mappings():
+    """proc_mappings() - list the memory mappings of the inferior
+
+Returns a list of (start, end, objfile) of the readable mappings from
+'info proc mappings'.  If the output has no permission column, every
+mapping is assumed to be readable."""
+    out = gdb.execute("info proc mappings", False, True)
+    ret = list()
+    perms_column = None
+    for line in out.splitlines():
+        tokens = line.split()
+        if "Perms" in tokens:
+            perms_column = tokens.index("Perms") - 1
+            continue
+        if len(tokens) < 4 or not tokens[0].startswith("0x"):
+            continue
+        if perms_column != None and len(tokens) > perms_column and \
+           "r" not in tokens[perms_column]:
+            continue
+        objfile = len(tokens) > 4 and tokens[-1] or ""
+        ret.append((int(tokens[0], 16), int(tokens[1], 16), objfile))
+    return ret
+
+def value_address(value):
+    """value_address(value) - convert a gdb.Value into an address
+
+Arrays are converted to the address of their first element, like the
+way gdb treats them in an address expression."""
+    if value.type.strip_typedefs().code == gdb.TYPE_CODE_ARRAY and \
+       value.address != None:
+        return int(value.address)
+    return int(value)
+
 def set_default_encoding(encoding = None):
     """set_default_encoding(encoding) - set the default character encoding
 
@@ -86,9 +535,899 @@ On invalid encoding name, it returns False.  Otherwise returns True."""
         debug("Default encoding is %s" % defenc)
 
     
+def memfd_create(name):
+    """memfd_create(name) - create an anonymous memory file
+
+Returns the file descriptor, which is inherited by the child processes.
+Raises OSError if memfd_create(2) is not available."""
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "memfd_create"):
+        raise OSError(errno.ENOSYS, "memfd_create is not available")
+    fd = libc.memfd_create(name, 0)
+    if fd < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return fd
+
+def set_cloexec(fd):
+    """set_cloexec(fd) - close FD on exec(2) of the child processes"""
+    fcntl.fcntl(fd, fcntl.F_SETFD,
+                fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+class ToolInput(object):
+    """The data given to an external tool, according to TOOL_TRANSPORT
+
+Use it as a context manager.  'path' is the pathname that the tool
+should read, and feed() returns the chunks to write on the standard
+input of the tool, or None if the tool reads 'path' by itself.
+
+'source' is a sequence of the data chunks.  If it is a list, the input
+can be used several times, otherwise only once."""
+
+    def __init__(self, source, transport = None):
+        self.source = source
+        self.transport = transport or TOOL_TRANSPORT
+        self.path = None
+        self.tmp = None
+        self.fd = None
+
+    def __enter__(self):
+        if self.transport == "memfd":
+            try:
+                self.fd = memfd_create("gdbx")
+            except OSError as e:
+                debug("memfd transport is not available: %s" % e)
+                self.transport = "file"
+        if self.fd != None:
+            with os.fdopen(os.dup(self.fd), "wb") as f:
+                for chunk in self.source:
+                    f.write(chunk)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            # gdb's pid, so that the tools of ToolPool can open it too
+            self.path = "/proc/%d/fd/%d" % (os.getpid(), self.fd)
+            return self
+
+        if self.transport == "pipe":
+            self.path = "/dev/stdin"
+        else:
+            self.tmp = tempfile.NamedTemporaryFile(prefix="gdb-")
+            for chunk in self.source:
+                self.tmp.write(chunk)
+            self.tmp.flush()
+            self.path = self.tmp.name
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.fd != None:
+            os.close(self.fd)
+        if self.tmp != None:
+            self.tmp.close()
+        return False
+
+    def feed(self):
+        if self.transport != "pipe":
+            return None
+        return iter(self.source)
+
+def run_tool(cmdline, chunks = None, outfile = None, cancel = None):
+    """run_tool(cmdline[, chunks[, outfile[, cancel]]]) - run an external tool
+
+Run CMDLINE (a string for the shell or a list), writing the data
+CHUNKS (if not None) on its standard input.  The standard output is
+written to OUTFILE as soon as it is available; if OUTFILE is None, the
+output is collected instead.  Returns a tuple (status, output, error).
+
+The input, the output and the error are multiplexed with select(2) in
+the calling thread, so CHUNKS may read the inferior memory lazily.
+
+If CANCEL (a threading.Event) is set, or KeyboardInterrupt is raised,
+the tool is killed and KeyboardInterrupt is raised.
+
+The tool is run by a worker of the tool pool if possible, see ToolPool."""
+    with stats.phase("tool"):
+        pool = tool_pool()
+        if pool != None:
+            return pool.run([ (cmdline, chunks) ], outfile, cancel)[0]
+        return _run_tool(cmdline, chunks, outfile, cancel)
+
+def _run_tool(cmdline, chunks, outfile, cancel):
+    use_shell = type(cmdline) != list
+    debug("executing %s (shell=%s)" % (cmdline, use_shell))
+    # The tool gets its own process group, so that killing it also kills
+    # the children of the shell.
+    p = subprocess.Popen(cmdline, shell=use_shell, close_fds=False,
+                         stdin=chunks != None and subprocess.PIPE or None,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         preexec_fn=os.setpgrp)
+    outbuf = list()
+    errbuf = list()
+    readers = { p.stdout.fileno(): outbuf, p.stderr.fileno(): errbuf }
+    writer = None
+    pending = ""
+    if chunks != None:
+        writer = p.stdin.fileno()
+        fcntl.fcntl(writer, fcntl.F_SETFL,
+                    fcntl.fcntl(writer, fcntl.F_GETFL) | os.O_NONBLOCK)
+        chunks = iter(chunks)
+
+    try:
+        while readers or writer != None:
+            if cancel != None and cancel.is_set():
+                raise KeyboardInterrupt
+            (rlist, wlist, xlist) = \
+                select.select(readers.keys(), writer != None and [writer] or [],
+                              [], cancel != None and 0.1 or None)
+            for fd in rlist:
+                data = os.read(fd, 65536)
+                if not data:
+                    del readers[fd]
+                elif fd == p.stdout.fileno() and outfile != None:
+                    outfile.write(data)
+                else:
+                    readers[fd].append(data)
+
+            if wlist:
+                try:
+                    if not pending:
+                        pending = next(chunks, None)
+                    if pending == None:
+                        p.stdin.close()
+                        writer = None
+                    else:
+                        pending = pending[os.write(writer, pending):]
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        continue
+                    # EPIPE; the tool does not want more input.
+                    debug("run_tool: stop writing: %s" % e)
+                    p.stdin.close()
+                    writer = None
+    except BaseException:
+        debug("run_tool: killing %d" % p.pid)
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        p.wait()
+        raise
+
+    status = p.wait()
+    debug("exit status: %d" % status)
+    return (status, "".join(outbuf), "".join(errbuf))
+
+class ToolPool(object):
+    """Long-lived helper processes that run the external tools
+
+Forking gdb for every tool is slow when gdb has a large address space.
+Instead, a small launcher process is started once with POOL_PYTHON,
+and it forks the workers, which connect back to a Unix socket of gdb.
+A worker runs one tool at a time, relaying its standard input and
+output, and is reused for the next tool.  A worker that is killed with
+its tool is replaced by the launcher on demand.
+
+The messages are frames of a type byte, a 4-byte length and the data:
+
+  gdb to worker     'r' request; the command line, whether the tool
+                    reads the standard input, and the working directory
+                    and the environment if they changed since the last
+                    request to the worker, in JSON; 'i' input data;
+                    'c' end of the input
+  worker to gdb     'h' the worker pid; 'p' the tool pid; 'f' the errno
+                    of exec(2) if the tool cannot run; 'o' output;
+                    'e' error output; 's' the tool stopped reading the
+                    input; 'x' exit status
+
+run() runs many tools at once, one per free worker.  If the pool cannot
+be started, 'broken' is set, and the tools are run directly.
+
+The pool is opt-in: POOL_SIZE is 0 by default, and 'set gdbx pool-size'
+starts it.  It pays off with a large gdb; with 2 GB of private memory,
+four iconv(1) runs over 64 KB take 14 ms on the pool against 168 ms
+directly, but about the same (15 ms) in a small process."""
+
+    frame = struct.Struct(">cI")
+    # MSG_NOSIGNAL of Linux, not defined by the socket module of Python 2
+    MSG_NOSIGNAL = 0x4000
+
+    # The launcher and the workers; Python 2 and 3 compatible
+    source = r'''
+import os, sys, socket, struct, json, select, signal, errno, fcntl
+
+FRAME = struct.Struct(">cI")
+
+def cloexec(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+def send(sock, kind, data = b""):
+    sock.sendall(FRAME.pack(kind, len(data)) + data)
+
+class Frames(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b""
+        self.pos = 0
+
+    def parse(self):
+        start = self.pos + FRAME.size
+        if len(self.buf) < start:
+            return None
+        (kind, size) = FRAME.unpack_from(self.buf, self.pos)
+        if len(self.buf) < start + size:
+            return None
+        self.pos = start + size
+        return (kind, self.buf[start:self.pos])
+
+    def fill(self):
+        data = self.sock.recv(262144)
+        if not data:
+            sys.exit(0)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def next(self):
+        while True:
+            frame = self.parse()
+            if frame != None:
+                return frame
+            self.fill()
+
+def run(sock, frames, request):
+    # The strings are the bytes of gdb, decoded as Latin-1.
+    argv = request["argv"]
+    if isinstance(argv, list):
+        argv = [ a.encode("latin-1") for a in argv ]
+    else:
+        argv = [ b"/bin/sh", b"-c", argv.encode("latin-1") ]
+    env = dict([ (k.encode("latin-1"), v.encode("latin-1"))
+                 for (k, v) in request["env"].items() ])
+    stdin = None
+    if request["stdin"]:
+        (child_in, stdin) = os.pipe()
+    else:
+        child_in = os.open(os.devnull, os.O_RDONLY)
+    (out, child_out) = os.pipe()
+    (err, child_err) = os.pipe()
+    # The errno of exec(2) if it fails
+    (failed, child_failed) = os.pipe()
+    for fd in (out, err, stdin, failed, child_failed):
+        if fd != None:
+            cloexec(fd)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setpgrp()
+            signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+            os.chdir(request["cwd"].encode("latin-1"))
+            os.dup2(child_in, 0)
+            os.dup2(child_out, 1)
+            os.dup2(child_err, 2)
+            os.execvpe(argv[0], argv, env)
+        except OSError as e:
+            os.write(child_failed, str(e.errno).encode("ascii"))
+        os._exit(127)
+    for fd in (child_in, child_out, child_err, child_failed):
+        os.close(fd)
+    send(sock, b"p", str(pid).encode("ascii"))
+    data = os.read(failed, 64)
+    os.close(failed)
+    if data:
+        send(sock, b"f", data)
+    if stdin != None:
+        fcntl.fcntl(stdin, fcntl.F_SETFL,
+                    fcntl.fcntl(stdin, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    readers = [ out, err ]
+    pending = list()
+    size = 0
+    done = False
+    while True:
+        while not done:
+            frame = frames.parse()
+            if frame == None:
+                break
+            if frame[0] == b"c":
+                done = True
+            elif stdin != None:
+                pending.append(frame[1])
+                size += len(frame[1])
+        if stdin != None and done and not pending:
+            os.close(stdin)
+            stdin = None
+        if done and not readers:
+            break
+        rlist = list(readers)
+        if not done and size < 1024 * 1024:
+            rlist.append(sock)
+        wlist = stdin != None and pending and [ stdin ] or []
+        (rlist, wlist, xlist) = select.select(rlist, wlist, [])
+        for fd in rlist:
+            if fd is sock:
+                frames.fill()
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                readers.remove(fd)
+                os.close(fd)
+            else:
+                send(sock, fd == out and b"o" or b"e", data)
+        if wlist:
+            try:
+                n = os.write(stdin, pending[0])
+                size -= n
+                if n < len(pending[0]):
+                    pending[0] = pending[0][n:]
+                else:
+                    pending.pop(0)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    os.close(stdin)
+                    stdin = None
+                    (pending, size) = (list(), 0)
+                    if not done:
+                        send(sock, b"s")
+    status = os.waitpid(pid, 0)[1]
+    if os.WIFSIGNALED(status):
+        status = -os.WTERMSIG(status)
+    else:
+        status = os.WEXITSTATUS(status)
+    send(sock, b"x", str(status).encode("ascii"))
+
+def worker(path):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    cloexec(sock.fileno())
+    send(sock, b"h", str(os.getpid()).encode("ascii"))
+    frames = Frames(sock)
+    # The last request, with the working directory and the environment
+    # that are sent only when they change
+    request = dict()
+    while True:
+        (kind, data) = frames.next()
+        if kind == b"r":
+            request.update(json.loads(data.decode("latin-1")))
+            run(sock, frames, request)
+
+def launcher(path):
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        for i in range(int(line)):
+            if os.fork() == 0:
+                try:
+                    sys.stdin.close()
+                    worker(path)
+                finally:
+                    os._exit(0)
+
+launcher(sys.argv[1])
+'''
+
+    def __init__(self, size):
+        self.size = size
+        self.broken = False
+        self.lock = threading.Lock()
+        self.launcher = None
+        self.listener = None
+        self.dir = None
+        # All the workers, and the free ones
+        self.workers = list()
+        self.idle = list()
+
+    def start(self):
+        """Start the launcher; raises OSError or socket.error on failure"""
+        import socket
+        self.dir = tempfile.mkdtemp(prefix="gdbx-pool-")
+        path = os.path.join(self.dir, "socket")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(16)
+        self.listener.settimeout(POOL_TIMEOUT)
+        set_cloexec(self.listener.fileno())
+        with open(os.devnull, "r+b") as null:
+            self.launcher = subprocess.Popen([POOL_PYTHON, "-c", self.source,
+                                              path], stdin=subprocess.PIPE,
+                                             stdout=null, stderr=null,
+                                             close_fds=True)
+        # The tools run directly must not keep the launcher alive.
+        set_cloexec(self.launcher.stdin.fileno())
+        debug("tool pool: launcher %d" % self.launcher.pid)
+
+    def spawn(self):
+        """Start a worker, and wait for it to connect"""
+        import socket
+        self.launcher.stdin.write("1\n")
+        self.launcher.stdin.flush()
+        (sock, addr) = self.listener.accept()
+        set_cloexec(sock.fileno())
+        sock.settimeout(POOL_TIMEOUT)
+        data = ""
+        while len(data) < self.frame.size or \
+              len(data) < self.frame.size + \
+              self.frame.unpack_from(data)[1]:
+            more = sock.recv(4096)
+            if not more:
+                raise socket.error(errno.EPIPE, "the worker exited")
+            data += more
+        (kind, size) = self.frame.unpack_from(data)
+        worker = ToolWorker(sock, int(data[self.frame.size:
+                                           self.frame.size + size]))
+        sock.setblocking(0)
+        self.workers.append(worker)
+        debug("tool pool: worker %d" % worker.pid)
+        return worker
+
+    def acquire(self):
+        """Returns a free worker, or None if every worker is busy"""
+        import socket
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.broken or len(self.workers) >= self.size:
+                return None
+            try:
+                if self.launcher == None:
+                    self.start()
+                return self.spawn()
+            except (OSError, IOError, socket.error) as e:
+                error("cannot start the tool pool, running the tools "
+                      "directly: %s" % e)
+                self.broken = True
+                return None
+
+    def release(self, worker):
+        with self.lock:
+            if worker.lost or len(self.workers) > self.size:
+                self.discard(worker)
+            else:
+                self.idle.append(worker)
+
+    def discard(self, worker):
+        """Kill the worker, which is replaced on demand"""
+        try:
+            os.kill(worker.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        worker.sock.close()
+        if worker in self.workers:
+            self.workers.remove(worker)
+
+    def resize(self, size):
+        with self.lock:
+            self.size = size
+            while len(self.workers) > size and self.idle:
+                self.discard(self.idle.pop())
+
+    def run(self, requests, outfile = None, cancel = None):
+        """run(requests[, outfile[, cancel]]) - run the tools on the workers
+
+REQUESTS is a list of (cmdline, chunks) like the arguments of
+run_tool().  As many tools as the free workers run at once, and the
+rest as soon as a worker is free; if no worker is free at all, a tool
+is run directly.  Returns the list of (status, output, error) in the
+order of REQUESTS.  The output of a single tool is written to OUTFILE
+as it comes, if OUTFILE is not None.
+
+Raises OSError if a tool cannot run, as subprocess.Popen does."""
+        results = [ None ] * len(requests)
+        queue = collections.deque(enumerate(requests))
+        # The running tools by the socket
+        active = dict()
+        try:
+            while queue or active:
+                while queue:
+                    worker = self.acquire()
+                    if worker == None:
+                        break
+                    (index, (cmdline, chunks)) = queue.popleft()
+                    active[worker.sock.fileno()] = \
+                        ToolRun(worker, index, cmdline, chunks)
+                if not active:
+                    (index, (cmdline, chunks)) = queue.popleft()
+                    results[index] = _run_tool(cmdline, chunks, outfile,
+                                               cancel)
+                    continue
+                if cancel != None and cancel.is_set():
+                    raise KeyboardInterrupt
+                (rlist, wlist, xlist) = \
+                    select.select(active.keys(),
+                                  [ fd for (fd, run) in active.iteritems()
+                                    if run.writing() ],
+                                  [], cancel != None and 0.1 or None)
+                for fd in wlist:
+                    active[fd].write()
+                for fd in rlist:
+                    run = active[fd]
+                    if run.read(outfile):
+                        debug("exit status: %d" % run.status)
+                        results[run.index] = run.failed or \
+                            (run.status, "".join(run.out), "".join(run.err))
+                        del active[fd]
+                        self.release(run.worker)
+        except BaseException:
+            for run in active.itervalues():
+                debug("tool pool: killing %s" % run.pid)
+                run.kill()
+                with self.lock:
+                    self.discard(run.worker)
+            raise
+        for result in results:
+            if isinstance(result, OSError):
+                raise result
+        return results
+
+    def close(self):
+        with self.lock:
+            for worker in list(self.workers):
+                self.discard(worker)
+            self.idle = list()
+            if self.launcher != None:
+                self.launcher.stdin.close()
+                self.launcher.wait()
+                self.launcher = None
+            if self.listener != None:
+                self.listener.close()
+                self.listener = None
+            if self.dir != None:
+                import shutil
+                shutil.rmtree(self.dir, True)
+                self.dir = None
+
+class ToolWorker(object):
+    """A worker of ToolPool, connected by 'sock'"""
+    def __init__(self, sock, pid):
+        self.sock = sock
+        self.pid = pid
+        # True if the worker exited
+        self.lost = False
+        # The working directory and the environment the worker has
+        self.cwd = None
+        self.env = None
+
+class ToolRun(object):
+    """A tool running on a worker of ToolPool, see ToolPool.run()"""
+    def __init__(self, worker, index, cmdline, chunks):
+        debug("executing %s (worker %d)" % (cmdline, worker.pid))
+        self.worker = worker
+        self.index = index
+        import json
+        request = { "argv": cmdline, "stdin": chunks != None }
+        cwd = os.getcwd()
+        if cwd != worker.cwd:
+            request["cwd"] = worker.cwd = cwd
+        if os.environ != worker.env:
+            request["env"] = worker.env = dict(os.environ)
+        request = json.dumps(request, encoding="latin-1")
+        self.wbuf = self.frame("r", request)
+        self.pos = 0
+        # The input chunks to send; None once 'c' is queued
+        self.chunks = None
+        if chunks != None:
+            self.chunks = iter(chunks)
+        else:
+            self.wbuf += self.frame("c")
+        self.rbuf = ""
+        self.pid = None
+        # OSError if the tool cannot run
+        self.failed = None
+        self.out = list()
+        self.err = list()
+        self.status = None
+
+    def frame(self, kind, data = ""):
+        return ToolPool.frame.pack(kind, len(data)) + data
+
+    def writing(self):
+        return self.pos < len(self.wbuf) or self.chunks != None
+
+    def write(self):
+        import socket
+        if self.pos >= len(self.wbuf):
+            chunk = next(self.chunks, None)
+            if chunk == None:
+                self.wbuf = self.frame("c")
+                self.chunks = None
+            else:
+                self.wbuf = self.frame("i", chunk)
+            self.pos = 0
+        try:
+            self.pos += self.worker.sock.send(buffer(self.wbuf, self.pos),
+                                              ToolPool.MSG_NOSIGNAL)
+        except socket.error as e:
+            if e.errno == errno.EAGAIN:
+                return
+            # The worker exited; read() finds it out.
+            (self.wbuf, self.pos, self.chunks) = ("", 0, None)
+
+    def read(self, outfile):
+        """Read the frames from the worker; returns True once the tool exits"""
+        import socket
+        try:
+            data = self.worker.sock.recv(65536)
+        except socket.error as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            data = ""
+        if not data:
+            self.worker.lost = True
+            self.err.append("gdbx: the tool worker %d exited\n" %
+                            self.worker.pid)
+            self.status = -signal.SIGKILL
+            return True
+        self.rbuf += data
+        size = ToolPool.frame.size
+        while len(self.rbuf) >= size:
+            (kind, length) = ToolPool.frame.unpack_from(self.rbuf)
+            if len(self.rbuf) < size + length:
+                break
+            data = self.rbuf[size:size + length]
+            self.rbuf = self.rbuf[size + length:]
+            if kind == "o":
+                if outfile != None:
+                    outfile.write(data)
+                else:
+                    self.out.append(data)
+            elif kind == "e":
+                self.err.append(data)
+            elif kind == "p":
+                self.pid = int(data)
+            elif kind == "f":
+                e = int(data)
+                self.failed = OSError(e, os.strerror(e))
+            elif kind == "s":
+                # The tool does not want more input.
+                if self.chunks != None:
+                    self.chunks = None
+                    if self.pos >= len(self.wbuf):
+                        (self.wbuf, self.pos) = (self.frame("c"), 0)
+                    else:
+                        self.wbuf += self.frame("c")
+            elif kind == "x":
+                self.status = int(data)
+                return True
+        return False
+
+    def kill(self):
+        if self.pid != None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+# The pool of the external tools, see tool_pool()
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+
+def tool_pool():
+    """tool_pool() - returns the ToolPool, or None to run the tools directly"""
+    global _tool_pool
+    if POOL_SIZE == 0:
+        return None
+    with _tool_pool_lock:
+        if _tool_pool == None:
+            import atexit
+            _tool_pool = ToolPool(POOL_SIZE)
+            atexit.register(close_tool_pool)
+    if _tool_pool.size != POOL_SIZE:
+        _tool_pool.resize(POOL_SIZE)
+    if _tool_pool.broken:
+        return None
+    return _tool_pool
+
+def close_tool_pool():
+    """close_tool_pool() - stop the workers of the tool pool"""
+    if _tool_pool != None:
+        _tool_pool.close()
+
+def run_tools(requests, cancel = None):
+    """run_tools(requests[, cancel]) - run external tools at once
+
+REQUESTS is a list of (cmdline, chunks) like the arguments of
+run_tool().  The tools run in parallel on the workers of the tool pool,
+and the results are returned as a list of (status, output, error) in
+the order of REQUESTS.  Without the tool pool, the tools run one after
+another."""
+    with stats.phase("tool"):
+        pool = tool_pool()
+        if pool != None:
+            return pool.run(requests, None, cancel)
+        return [ _run_tool(cmdline, chunks, None, cancel)
+                 for (cmdline, chunks) in requests ]
+
+def run_tool_batch(cmdlines, cancel = None):
+    """run_tool_batch(cmdlines[, cancel]) - run many tools in a single run
+
+CMDLINES is a list of the command lines (a string for the shell or a
+list) of the tools that read their input from files.  Instead of
+starting a process per tool, a single shell script runs them one after
+another, and saves the output, the error and the exit status of each
+tool into its own temporary file.  Generates (status, output, error)
+of each tool in the order of CMDLINES, reading the files one by one,
+so that only one output is held at a time."""
+    import pipes
+    import shutil
+    tmpdir = tempfile.mkdtemp(prefix="gdbx-batch-")
+    try:
+        script = os.path.join(tmpdir, "run.sh")
+        with open(script, "w") as f:
+            for (i, cmdline) in enumerate(cmdlines):
+                if type(cmdline) == list:
+                    cmdline = " ".join([ pipes.quote(a) for a in cmdline ])
+                path = pipes.quote(os.path.join(tmpdir, "%d" % i))
+                f.write("{ %s\n} </dev/null >%s.out 2>%s.err\n"
+                        "echo $? >%s.status\n" % (cmdline, path, path, path))
+        (shell_status, dummy, shell_err) = run_tool([ "/bin/sh", script ],
+                                                    None, None, cancel)
+        for i in xrange(len(cmdlines)):
+            path = os.path.join(tmpdir, "%d" % i)
+            try:
+                with open(path + ".status") as f:
+                    status = int(f.read())
+                with open(path + ".out", "rb") as f:
+                    out = f.read()
+                with open(path + ".err", "rb") as f:
+                    err = f.read()
+            except (IOError, ValueError):
+                # The shell did not get to this tool.
+                yield (shell_status or -1, "", shell_err)
+                continue
+            yield (status, out, err)
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+class Job(object):
+    """A command running in the background, see start_job()
+
+The output of the job is written to 'out', a temporary file, and the
+job stops as soon as possible once 'cancel' is set."""
+    def __init__(self, num, command, func, cleanup = None):
+        self.num = num
+        self.command = command
+        self.func = func
+        self.cleanup = cleanup
+        self.state = "Running"
+        self.started = time.time()
+        self.finished = None
+        self.done = 0
+        self.total = 0
+        # The start of the whole region when the job has only a part of it
+        self.origin = None
+        self.cancel = threading.Event()
+        self.out = tempfile.NamedTemporaryFile(prefix="gdbx-job-")
+        self.thread = threading.Thread(target = self.run,
+                                       name = "gdbx job %d" % num)
+        self.thread.daemon = True
+
+    def reader(self, address, data):
+        """Returns a reader of 'data' like data_reader(), which counts the
+progress of the job and stops when the job is cancelled."""
+        read = data_reader(address, data)
+        def reader(start, length):
+            self.total = length
+            for (addr, chunk) in read(start, length):
+                if self.cancel.is_set():
+                    raise KeyboardInterrupt
+                yield (addr, chunk)
+                self.done += len(chunk)
+        return reader
+
+    def iterate(self, items):
+        """Generate 'items' until the job is cancelled"""
+        self.total = len(items)
+        for item in items:
+            if self.cancel.is_set():
+                raise KeyboardInterrupt
+            yield item
+            self.done += 1
+
+    def run(self):
+        try:
+            self.func(self)
+            self.state = self.cancel.is_set() and "Killed" or "Done"
+        except KeyboardInterrupt:
+            self.state = "Killed"
+        except Exception as e:
+            self.out.write("error: %s\n" % e)
+            self.state = "Failed"
+        finally:
+            self.out.flush()
+            self.finished = time.time()
+            if self.cleanup != None:
+                self.cleanup()
+            gdb.post_event(self.report)
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def output(self, limit = -1):
+        with open(self.out.name, "rb") as f:
+            return f.read(limit)
+
+    def status(self):
+        progress = ""
+        if self.state == "Running" and self.total > 0:
+            progress = " %3d%%" % (self.done * 100 / self.total)
+        return "[%d] %-7s %8.1fs%s  %s" % (self.num, self.state,
+                                           self.elapsed(), progress,
+                                           self.command)
+
+    def report(self):
+        """Show the result of the job; called in the main thread"""
+        size = os.path.getsize(self.out.name)
+        sys.stdout.write("\n%s\n" % self.status())
+        sys.stdout.write(self.output(JOB_OUTPUT_MAX))
+        if size > JOB_OUTPUT_MAX:
+            sys.stdout.write("\n[%d] %d more bytes, see 'gdbx jobs %d'\n" %
+                             (self.num, size - JOB_OUTPUT_MAX, self.num))
+        sys.stdout.flush()
+
+    def close(self):
+        self.out.close()
+
+# The background jobs by number, see start_job()
+jobs = collections.OrderedDict()
+
+def start_job(command, func, cleanup = None):
+    """start_job(command, func[, cleanup]) - run FUNC in the background
+
+FUNC is called with the Job in a worker thread, so it must not use the
+gdb API at all; all the data must be captured before.  CLEANUP is
+called in the worker thread after FUNC returns.  When the job is
+finished, the result is shown through gdb.post_event()."""
+    num = jobs and max(jobs.iterkeys()) + 1 or 1
+    job = Job(num, command, func, cleanup)
+    jobs[num] = job
+    job.thread.start()
+    sys.stdout.write("[%d] %s\n" % (num, command))
+    return job
+
+def split_background(args):
+    """Returns (args, True) if ARGS ends with '&', otherwise (args, False)"""
+    args = args.rstrip()
+    if args.endswith("&"):
+        return (args[:-1].rstrip(), True)
+    return (args, False)
+
+def sample_region(address, length):
+    """sample_region(address, length) - apply MAX_BYTES and SAMPLING
+
+Returns a list of (address, length) of the parts of the region to
+process, which is the whole region if it is within MAX_BYTES.  Raises
+RuntimeError if the region is over MAX_BYTES, and SAMPLING is "error".
+Nothing is read from the inferior."""
+    if MAX_BYTES == 0 or length <= MAX_BYTES:
+        return [ (address, length) ]
+    if SAMPLING == "error":
+        raise RuntimeError("%d bytes (0x%x-0x%x) is over the limit of %d "
+                           "bytes; see 'help set gdbx max-bytes'" %
+                           (length, address, address + length, MAX_BYTES))
+    size = min(SAMPLE_BYTES, MAX_BYTES)
+    if SAMPLING == "head":
+        return [ (address, size) ]
+    if SAMPLING == "tail":
+        return [ (address + length - size, size) ]
+    pieces = max(1, min(SAMPLE_PIECES, size))
+    piece = size / pieces
+    if pieces == 1:
+        return [ (address, piece) ]
+    step = (length - piece) / (pieces - 1)
+    return [ (address + i * step, piece) for i in xrange(pieces) ]
+
 class GdbDumpParent(gdb.Command):
+    # True if the command can run in the background, see process_job()
+    background = False
+    # True if the regions over MAX_BYTES are refused or sampled
+    sampling = False
+    # The start of the whole region while its parts are processed, so
+    # that process() knows the offset of a part, see sample()
+    origin = None
+
     def __init__(self, name, completer = -1, prefix = False):
         gdb.Command.__init__(self, name, gdb.COMMAND_DATA, completer, prefix)
+        self.stats_name = name
 
     def parse_arguments(self, args):
         """parse the command arguments into two group; gdb dump
@@ -113,24 +1452,16 @@ one or more string values."""
 
         return []
     
-    def execute(self, filename, args):
+    def execute(self, filename, args, chunks = None):
+        """execute(filename, args[, chunks]) -- run the shell command.
+
+'filename' is the pathname for the command to read the data from.  If
+'chunks' is not None, the data chunks are written to the standard
+input of the command.  The output is written as it comes."""
         cmdline = self.commandline(filename, args)
-        if type(cmdline) != list:
-            use_shell = True
-        else:
-            use_shell = False
-        debug("type of cmdline: %s" % type(cmdline))
-        debug("excuting %s (shell=%s)" % (cmdline, use_shell))
-        p = subprocess.Popen(cmdline,
-                             shell=use_shell,
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (out, err) = p.communicate()
-        status = p.wait()
-
-        sys.stdout.write(out)
+        (status, out, err) = run_tool(cmdline, chunks, sys.stdout)
         if err != "":
             sys.stdout.write(err)
-        debug("exit status: %d" % status)
         return True
 
     def dump(self, filename, args):
@@ -139,23 +1470,216 @@ one or more string values."""
 
     def on_execute_error(self):
         pass
-    
+
+    def region(self, args):
+        """region(args) -- locate the data in the inferior memory.
+
+'args' is the gdb dump arguments.  Returns a tuple (address, length)
+of the data, or None if the data does not reside in the inferior
+memory."""
+        return None
+
+    def estimate(self, args):
+        """estimate(args) -- return the size of the data that is dumped.
+
+This is for the data that is not in the inferior memory, see
+region()."""
+        return 0
+
+    def check_dump(self, dump_args):
+        """Refuse to dump the data over MAX_BYTES, which cannot be sampled"""
+        if self.sampling and MAX_BYTES != 0:
+            size = self.estimate(dump_args)
+            if size > MAX_BYTES:
+                raise RuntimeError("%s: %d bytes is over the limit of %d "
+                                   "bytes; see 'help set gdbx max-bytes'" %
+                                   (self.stats_name, size, MAX_BYTES))
+
+    def parts(self, region):
+        """Returns the parts of the region to process, see sample_region()"""
+        try:
+            return sample_region(region[0], region[1])
+        except RuntimeError as e:
+            raise RuntimeError("%s: %s" % (self.stats_name, e))
+
+    def sample(self, region, func):
+        """sample(region, func) -- call func(address, length) on the region.
+
+If the region is over MAX_BYTES, 'func' is called for each part of it
+chosen by SAMPLING instead, with a header, and the skipped ranges are
+shown.  'origin' is set to the start of the region meanwhile.  Returns
+False if any of the calls returns False."""
+        (start, length) = region
+        self.origin = start
+        if not self.sampling:
+            return func(start, length)
+        parts = self.parts(region)
+        if len(parts) == 1 and parts[0] == region:
+            return func(start, length)
+        sys.stdout.write("%s: %d bytes (0x%x-0x%x) is over the limit of %d "
+                         "bytes, %s sampling\n" %
+                         (self.stats_name, length, start, start + length,
+                          MAX_BYTES, SAMPLING))
+        ok = True
+        pos = start
+        for (num, (address, size)) in enumerate(parts):
+            if pos < address:
+                sys.stdout.write("--- skipped 0x%x-0x%x (%d bytes) ---\n" %
+                                 (pos, address, address - pos))
+            sys.stdout.write("==> %s %d/%d: 0x%x-0x%x, %d bytes <==\n" %
+                             (SAMPLING, num + 1, len(parts), address,
+                              address + size, size))
+            sys.stdout.flush()
+            if not func(address, size):
+                ok = False
+            pos = address + size
+        if pos < start + length:
+            sys.stdout.write("--- skipped 0x%x-0x%x (%d bytes) ---\n" %
+                             (pos, start + length, start + length - pos))
+        return ok
+
+    def offset(self, address, job = None):
+        """offset(address[, job]) -- return the offset of ADDRESS in the region.
+
+This is 0 unless ADDRESS is of a sampled part of the region, which is
+processed by 'job' if it is not None."""
+        origin = self.origin
+        if job != None:
+            origin = job.origin
+        if origin == None:
+            return 0
+        return address - origin
+
+    def native(self, args):
+        """native(args) -- return True if the data can be processed in-process.
+
+'args' is the execute arguments.  If this returns True, the data is
+read directly from the inferior memory and passed to self.process()
+instead of running the shell command."""
+        return False
+
+    def process(self, address, length, args):
+        """process(address, length, args) -- process the data in-process.
+
+'address' and 'length' describe the data in the inferior memory, and
+'args' is the execute arguments."""
+        debug("Never reached here!!!")
+        return True
+
+    def process_job(self, job, address, data, args):
+        """process_job(job, address, data, args) -- process the data in a job.
+
+'data' is the data captured from 'address' (0 if the data is not in
+the inferior memory), and 'args' is the execute arguments.  This runs
+in a worker thread, so it must not use the gdb API; the output goes to
+'job.out'.  This runs the shell command; override it to process the
+data in-process."""
+        chunks = (chunk for (addr, chunk)
+                  in job.reader(address, data)(address, len(data)))
+        with ToolInput(chunks) as inp:
+            cmdline = self.commandline(inp.path, args)
+            (status, out, err) = run_tool(cmdline, inp.feed(), job.out,
+                                          job.cancel)
+            job.out.write(err)
+
+    def job_args(self, args):
+        """job_args(args) -- return the arguments of process_job().
+
+This runs in the main thread before the job starts; override it to
+resolve whatever needs gdb or the shared state from the execute
+arguments 'args', so that process_job() does not."""
+        return args
+
+    def invoke_background(self, args, dump_args, exec_args):
+        """Capture the data now, then process it by a background job"""
+        if not self.background:
+            raise RuntimeError("%s: cannot run in the background" %
+                               self.stats_name)
+        exec_args = self.job_args(exec_args)
+        region = self.region(dump_args)
+        origin = None
+        if region == None:
+            self.check_dump(dump_args)
+            tmp = tempfile.NamedTemporaryFile(prefix="gdb-")
+            self.dump(tmp.name, dump_args)
+            size = os.path.getsize(tmp.name)
+            (address, data) = (0, "")
+            if size > 0:
+                import mmap
+                data = mmap.mmap(tmp.fileno(), size, access=mmap.ACCESS_READ)
+            def cleanup():
+                if size > 0:
+                    data.close()
+                tmp.close()
+        else:
+            origin = region[0]
+            if self.sampling:
+                parts = self.parts(region)
+                if len(parts) > 1:
+                    raise RuntimeError("%s: stride sampling cannot run in "
+                                       "the background" % self.stats_name)
+                if parts[0] != region:
+                    sys.stdout.write("%s: %d bytes is over the limit of %d "
+                                     "bytes, only 0x%x-0x%x (%s)\n" %
+                                     (self.stats_name, region[1], MAX_BYTES,
+                                      parts[0][0], parts[0][0] + parts[0][1],
+                                      SAMPLING))
+                region = parts[0]
+            snap = Snapshot("job", region[0], region[1],
+                            region[1] > SNAPSHOT_SPILL_SIZE)
+            snap.capture()
+            (address, data) = (region[0], snap.view(0, region[1]))
+            cleanup = snap.close
+        def run(job):
+            job.origin = origin
+            return self.process_job(job, address, data, exec_args)
+        start_job("%s %s" % (self.stats_name, args), run, cleanup)
+
+    def invoke_tool(self, dump_args, exec_args):
+        region = self.region(dump_args)
+        if region == None:
+            self.check_dump(dump_args)
+            # Only gdb 'dump' can save the value, which needs a file.
+            with tempfile.NamedTemporaryFile(prefix="gdb-") as tmp:
+                self.dump(tmp.name, dump_args)
+                ok = self.execute(tmp.name, exec_args)
+        else:
+            ok = self.sample(region, lambda address, length:
+                             self.execute_region(address, length, exec_args))
+        if not ok:
+            self.on_execute_error()
+
+    def execute_region(self, address, length, exec_args):
+        chunks = (data for (addr, data) in iter_memory(address, length))
+        with ToolInput(chunks) as inp:
+            return self.execute(inp.path, exec_args, inp.feed())
+
+    @timed
     def invoke(self, args, from_tty):
-        with tempfile.NamedTemporaryFile(prefix="gdb-") as tmp:
-        #tmp = tempfile.NamedTemporaryFile(prefix="gdb-")
-        #if True:
-            try:
+        try:
+            (args, background) = split_background(args)
+            with stats.phase("parse"):
                 (dump_args, exec_args) = self.parse_arguments(args)
-                debug("dump_args: |%s|" % dump_args)
-                debug("exec_args: |%s|" % exec_args)
-                self.dump(tmp.name, dump_args)
-                if not self.execute(tmp.name, exec_args):
-                    self.on_execute_error()
-            except RuntimeError as e:
-                print e
-            except:
-                sys.stderr.write("error: an exception occurred during excution")
-                raise
+            debug("dump_args: |%s|" % dump_args)
+            debug("exec_args: |%s|" % exec_args)
+            if background:
+                self.invoke_background(args, dump_args, exec_args)
+                return
+            if self.native(exec_args):
+                region = self.region(dump_args)
+                if region != None:
+                    if not self.sample(region, lambda address, length:
+                                       self.process(address, length,
+                                                    exec_args)):
+                        self.on_execute_error()
+                    return
+                debug("no address for '%s', falling back to dump" % dump_args)
+            self.invoke_tool(dump_args, exec_args)
+        except RuntimeError as e:
+            print e
+        except:
+            sys.stderr.write("error: an exception occurred during excution")
+            raise
             
 class GdbDumpValueParent(GdbDumpParent):
     def __init__(self, name, completer = -1, prefix = False):
@@ -163,6 +1687,15 @@ class GdbDumpValueParent(GdbDumpParent):
 
     def dump(self, filename, args):
         cmd_dump(filename, args, format="binary", type="value")
+
+    def region(self, args):
+        value = gdb.parse_and_eval(args)
+        if value.address == None:
+            return None
+        return (int(value.address), value.type.sizeof)
+
+    def estimate(self, args):
+        return gdb.parse_and_eval(args).type.sizeof
         
 class GdbDumpMemoryParent(GdbDumpParent):
     def __init__(self, name, completer = -1, prefix = False):
@@ -171,75 +1704,754 @@ class GdbDumpMemoryParent(GdbDumpParent):
     def dump(self, filename, args):
         cmd_dump(filename, args, format="binary", type="memory")
 
-
-class HexdumpCommand(gdb.Command):
-    """Dump the given data using hexdump(1)"""
-    def __init__(self):
-        gdb.Command.__init__(self, "hexdump", gdb.COMMAND_DATA, -1, True)
+    def region(self, args):
+        # Like gdb 'dump memory', START_ADDR ends at the first blank,
+        # and the rest is END_ADDR.
+        args = args.strip()
+        m = re.search(r"[ \t]", args)
+        if m == None:
+            raise RuntimeError("Missing stop address.")
+        start = value_address(gdb.parse_and_eval(args[:m.start()]))
+        end = value_address(gdb.parse_and_eval(args[m.end():]))
+        if end < start:
+            raise RuntimeError("Invalid memory address range (start >= end).")
+        return (start, end - start)
 
-class HexdumpImpl(object):
-    def parse_argument(self, args):
-        idx = args.find("##")
-        if idx < 0:
-            debug("hexdump impl parse args: |%s|, |%s|" % (args, ""))
-            return (args, "")
-        else:
-            debug("hexdump impl parse args: |%s|, |%s|" % (args[:idx].strip(), args[idx+2:].strip()))
-            return (args[:idx].strip(), args[idx+2:].strip())
+class BatchImpl(object):
+    """Resolve many values at once for the 'each' commands
 
-    def commandline(self, filename, args):
-        if args == "":
-            return [HEXDUMP_PATH, "-C", filename]
-        else:
-            return "%s %s %s" % (HEXDUMP_PATH, args, filename)
+The elements are given as either an array slice or a linked list:
 
-    def complete(self, text, word):
-        if text.find("##") < 0:
-            return gdb.COMPLETE_SYMBOL
-        else:
-            return gdb.COMPELTE_NONE
-        
-class HexdumpValueCommand(GdbDumpValueParent):
-    """Dump the value EXPR using hexdump(1)
+  EXPR[LO..HI][SUFFIX]      elements EXPR[LO] through EXPR[HI], each
+                            followed by SUFFIX, e.g. msgs[0..99].buf
+  --list HEAD NEXT          the nodes from the pointer HEAD, following
+                            the pointer member NEXT, until NULL
 
-usage: hexdump value EXPR [## OPTION...]
+followed by these options:
 
-Dump the value, EXPR using hexdump(1).  If no OPTION is provided, '-C'
-is assumed (canonnical hex+ASCII display).  If provided, OPTION is
-passed to hexdump(1).  Note that you need '##' to separate EXPR from
-OPTION.
+  --field NAME              use the member NAME of each list node
+  --size N                  dump N bytes at each element that is a
+                            pointer, instead of the pointed object
+  --max N                   stop after N elements (default: EACH_MAX)
 
-For example, to dump the value, 'buffer' using hexdump(1) '-C':
+The addresses and the sizes of all elements are resolved first.  Then,
+the memory is read in batches of up to EACH_BATCH_SIZE bytes, where
+each batch is sorted by address and the neighbouring elements are read
+together with a single read."""
 
-    (gdb) hexdump value buffer
+    re_slice = re.compile(r"^(.*?)\[([^\[\]]+?)\.\.([^\[\]]+?)\](.*)$")
 
-To dump the value, 'buffer' in one-byte octal display:
+    def parse_batch(self, args):
+        """Returns (element spec, options, tool arguments)"""
+        (spec, sep, tool_args) = args.partition("##")
+        opts = { "field": None, "size": None, "max": EACH_MAX }
+        for name in ("field", "size", "max"):
+            m = re.search(r"(^|\s)--%s(?:\s+|=)(\S+)" % name, spec)
+            if m != None:
+                opts[name] = m.group(2)
+                if name != "field":
+                    opts[name] = int(gdb.parse_and_eval(m.group(2)))
+                spec = spec[:m.start()] + spec[m.end():]
+        return (spec.strip(), opts, tool_args.strip())
 
-    (gdb) hexdump value buffer ## -b
-"""
-    def __init__(self):
-        GdbDumpValueParent.__init__(self, "hexdump value", -1)
-        self.impl = HexdumpImpl()
+    def element(self, value, opts):
+        """Returns (address, length) of the element 'value'"""
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            if opts["size"] != None:
+                return (int(value), opts["size"])
+            value = value.dereference()
+        if value.address == None:
+            raise RuntimeError("the element is not in the inferior memory")
+        if opts["size"] != None:
+            return (int(value.address), opts["size"])
+        return (int(value.address), value.type.sizeof)
+
+    def resolve(self, spec, opts):
+        """Returns a list of (label, address, length) of the elements"""
+        ret = list()
+        if spec.startswith("--list"):
+            argv = gdb.string_to_argv(spec)
+            if len(argv) != 3:
+                raise RuntimeError("usage: --list HEAD NEXT")
+            (head, nextname) = argv[1:]
+            node = gdb.parse_and_eval(head)
+            visited = set()
+            while int(node) != 0 and len(ret) < opts["max"]:
+                if int(node) in visited:
+                    error("%s: a cycle at 0x%x, stopped" % (head, int(node)))
+                    break
+                visited.add(int(node))
+                value = node.dereference()
+                if opts["field"] != None:
+                    value = value[opts["field"]]
+                (address, length) = self.element(value, opts)
+                ret.append(("%s #%d (0x%x)" % (head, len(ret), int(node)),
+                            address, length))
+                node = node.dereference()[nextname]
+            return ret
+
+        m = BatchImpl.re_slice.match(spec)
+        if m == None:
+            raise RuntimeError("invalid elements, '%s'" % spec)
+        (base, lo, hi, suffix) = [ g.strip() for g in m.groups() ]
+        lo = int(gdb.parse_and_eval(lo))
+        hi = min(int(gdb.parse_and_eval(hi)), lo + opts["max"] - 1)
+        array = gdb.parse_and_eval(base)
+        for i in xrange(lo, hi + 1):
+            if suffix:
+                value = gdb.parse_and_eval("(%s)[%d]%s" % (base, i, suffix))
+            else:
+                value = array[i]
+            (address, length) = self.element(value, opts)
+            ret.append(("%s[%d]%s" % (base, i, suffix), address, length))
+        return ret
+
+    def read_batch(self, elements):
+        """Generate (label, address, data) of 'elements' in the same order
+
+Consecutive elements up to EACH_BATCH_SIZE bytes are taken as a batch,
+and the elements of a batch whose gaps are smaller than
+EACH_MERGE_GAP are read together."""
+        import bisect
+        pos = 0
+        while pos < len(elements):
+            end = pos
+            size = 0
+            while end < len(elements) and \
+                  (end == pos or size + elements[end][2] <= EACH_BATCH_SIZE):
+                size += elements[end][2]
+                end += 1
+            batch = elements[pos:end]
+
+            spans = list()
+            for (label, address, length) in sorted(batch,
+                                                   key=lambda e: e[1]):
+                if spans and address <= spans[-1][1] + EACH_MERGE_GAP:
+                    spans[-1][1] = max(spans[-1][1], address + length)
+                else:
+                    spans.append([ address, address + length ])
+            debug("read_batch: %d elements in %d reads" %
+                  (len(batch), len(spans)))
+            starts = [ span[0] for span in spans ]
+            datas = [ read_memory(span[0], span[1] - span[0])
+                      for span in spans ]
+
+            for (label, address, length) in batch:
+                idx = bisect.bisect_right(starts, address) - 1
+                offset = address - starts[idx]
+                yield (label, address, datas[idx][offset:offset + length])
+            pos = end
+
+    def header(self, label, address, length, out):
+        out.write("==> %s: 0x%x, %d bytes <==\n" % (label, address, length))
+
+    def save_batch(self, batch, tmpdir):
+        """Save each element of 'batch' into a file in 'tmpdir'
+
+The files are named after the elements, so that the messages of a tool
+are readable.  Returns a list of (label, address, length, file name)."""
+        ret = list()
+        for (label, address, data) in batch:
+            name = "%05d-%s" % (len(ret), re.sub(r"[^A-Za-z0-9_.-]+", "_",
+                                                 label))
+            with open(os.path.join(tmpdir, name), "wb") as f:
+                f.write(data)
+            ret.append((label, address, len(data), name))
+        return ret
+
+    def remove_batch(self, tmpdir):
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+    def register(self, tool):
+        """Make this the 'each' command of TOOL for 'gdbx foreach-thread'"""
+        each_commands[tool] = self
+
+    def job_args(self, args):
+        """Return the arguments of process_batch() from the tool arguments
+
+This runs in the main thread, even for a background job; override it
+to resolve what process_batch() must not do in a job."""
+        return args
+
+    @timed
+    def invoke(self, args, from_tty):
+        try:
+            (args, background) = split_background(args)
+            with stats.phase("parse"):
+                (spec, opts, tool_args) = self.parse_batch(args)
+                elements = self.resolve(spec, opts)
+                tool_args = self.job_args(tool_args)
+            debug("%d elements, %d bytes" %
+                  (len(elements), sum([ e[2] for e in elements ])))
+            if background:
+                batch = list(self.read_batch(elements))
+                start_job("%s %s" % (self.stats_name, args),
+                          lambda job: self.process_batch(job.iterate(batch),
+                                                         tool_args, job))
+                return
+            self.process_batch(self.read_batch(elements), tool_args)
+        except RuntimeError as e:
+            print e
+        except KeyboardInterrupt:
+            sys.stderr.write("interrupted\n")
+
+    def process_batch(self, batch, args, job = None):
+        """Process the elements from read_batch() with the tool
+
+If 'job' is not None, this runs in the background job 'job'; the
+output goes to 'job.out' instead of the standard output."""
+        pass
+
+# The 'each' commands by the name of the tool, see BatchImpl.register()
+each_commands = dict()
+
+def data_reader(address, data):
+    """data_reader(address, data) - make a reader of the data already read
+
+Returns a function like iter_memory(), which generates the chunks of
+'data' as if 'data' was read from 'address'."""
+    def reader(start, length):
+        offset = start - address
+        for pos in xrange(offset, offset + length, MEMORY_CHUNK_SIZE):
+            size = min(MEMORY_CHUNK_SIZE, offset + length - pos)
+            yield (address + pos, data[pos:pos + size])
+    return reader
+
+
+class HexdumpCommand(gdb.Command):
+    """Dump the given data using hexdump(1)"""
+    def __init__(self):
+        gdb.Command.__init__(self, "hexdump", gdb.COMMAND_DATA, -1, True)
+
+def _hexdump_char(c):
+    # hexdump(1) '%_c' conversion
+    escapes = { 0: "\\0", 7: "\\a", 8: "\\b", 9: "\\t", 10: "\\n",
+                11: "\\v", 12: "\\f", 13: "\\r" }
+    if c in escapes:
+        return "%3s " % escapes[c]
+    elif 0x20 <= c < 0x7f:
+        return "%3s " % chr(c)
+    else:
+        return "%03o " % c
+
+class HexdumpFormatter(object):
+    """Format the data like hexdump(1), without running hexdump(1)
+
+Supported display formats are the canonical hex+ASCII display ('C'),
+one-byte octal ('b'), one-byte character ('c'), two-byte decimal
+('d'), two-byte octal ('o'), two-byte hexadecimal ('x') and the
+default format of hexdump(1) (None).
+
+Call feed() with the data as many times as needed, then finish().
+Both return the formatted lines as a string."""
+
+    LINE_SIZE = 16
+
+    # format: (unit size, unit conversion, final offset conversion)
+    formats = { "C": (1, None, "%08x\n"),
+                "b": (1, "%03o ", "%07x\n"),
+                "c": (1, _hexdump_char, "%07x\n"),
+                "d": (2, "  %05u ", "%07x\n"),
+                "o": (2, " %06o ", "%07x\n"),
+                "x": (2, "   %04x ", "%07x\n"),
+                None: (2, "%04x ", "%07x\n") }
+
+    tables = dict()
+    hex_table = [ "%02x" % c for c in range(256) ]
+    ascii_table = "".join([ (0x20 <= c < 0x7f) and chr(c) or "."
+                            for c in range(256) ])
+
+    def __init__(self, format = "C", squeeze = True, offset = 0):
+        (self.unit, conv, self.final) = HexdumpFormatter.formats[format]
+        self.format = format
+        self.squeeze = squeeze
+        self.offset = offset
+        self.pending = ""
+        self.prev = None
+        self.squeezing = False
+        if format != "C":
+            self.table = HexdumpFormatter.table(format)
+            self.width = len(self.table[0])
+
+    @staticmethod
+    def table(format):
+        """Return the conversion table of all units of 'format'"""
+        if format not in HexdumpFormatter.tables:
+            (unit, conv, final) = HexdumpFormatter.formats[format]
+            if callable(conv):
+                table = [ conv(v) for v in range(1 << (unit * 8)) ]
+            else:
+                table = [ conv % v for v in range(1 << (unit * 8)) ]
+            HexdumpFormatter.tables[format] = table
+        return HexdumpFormatter.tables[format]
+
+    @staticmethod
+    def marked_line(offset, block, marks):
+        """Return a canonical line without the newline, where each byte
+of 'block' is followed by the character of 'marks' instead of a space"""
+        table = HexdumpFormatter.hex_table
+        hexes = [ table[c] + m for (c, m) in zip(bytearray(block), marks) ]
+        return "%08x  %-24s %-24s |%-16s|" % \
+               (offset, "".join(hexes[:8]), "".join(hexes[8:]),
+                block.translate(HexdumpFormatter.ascii_table))
+
+    def line(self, offset, block):
+        if self.format == "C":
+            hexes = [ "%02x " % c for c in bytearray(block) ]
+            return "%08x  %-24s %-24s |%s|\n" % \
+                   (offset, "".join(hexes[:8]), "".join(hexes[8:]),
+                    block.translate(HexdumpFormatter.ascii_table))
+
+        nunits = HexdumpFormatter.LINE_SIZE / self.unit
+        if len(block) % self.unit:
+            # Units overlapping the end of data are zero-padded.
+            block += "\0" * (self.unit - len(block) % self.unit)
+        if self.unit == 1:
+            units = bytearray(block)
+        else:
+            import array
+            units = array.array("H", block)
+        conv = "".join([ self.table[u] for u in units ])
+        # Units beyond the end of data are replaced by spaces.
+        return "%07x %s\n" % (offset,
+                               conv + " " * ((nunits - len(units)) *
+                                             self.width))
+
+    def feed(self, data):
+        """Format 'data' and return the formatted full lines"""
+        size = HexdumpFormatter.LINE_SIZE
+        if self.pending:
+            data = self.pending + data
+        nfull = len(data) - len(data) % size
+        self.pending = data[nfull:]
+
+        lines = list()
+        for pos in xrange(0, nfull, size):
+            block = data[pos:pos + size]
+            if self.squeeze and block == self.prev:
+                if not self.squeezing:
+                    lines.append("*\n")
+                    self.squeezing = True
+            else:
+                lines.append(self.line(self.offset, block))
+                self.squeezing = False
+            self.prev = block
+            self.offset += size
+        return "".join(lines)
+
+    def finish(self, final = True):
+        """Format the remaining data, and return it with the final offset
+
+If 'final' is False, the final offset line is omitted."""
+        if self.pending:
+            ret = self.line(self.offset, self.pending)
+            self.offset += len(self.pending)
+            self.pending = ""
+        elif self.offset == 0:
+            return ""
+        else:
+            ret = ""
+        if final:
+            ret += self.final % self.offset
+        return ret
+
+class TypeLayout(object):
+    """The flattened layout of a type, for 'hexdump value ... ## --fields'
+
+'fields' is a list of (offset, size, path) of the members of the type,
+sorted by the offsets.  The nested structures and unions, and the
+arrays of them, are flattened into their members with the paths like
+'hdr.len' or 'ent[2].key'.  The bytes that no member covers are the
+padding, which is in 'fields' as (offset, size, None); 'padding' is a
+string of '_' for each padding byte and ' ' for each other byte.
+
+If the type is an array of structures or unions, the layout is of the
+element type, for 'count' elements.
+
+Walking the fields through the gdb API is slow, so the layouts are
+computed once and cached by the type name, see get()."""
+
+    # The layouts by type name, dropped when the symbols change
+    cache = dict()
+    padding_table = "".join([ c == 0 and "_" or " " for c in range(256) ])
+
+    @staticmethod
+    def get(type):
+        """Returns the layout of the gdb.Type 'type'"""
+        key = str(type)
+        layout = TypeLayout.cache.get(key)
+        if layout == None:
+            layout = TypeLayout(type)
+            # Anonymous types have no name of their own.
+            if "{...}" not in key:
+                TypeLayout.cache[key] = layout
+        return layout
+
+    @staticmethod
+    def clear(event = None):
+        TypeLayout.cache.clear()
+
+    def __init__(self, type):
+        t = type.strip_typedefs()
+        self.count = 1
+        if t.code == gdb.TYPE_CODE_ARRAY:
+            target = t.target().strip_typedefs()
+            if target.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION) \
+               and target.sizeof > 0:
+                self.count = t.sizeof / target.sizeof
+                t = target
+        self.size = t.sizeof
+        fields = list()
+        self.flatten(t, 0, "", fields)
+
+        covered = bytearray(self.size)
+        for (offset, size, path) in fields:
+            end = min(offset + size, self.size)
+            if offset < end:
+                covered[offset:end] = "\x01" * (end - offset)
+        covered = str(covered)
+        for m in re.finditer("\x00+", covered):
+            fields.append((m.start(), m.end() - m.start(), None))
+        self.padding = covered.translate(TypeLayout.padding_table)
+        fields.sort(key = lambda f: f[0])
+        self.fields = fields
+        self.offsets = [ f[0] for f in fields ]
+
+    def flatten(self, type, offset, path, fields):
+        t = type.strip_typedefs()
+        if t.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+            for f in t.fields():
+                if not hasattr(f, "bitpos"):
+                    continue            # a static member
+                sub = path
+                if f.name and not f.is_base_class:
+                    sub = path and "%s.%s" % (path, f.name) or f.name
+                pos = offset + f.bitpos / 8
+                if f.bitsize:
+                    fields.append((pos, (f.bitpos % 8 + f.bitsize + 7) / 8,
+                                   "%s:%d" % (sub, f.bitsize)))
+                else:
+                    self.flatten(f.type, pos, sub, fields)
+        elif t.code == gdb.TYPE_CODE_ARRAY and t.target().sizeof > 0:
+            target = t.target().strip_typedefs()
+            count = t.sizeof / target.sizeof
+            element = None
+            if target.code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION):
+                element = TypeLayout.get(t.target())
+                if len(fields) + count * len(element.fields) > \
+                   LAYOUT_MAX_FIELDS:
+                    element = None
+            if element == None:
+                fields.append((offset, t.sizeof, "%s[%d]" % (path, count)))
+                return
+            for i in xrange(count):
+                base = offset + i * element.size
+                for (off, size, name) in element.fields:
+                    if name != None:
+                        fields.append((base + off, size, "%s[%d]%s" %
+                                       (path, i, name and "." + name)))
+        else:
+            fields.append((offset, t.sizeof, path or str(type)))
+
+    def annotate(self, offset, length):
+        """Returns (names, padding) of the bytes [offset, offset+length)
+
+'names' is a string of the fields that start in the range, with their
+offsets, and 'padding' is the part of self.padding for the range."""
+        import bisect
+        if self.size == 0:
+            return ("", " " * length)
+        names = list()
+        marks = list()
+        end = offset + length
+        while offset < end:
+            (index, pos) = divmod(offset, self.size)
+            stop = min(self.size, pos + end - offset)
+            lo = bisect.bisect_left(self.offsets, pos)
+            hi = bisect.bisect_left(self.offsets, stop)
+            if lo < hi:
+                fields = ", ".join([ "+%d %s" %
+                                     (off, name == None and
+                                      "<pad %d>" % size or name)
+                                     for (off, size, name)
+                                     in self.fields[lo:hi] ])
+                if self.count > 1:
+                    fields = "[%d] %s" % (index, fields)
+                names.append(fields)
+            marks.append(self.padding[pos:stop])
+            offset += stop - pos
+        return ("; ".join(names), "".join(marks))
+
+class AnnotatedFormatter(HexdumpFormatter):
+    """HexdumpFormatter of the canonical display with the fields of a type
+
+Each line is followed by the fields that start in the line, with their
+offsets in the type (see TypeLayout), and each padding byte has '_'
+after its hex value instead of a space.  Identical lines are not
+squeezed, as their fields may differ."""
+
+    def __init__(self, layout, offset = 0):
+        HexdumpFormatter.__init__(self, "C", False, offset)
+        self.layout = layout
+
+    def line(self, offset, block):
+        (names, marks) = self.layout.annotate(offset, len(block))
+        line = HexdumpFormatter.marked_line(offset, block, marks)
+        if names:
+            return "%s  %s\n" % (line, names)
+        return line + "\n"
+
+class HexdumpImpl(object):
+    # hexdump(1) options which can be handled by HexdumpFormatter
+    native_formats = { "-C": "C", "-b": "b", "-c": "c", "-d": "d",
+                       "-o": "o", "-x": "x" }
+
+    def parse_native(self, args):
+        """Parse hexdump(1) options into HexdumpFormatter arguments
+
+Returns a dictionary contains the 'format', 'squeeze', 'skip', and
+'length', or None if hexdump(1) is required to handle 'args'."""
+        opts = { "format": None, "squeeze": True, "skip": 0, "length": None,
+                 "max_bytes": None, "fields": False }
+        formats = list()
+        tokens = args.split()
+        hexdump_opts = False
+        while tokens:
+            tok = tokens.pop(0)
+            if tok == "--max-bytes" or tok.startswith("--max-bytes="):
+                (dummy, sep, val) = tok.partition("=")
+                if not sep:
+                    if not tokens:
+                        raise RuntimeError("--max-bytes requires a number")
+                    val = tokens.pop(0)
+                try:
+                    opts["max_bytes"] = int(val, 0)
+                except ValueError:
+                    raise RuntimeError("invalid --max-bytes value, '%s'" % val)
+                continue
+            if tok == "--fields":
+                opts["fields"] = True
+                continue
+            hexdump_opts = True
+            if tok in HexdumpImpl.native_formats:
+                formats.append(HexdumpImpl.native_formats[tok])
+            elif tok == "-v":
+                opts["squeeze"] = False
+            elif tok in ("-n", "-s") or \
+                 (len(tok) > 2 and tok[:2] in ("-n", "-s")):
+                if len(tok) > 2:
+                    val = tok[2:]
+                elif tokens:
+                    val = tokens.pop(0)
+                else:
+                    return None
+                try:
+                    val = int(val, 0)
+                except ValueError:
+                    return None
+                opts[tok[1] == "n" and "length" or "skip"] = val
+            else:
+                return None
+        if len(formats) > 1:
+            return None
+        if formats:
+            opts["format"] = formats[0]
+        elif not hexdump_opts or opts["fields"]:
+            opts["format"] = "C"
+        if opts["fields"] and opts["format"] != "C":
+            raise RuntimeError("--fields works with -C only")
+        return opts
+
+    def native(self, args):
+        return self.parse_native(args) != None
+
+    def process(self, address, length, args, reader = iter_memory,
+                out = None, layout = None, offset = 0):
+        """Dump LENGTH bytes from ADDRESS in-process
+
+'reader' is a function like iter_memory(), which generates the data
+chunks of a region.  The dump is written to 'out', or the standard
+output if 'out' is None.  'layout' is the TypeLayout of the data for
+'--fields'.  'offset' is the offset of ADDRESS in the value, where the
+offset column and the fields start, for a sampled part of a value."""
+        out = out or sys.stdout
+        opts = self.parse_native(args)
+        skip = min(opts["skip"], length)
+        length -= skip
+        if opts["length"] != None:
+            length = min(length, opts["length"])
+
+        total = length
+        if opts["max_bytes"] != None:
+            length = min(length, opts["max_bytes"])
+
+        if not opts["fields"]:
+            fmt = HexdumpFormatter(opts["format"], opts["squeeze"],
+                                   offset + skip)
+        elif layout == None:
+            raise RuntimeError("--fields needs the type of a value, "
+                               "see 'help hexdump value'")
+        else:
+            fmt = AnnotatedFormatter(layout, offset + skip)
+        done = 0
+        try:
+            for (addr, data) in reader(address + skip, length):
+                out.write(fmt.feed(data))
+                out.flush()
+                done += len(data)
+        except KeyboardInterrupt:
+            out.write(fmt.finish())
+            self.report_progress("interrupted", address + skip, done, total,
+                                 out != sys.stdout and out or sys.stderr)
+            return True
+        out.write(fmt.finish())
+        if done < total:
+            self.report_progress("stopped by --max-bytes", address + skip,
+                                 done, total,
+                                 out != sys.stdout and out or sys.stderr)
+        return True
+
+    def report_progress(self, reason, address, done, total, out):
+        out.write("hexdump: %s after %d of %d bytes (0x%x-0x%x)\n" %
+                         (reason, done, total, address, address + done))
+
+    def parse_argument(self, args):
+        idx = args.find("##")
+        if idx < 0:
+            debug("hexdump impl parse args: |%s|, |%s|" % (args, ""))
+            return (args, "")
+        else:
+            debug("hexdump impl parse args: |%s|, |%s|" % (args[:idx].strip(), args[idx+2:].strip()))
+            return (args[:idx].strip(), args[idx+2:].strip())
+
+    def commandline(self, filename, args):
+        if re.search(r"(^|\s)--fields\b", args):
+            raise RuntimeError("--fields needs a value in the inferior memory, "
+                               "and works with -C, -v, -n, -s only")
+        # hexdump(1) does not know '--max-bytes', but '-n' is the same.
+        args = re.sub(r"--max-bytes(=|\s+)", "-n ", args)
+        if args == "" or re.match(r"^-n \S+$", args):
+            return [HEXDUMP_PATH, "-C"] + args.split() + [filename]
+        else:
+            return "%s %s %s" % (HEXDUMP_PATH, args, filename)
+
+    def complete(self, text, word):
+        if text.find("##") < 0:
+            return gdb.COMPLETE_SYMBOL
+        else:
+            return gdb.COMPELTE_NONE
+        
+class HexdumpValueCommand(GdbDumpValueParent):
+    """Dump the value EXPR using hexdump(1)
+
+usage: hexdump value EXPR [## [--fields] OPTION...] [&]
+
+Dump the value, EXPR using hexdump(1).  If no OPTION is provided, '-C'
+is assumed (canonnical hex+ASCII display).  If provided, OPTION is
+passed to hexdump(1).  Note that you need '##' to separate EXPR from
+OPTION.
+
+The display formats '-C', '-b', '-c', '-d', '-o', '-x' with '-v', '-n'
+and '-s' are handled without running hexdump(1), reading the value
+directly from the inferior memory.  Other OPTIONs require hexdump(1).
+
+The value is read and printed chunk by chunk.  Use '--max-bytes N' to
+stop after N bytes; Ctrl-C also stops the output.  In both cases, the
+number of bytes dumped so far is reported.
+
+For example, to dump the value, 'buffer' using hexdump(1) '-C':
+
+    (gdb) hexdump value buffer
+
+To dump the value, 'buffer' in one-byte octal display:
+
+    (gdb) hexdump value buffer ## -b
+
+With '--fields', each line of the '-C' display is followed by the
+members of the type of EXPR that start in the line, with their offsets
+in the type, and the padding bytes are marked with '_' after their hex
+values.  For an array of structures, the members are shown for each
+element, e.g. to dump the first four elements of 'table':
+
+    (gdb) hexdump value table ## --fields -n 96
+    00000000  01 00 00 00 00_00_00_00_ 10 20 60 00 00 00 00 00  |......... `.....|  [0] +0 id, +4 <pad 4>, +8 name
+    00000010  2a 00 00 00 00 00 00 00  02 00 00 00 00_00_00_00_  |*...............|  [0] +16 count; [1] +0 id, +4 <pad 4>
+
+The layout of a type is computed once, and kept until the symbols are
+reloaded.
+
+A value over 'gdbx max-bytes' bytes is refused, or only a part of it
+is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the value is copied at once, and dumped in the
+background while you keep debugging; see 'help gdbx jobs'.
+"""
+    background = True
+    sampling = True
+
+    def __init__(self):
+        GdbDumpValueParent.__init__(self, "hexdump value", -1)
+        self.impl = HexdumpImpl()
+        self.fields = False
+        self.layout = None
         
     def parse_arguments(self, args):
-        return self.impl.parse_argument(args)
+        (dump_args, exec_args) = self.impl.parse_argument(args)
+        opts = self.impl.parse_native(exec_args)
+        self.fields = opts != None and opts["fields"]
+        return (dump_args, exec_args)
+
+    def region(self, args):
+        value = gdb.parse_and_eval(args)
+        # The layout is made here, as a background job cannot use gdb.
+        self.layout = None
+        if self.fields:
+            self.layout = TypeLayout.get(value.type)
+        if value.address == None:
+            return None
+        return (int(value.address), value.type.sizeof)
     
     def commandline(self, filename, args):
         return self.impl.commandline(filename, args)
 
+    def native(self, args):
+        return self.impl.native(args)
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args, layout=self.layout,
+                                 offset=self.offset(address))
+
+    def process_job(self, job, address, data, args):
+        if not self.native(args):
+            return GdbDumpParent.process_job(self, job, address, data, args)
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out,
+                                 self.layout, self.offset(address, job))
+
     def complete(self, text, word):
         return self.impl.complete(text, word)
         
 class HexdumpMemoryCommand(GdbDumpMemoryParent):
     """Dump the memory using hexdump(1)
 
-usage: hexdump memory START_ADDR END_ADDR [## OPTION...]
+usage: hexdump memory START_ADDR END_ADDR [## OPTION...] [&]
 
 Dump the memory from START_ADDR to END_ADDR using hexdump(1).  If no
 OPTION is provided, '-C' is assumed (canonnical hex+ASCII display).
 If provided, OPTION is passed to hexdump(1).  Note that you need '##'
 to separate EXPR from OPTION.
 
+The display formats '-C', '-b', '-c', '-d', '-o', '-x' with '-v', '-n'
+and '-s' are handled without running hexdump(1), reading the memory
+directly from the inferior.  Other OPTIONs require hexdump(1).
+
+The memory is read and printed chunk by chunk, so even a huge range
+starts printing immediately with a bounded memory usage.  Use
+'--max-bytes N' to stop after N bytes; Ctrl-C also stops the output.
+In both cases, the number of bytes dumped so far is reported.
+
 For example, to dump the memory from 'buffer' (100 bytes) using
 hexdump(1) '-C':
 
@@ -248,7 +2460,16 @@ hexdump(1) '-C':
 To dump the value, 'buffer' in one-byte octal display:
 
     (gdb) hexdump memory buffer ((char*)buffer+100) ## -b
+
+A memory region over 'gdbx max-bytes' bytes is refused, or only a part
+of it is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the memory is copied at once, and dumped in the
+background while you keep debugging; see 'help gdbx jobs'.
 """
+    background = True
+    sampling = True
+
     def __init__(self):
         GdbDumpMemoryParent.__init__(self, "hexdump memory", -1)
         self.impl = HexdumpImpl()
@@ -259,379 +2480,3570 @@ To dump the value, 'buffer' in one-byte octal display:
     def commandline(self, filename, args):
         return self.impl.commandline(filename, args)
 
+    def native(self, args):
+        return self.impl.native(args)
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args,
+                                 offset=self.offset(address))
+
+    def process_job(self, job, address, data, args):
+        if not self.native(args):
+            return GdbDumpParent.process_job(self, job, address, data, args)
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out,
+                                 offset=self.offset(address, job))
+
     def complete(self, text, word):
         return self.impl.complete(text, word)
         
-HexdumpCommand()
-HexdumpValueCommand()
-HexdumpMemoryCommand()
+class Snapshot(object):
+    """A copy of an inferior memory region
+
+The copy is kept in a bytearray, or in a memory-mapped temporary file
+if 'spill' is True, so that a large snapshot can be paged out."""
+    def __init__(self, name, address, length, spill = False):
+        self.name = name
+        self.address = address
+        self.length = length
+        self.file = None
+        if spill and length > 0:
+            self.file = tempfile.TemporaryFile(prefix="gdbx-snapshot-")
+            self.file.truncate(length)
+            import mmap
+            self.data = mmap.mmap(self.file.fileno(), length)
+        else:
+            self.data = bytearray(length)
+
+    def capture(self):
+        for (addr, data) in iter_memory(self.address, self.length):
+            pos = addr - self.address
+            self.data[pos:pos + len(data)] = data
+
+    def close(self):
+        if self.file != None:
+            self.data.close()
+            self.file.close()
+        self.data = None
+
+    def view(self, offset, length):
+        """Return a read-only view of the snapshot without copying"""
+        return buffer(self.data, offset, length)
+
+snapshots = collections.OrderedDict()
+
+def diff_runs(a, b, offset = 0, block = 64 * 1024):
+    """diff_runs(a, b[, offset[, block]]) - find the changed bytes
+
+Compare the buffers 'a' and 'b' of the same length, and generate the
+tuples (start, end) of the runs of the changed bytes, relative to
+'offset'.  Equal blocks are skipped with a single comparison, and only
+the changed blocks are compared again with a smaller block size, down
+to a byte."""
+    length = len(a)
+    run = None
+    for pos in xrange(0, length, block):
+        size = min(block, length - pos)
+        if buffer(a, pos, size) == buffer(b, pos, size):
+            continue
+        if block > 1:
+            runs = diff_runs(buffer(a, pos, size), buffer(b, pos, size),
+                             offset + pos, max(1, block / 16))
+        else:
+            runs = [ (offset + pos, offset + pos + 1) ]
+        for r in runs:
+            if run != None and run[1] == r[0]:
+                run = (run[0], r[1])
+            else:
+                if run != None:
+                    yield run
+                run = r
+    if run != None:
+        yield run
+
+class HexdumpSnapshotCommand(GdbDumpMemoryParent):
+    """Capture a memory region for 'hexdump diff'
+
+usage: hexdump snapshot NAME START_ADDR END_ADDR [--spill]
+       hexdump snapshot
+       hexdump snapshot -d NAME
+
+Copy the memory from START_ADDR to END_ADDR as a snapshot NAME.  The
+snapshot is kept in the gdb process, or in a memory-mapped temporary
+file if '--spill' is given, or if it is larger than
+SNAPSHOT_SPILL_SIZE bytes.  Capturing an existing NAME replaces it.
+
+Without arguments, list the snapshots.  With '-d', delete the snapshot
+NAME.
+
+For example, to find what is changed in 'buffer' by a function call:
+
+    (gdb) hexdump snapshot before buffer buffer+4096
+    (gdb) next
+    (gdb) hexdump diff before"""
 
-
-class IconvCommand(gdb.Command):
-    """Check the character encoding of the data"""
     def __init__(self):
-        gdb.Command.__init__(self, "iconv", gdb.COMMAND_DATA, -1, True)
+        GdbDumpMemoryParent.__init__(self, "hexdump snapshot", -1)
 
-class IconvEncodings(object):
-    encodings = None
-    replaces = "./:-()"
-    
-    @staticmethod
-    def supported_encodings():
-        ret = dict()
+    def complete(self, text, word):
+        return gdb.COMPLETE_SYMBOL
+
+    def parse_arguments(self, args):
+        # NAME START_ADDR END_ADDR [--spill]
+        (name, dummy, rest) = args.strip().partition(" ")
+        spill = ""
+        if rest.rstrip().endswith("--spill"):
+            rest = rest.rstrip()[:-len("--spill")]
+            spill = " --spill"
+        return (rest, name + spill)
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        tokens = args.split()
+        name = tokens[0]
+        spill = "--spill" in tokens or length > SNAPSHOT_SPILL_SIZE
+        snap = Snapshot(name, address, length, spill)
         try:
-            p = subprocess.Popen([ICONV_PATH, "-l"], stdout=subprocess.PIPE)
-            outbuf = p.communicate()[0]
-            enclist = outbuf.split("\n")
-            for enc in enclist:
-                # 'enc' is something like "ANSI_X3.110-1983//"
-                enc = enc.rstrip("/")
-                alias = enc.lower()
+            snap.capture()
+        except:
+            snap.close()
+            raise
+        if name in snapshots:
+            snapshots.pop(name).close()
+        snapshots[name] = snap
+        sys.stdout.write("snapshot %s: %d bytes (0x%x-0x%x)%s\n" %
+                         (name, length, address, address + length,
+                          snap.file != None and ", spilled" or ""))
+        return True
 
-                for repl in IconvEncodings.replaces:
-                    alias = alias.replace(repl, "_")
-                
-                ret[alias] = enc
+    @timed
+    def invoke(self, args, from_tty):
+        tokens = args.split()
+        if not tokens:
+            for snap in snapshots.itervalues():
+                sys.stdout.write("%-16s 0x%x-0x%x %12d bytes%s\n" %
+                                 (snap.name, snap.address,
+                                  snap.address + snap.length, snap.length,
+                                  snap.file != None and " (spilled)" or ""))
+        elif tokens[0] == "-d":
+            for name in tokens[1:]:
+                if name in snapshots:
+                    snapshots.pop(name).close()
+                else:
+                    error("no snapshot named %s" % name)
+        else:
+            GdbDumpMemoryParent.invoke(self, args, from_tty)
+
+class HexdumpDiffCommand(gdb.Command):
+    """Show the changed bytes between snapshots
+
+usage: hexdump diff SNAPSHOT_A [SNAPSHOT_B]
+
+Compare the snapshot SNAPSHOT_A with SNAPSHOT_B, or with the current
+memory of the same region if SNAPSHOT_B is not given, and show every
+range of the changed bytes with its addresses.  For each range, the
+lines of SNAPSHOT_A ('-') and SNAPSHOT_B ('+') are shown in the
+canonical hex+ASCII display, up to DIFF_MAX_LINES lines.
+
+Equal blocks are skipped quickly, so comparing large snapshots costs
+little more than reading them.  See 'help hexdump snapshot'."""
+
+    def __init__(self):
+        gdb.Command.__init__(self, "hexdump diff", gdb.COMMAND_DATA, -1)
+        self.stats_name = "hexdump diff"
+
+    def complete(self, text, word):
+        return [ n for n in snapshots.iterkeys() if n.startswith(word) ]
+
+    def lines(self, prefix, address, data, start, end):
+        line = HexdumpFormatter.LINE_SIZE
+        first = start - start % line
+        last = min(len(data), end + (line - end % line) % line)
+        fmt = HexdumpFormatter("C", False, address + first)
+        out = fmt.feed(str(buffer(data, first, last - first)))
+        out += fmt.finish(False)
+        lines = [ prefix + l for l in out.splitlines() if l ]
+        if len(lines) > DIFF_MAX_LINES:
+            lines = lines[:DIFF_MAX_LINES] + \
+                    [ "%s... %d more lines" % (prefix,
+                                              len(lines) - DIFF_MAX_LINES) ]
+        return "\n".join(lines) + "\n"
+
+    def diff(self, a_addr, a, b_addr, b):
+        length = min(len(a), len(b))
+        if len(a) != len(b):
+            sys.stdout.write("sizes differ: %d != %d bytes, comparing the "
+                             "first %d bytes\n" % (len(a), len(b), length))
+        changed = 0
+        count = 0
+        for (start, end) in diff_runs(buffer(a, 0, length),
+                                      buffer(b, 0, length)):
+            count += 1
+            changed += end - start
+            if a_addr == b_addr:
+                sys.stdout.write("0x%x-0x%x (%d bytes):\n" %
+                                 (a_addr + start, a_addr + end, end - start))
+            else:
+                sys.stdout.write("0x%x-0x%x / 0x%x-0x%x (%d bytes):\n" %
+                                 (a_addr + start, a_addr + end,
+                                  b_addr + start, b_addr + end, end - start))
+            sys.stdout.write(self.lines("- ", a_addr, a, start, end))
+            sys.stdout.write(self.lines("+ ", b_addr, b, start, end))
+        sys.stdout.write("%d bytes changed in %d ranges\n" % (changed, count))
+
+    @timed
+    def invoke(self, args, from_tty):
+        names = args.split()
+        if len(names) not in (1, 2):
+            error("usage: hexdump diff SNAPSHOT_A [SNAPSHOT_B]")
+            return
+        for name in names:
+            if name not in snapshots:
+                error("no snapshot named %s" % name)
+                return
+        a = snapshots[names[0]]
+        try:
+            if len(names) == 2:
+                b = snapshots[names[1]]
+                self.diff(a.address, a.data, b.address, b.data)
+            else:
+                b = Snapshot(a.name, a.address, a.length,
+                             a.length > SNAPSHOT_SPILL_SIZE)
+                try:
+                    b.capture()
+                    self.diff(a.address, a.data, b.address, b.data)
+                finally:
+                    b.close()
+        except RuntimeError as e:
+            print e
+
+class Watch(object):
+    """A memory region that is compared at every stop, for 'hexdump watch'
+
+Two snapshots of the region are kept: 'prev' holds the memory at the
+last stop, and 'cur' is the buffer that the memory is read into at this
+stop.  They are swapped after the comparison, so no buffer is
+allocated at a stop."""
+    def __init__(self, number, address, length):
+        self.number = number
+        self.address = address
+        self.length = length
+        self.stops = 0
+        spill = length > SNAPSHOT_SPILL_SIZE
+        self.prev = Snapshot("watch", address, length, spill)
+        self.cur = Snapshot("watch", address, length, spill)
+        try:
+            self.prev.capture()
         except:
-            print "error: cannot get supported encoding list"
+            self.close()
             raise
-        
-        return ret
 
+    def close(self):
+        self.prev.close()
+        self.cur.close()
+
+    def update(self):
+        """Read the region again, and return the changed lines
+
+Returns a list of (offset, changed bytes, marks) of each changed line
+of the canonical display, where 'marks' has a '*' for each changed
+byte."""
+        self.cur.capture()
+        self.stops += 1
+        size = HexdumpFormatter.LINE_SIZE
+        (a, b) = (self.prev.data, self.cur.data)
+        lines = list()
+        for (start, end) in diff_runs(buffer(a), buffer(b)):
+            first = start - start % size
+            if lines and lines[-1][0] == first:
+                first += size
+            for pos in xrange(first, end, size):
+                old = bytearray(buffer(a, pos, size))
+                new = bytearray(buffer(b, pos, size))
+                marks = "".join([ x != y and "*" or " "
+                                  for (x, y) in zip(old, new) ])
+                lines.append((pos, len(marks) - marks.count(" "), marks))
+        (self.prev, self.cur) = (self.cur, self.prev)
+        return lines
+
+watches = collections.OrderedDict()
+
+class HexdumpWatchCommand(GdbDumpMemoryParent):
+    """Show the changes of a memory region at every stop
+
+usage: hexdump watch START_ADDR END_ADDR
+       hexdump watch
+       hexdump watch -d [NUMBER...]
+
+Watch the memory from START_ADDR to END_ADDR.  Whenever the inferior
+stops (e.g. after 'next' or at a breakpoint), the region is read again
+and compared with the previous stop, and only the lines with changed
+bytes are shown in the canonical hex+ASCII display, where each changed
+byte has '*' after its hex value.  Up to WATCH_MAX_LINES lines are
+shown per stop.
+
+Without arguments, list the watches.  With '-d', delete the watches
+NUMBER, or all watches if no NUMBER is given.
+
+For example, to see how a loop fills 'buffer':
+
+    (gdb) hexdump watch buffer buffer+64
+    watch 1: 64 bytes (0x601040-0x601080)
+    (gdb) next
+    watch 1: 2 bytes changed in 1 lines
+    00601050  41 42*43*00 00 00 00 00  00 00 00 00 00 00 00 00  |ABC.............|"""
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "hexdump watch", -1)
+        self.number = 0
+
+    def complete(self, text, word):
+        return gdb.COMPLETE_SYMBOL
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        if length == 0:
+            raise RuntimeError("hexdump watch: the region is empty")
+        self.number += 1
+        watches[self.number] = Watch(self.number, address, length)
+        if len(watches) == 1:
+            gdb.events.stop.connect(self.on_stop)
+        sys.stdout.write("watch %d: %d bytes (0x%x-0x%x)\n" %
+                         (self.number, length, address, address + length))
+        return True
+
+    def delete(self, numbers):
+        for number in numbers:
+            if number not in watches:
+                error("no watch number %d" % number)
+                continue
+            watches.pop(number).close()
+            if not watches:
+                gdb.events.stop.disconnect(self.on_stop)
+
+    def on_stop(self, event):
+        for watch in watches.values():
+            try:
+                lines = watch.update()
+            except RuntimeError as e:
+                error("watch %d: %s" % (watch.number, e))
+                continue
+            if not lines:
+                continue
+            out = [ "watch %d: %d bytes changed in %d lines\n" %
+                    (watch.number, sum([ l[1] for l in lines ]), len(lines)) ]
+            for (offset, count, marks) in lines[:WATCH_MAX_LINES]:
+                block = str(buffer(watch.prev.data, offset,
+                                   HexdumpFormatter.LINE_SIZE))
+                out.append(HexdumpFormatter.marked_line(
+                    watch.address + offset, block, marks) + "\n")
+            if len(lines) > WATCH_MAX_LINES:
+                out.append("... %d more lines\n" %
+                           (len(lines) - WATCH_MAX_LINES))
+            sys.stdout.write("".join(out))
+
+    @timed
+    def invoke(self, args, from_tty):
+        tokens = args.split()
+        if not tokens:
+            for watch in watches.itervalues():
+                sys.stdout.write("%3d  0x%x-0x%x %12d bytes, %d stops\n" %
+                                 (watch.number, watch.address,
+                                  watch.address + watch.length, watch.length,
+                                  watch.stops))
+        elif tokens[0] == "-d":
+            try:
+                numbers = [ int(t) for t in tokens[1:] ] or watches.keys()
+            except ValueError:
+                error("usage: hexdump watch -d [NUMBER...]")
+                return
+            self.delete(numbers)
+        else:
+            GdbDumpMemoryParent.invoke(self, args, from_tty)
+
+class BlockProfiler(object):
+    """Byte statistics of memory blocks, for 'hexdump profile'
+
+For each block, the byte histogram gives the Shannon entropy in bits
+per byte, and the block is classified by the entropy, the fraction of
+zero bytes and the fraction of printable bytes:
+
+  .  zero         all bytes are zero, e.g. freed or unused memory
+  _  sparse       more than half of the bytes are zero
+  t  text         mostly printable ASCII, CR, LF and TAB
+  #  random       high entropy: compressed, encrypted or random data
+  b  binary       anything else, e.g. pointers and integers
+  ?  unreadable   the memory cannot be read
+
+Counting each of 256 byte values over a block costs 256 scans of it,
+so the block is first split into 16 groups of byte values by
+str.translate(), and each value is counted only within its group."""
+
+    classes = (".", "_", "t", "#", "b", "?")
+    names = { ".": "zero", "_": "sparse", "t": "text", "#": "random",
+              "b": "binary", "?": "unreadable" }
+
+    printable = "\t\n\r" + "".join([ chr(c) for c in xrange(0x20, 0x7f) ])
+    # (bytes to delete to keep the group, bytes of the group) of each group
+    groups = [ ("".join([ chr(c) for c in xrange(256) if c >> 4 != g ]),
+                [ chr(c) for c in xrange(g << 4, (g + 1) << 4) ])
+               for g in xrange(16) ]
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        # Entropy above this is 'random'; 8 bits per byte at most, but
+        # a small random block cannot reach it.
+        self.random = 0.9 * min(8.0, math.log(block_size, 2))
+
+    def histogram(self, block):
+        """Returns the counts of the byte values that appear in 'block'"""
+        counts = list()
+        for (delete, values) in BlockProfiler.groups:
+            group = block.translate(None, delete)
+            if group:
+                for value in values:
+                    n = group.count(value)
+                    if n:
+                        counts.append(n)
+        return counts
+
+    def profile(self, block):
+        """Returns (class, entropy, zero fraction, printable fraction)"""
+        size = len(block)
+        zero = block.count("\0")
+        if zero == size:
+            return (".", 0.0, 1.0, 0.0)
+        printable = size - len(block.translate(None, BlockProfiler.printable))
+        log = math.log
+        entropy = log(size, 2) - sum([ n * log(n, 2)
+                                       for n in self.histogram(block) ]) / size
+        (zero, printable) = (float(zero) / size, float(printable) / size)
+        if zero > 0.5:
+            cls = "_"
+        elif printable >= 0.9:
+            cls = "t"
+        elif entropy >= self.random:
+            cls = "#"
+        else:
+            cls = "b"
+        return (cls, entropy, zero, printable)
+
+    def scan(self, address, length):
+        """Generate (address, size, class, entropy, zero, printable) of
+the blocks in [address, address+length)
+
+The memory is read in chunks of whole blocks of about
+PROFILE_CHUNK_SIZE bytes; if a chunk cannot be read, its blocks are
+read one by one, so only the unreadable blocks are lost."""
+        bsize = self.block_size
+        chunk_size = max(bsize, PROFILE_CHUNK_SIZE - PROFILE_CHUNK_SIZE % bsize)
+        end = address + length
+        pos = address
+        while pos < end:
+            size = min(chunk_size, end - pos)
+            try:
+                chunks = [ (pos, read_inferior(pos, size)) ]
+            except gdb.MemoryError:
+                chunks = list()
+                for addr in xrange(pos, pos + size, bsize):
+                    try:
+                        data = read_inferior(addr, min(bsize, pos + size - addr))
+                    except gdb.MemoryError:
+                        data = None
+                    chunks.append((addr, data))
+            for (addr, data) in chunks:
+                if data == None:
+                    yield (addr, min(bsize, end - addr), "?", 0.0, 0.0, 0.0)
+                    continue
+                for off in xrange(0, len(data), bsize):
+                    block = data[off:off + bsize]
+                    yield (addr + off, len(block)) + self.profile(block)
+            pos += size
+
+class HexdumpProfileCommand(GdbDumpMemoryParent):
+    """Show where the text, the random data and the zeros are in the memory
+
+usage: hexdump profile START_ADDR END_ADDR [--block N]
+
+Split the memory from START_ADDR to END_ADDR into blocks of N bytes
+(default: PROFILE_BLOCK_SIZE), and compute the byte histogram, the
+Shannon entropy, the fraction of zero bytes and the fraction of
+printable bytes of each block.  Then print a map of one character per
+block, 64 blocks per line, and the ranges of the blocks of the same
+class with their average statistics, up to PROFILE_MAX_RANGES ranges.
+The classes are:
+
+  .  zero         all bytes are zero, e.g. freed or unused memory
+  _  sparse       more than half of the bytes are zero
+  t  text         mostly printable; try 'iconv' or 'xmllint'
+  #  random       high entropy: compressed, encrypted or random data
+  b  binary       anything else, e.g. pointers and integers
+  ?  unreadable   the memory cannot be read
+
+Ctrl-C stops the scan, and shows the blocks scanned so far.
+
+For example, to find the text in a 100 MB heap before dumping it:
+
+    (gdb) hexdump profile heap heap+100*1024*1024 --block 65536"""
+
+    map_width = 64
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "hexdump profile", -1)
+
+    def complete(self, text, word):
+        return gdb.COMPLETE_SYMBOL
+
+    def parse_arguments(self, args):
+        m = re.search(r"\s--block\b", args)
+        if m == None:
+            return (args, "")
+        return (args[:m.start()], args[m.start():])
+
+    def native(self, args):
+        return True
+
+    def block_size(self, args):
+        m = re.search(r"--block(?:\s+|=)(\S+)", args)
+        if m == None:
+            return PROFILE_BLOCK_SIZE
+        try:
+            size = int(m.group(1), 0)
+        except ValueError:
+            size = 0
+        if size <= 0:
+            raise RuntimeError("invalid --block value, '%s'" % m.group(1))
+        return size
+
+    def process(self, address, length, args):
+        profiler = BlockProfiler(self.block_size(args))
+        sys.stdout.write("profile of 0x%x-0x%x, %d bytes in blocks of %d "
+                         "bytes\n  %s\n" %
+                         (address, address + length, length,
+                          profiler.block_size,
+                          "  ".join([ "%s %s" % (c, BlockProfiler.names[c])
+                                      for c in BlockProfiler.classes ])))
+        # [ start, end, class, blocks, entropy, zero, printable ]
+        ranges = list()
+        line = list()
+        line_start = address
+        try:
+            for (addr, size, cls, entropy, zero, printable) \
+                    in profiler.scan(address, length):
+                if not line:
+                    line_start = addr
+                line.append(cls)
+                if len(line) == self.map_width:
+                    sys.stdout.write("0x%x  %s\n" % (line_start, "".join(line)))
+                    line = list()
+                if ranges and ranges[-1][2] == cls:
+                    r = ranges[-1]
+                    r[1] = addr + size
+                    r[3] += 1
+                    r[4] += entropy
+                    r[5] += zero
+                    r[6] += printable
+                else:
+                    ranges.append([ addr, addr + size, cls, 1, entropy, zero,
+                                    printable ])
+        except KeyboardInterrupt:
+            sys.stderr.write("hexdump: interrupted\n")
+        if line:
+            sys.stdout.write("0x%x  %s\n" % (line_start, "".join(line)))
+
+        sys.stdout.write("%d ranges:\n" % len(ranges))
+        for r in ranges[:PROFILE_MAX_RANGES]:
+            n = r[3]
+            sys.stdout.write("0x%x-0x%x %12d  %-10s" %
+                             (r[0], r[1], r[1] - r[0],
+                              BlockProfiler.names[r[2]]))
+            if r[2] != "?":
+                sys.stdout.write("  entropy %.2f  zero %5.1f%%  printable "
+                                 "%5.1f%%" % (r[4] / n, r[5] * 100 / n,
+                                              r[6] * 100 / n))
+            sys.stdout.write("\n")
+        if len(ranges) > PROFILE_MAX_RANGES:
+            sys.stdout.write("... %d more ranges\n" %
+                             (len(ranges) - PROFILE_MAX_RANGES))
+        return True
+
+class MemorySearch(object):
+    """Search several patterns at once in the inferior memory
+
+'patterns' is a list of (label, regular expression source, literal),
+where 'literal' is the bytes of a literal pattern, or None for a
+regular expression.  The patterns are compiled into one zero-width
+regular expression, so each chunk of the memory is scanned only once;
+only at the positions it finds, each pattern is matched on its own, so
+the overlapping matches of different patterns are all reported.
+A single literal pattern is searched with str.find() instead.
+
+A regular expression with groups or inline flags would change the
+others in the combined expression, so it is scanned on its own.
+
+A chunk that cannot be read is reported by error(), and the search
+goes on with the next chunk; 'skipped' is the number of bytes that were
+not searched."""
+
+    re_flags = re.compile(r"\(\?[iLmsux]+\)")
+
+    def __init__(self, patterns):
+        self.literal = None
+        if len(patterns) == 1 and patterns[0][2] != None:
+            self.literal = patterns[0][2]
+        self.labels = [ p[0] for p in patterns ]
+        self.regexes = [ re.compile(p[1], re.DOTALL) for p in patterns ]
+        # The indices of the patterns in the combined expression, and
+        # (index, zero-width expression) of the patterns scanned alone
+        self.joined = list()
+        self.alone = list()
+        for (i, p) in enumerate(patterns):
+            if self.regexes[i].groups == 0 and \
+               MemorySearch.re_flags.search(p[1]) == None:
+                self.joined.append(i)
+            else:
+                self.alone.append((i, re.compile("(?=%s)" % p[1],
+                                                 re.DOTALL)))
+        self.regex = None
+        if self.joined:
+            self.regex = re.compile("(?=%s)" %
+                                    "|".join([ "(?:%s)" % patterns[i][1]
+                                               for i in self.joined ]),
+                                    re.DOTALL)
+        literals = [ p[2] for p in patterns ]
+        if None in literals:
+            self.overlap = SEARCH_OVERLAP
+        else:
+            self.overlap = max(map(len, literals)) - 1
+        self.scanned = 0
+        self.skipped = 0
+
+    def read(self, pos, size, end):
+        """Read the chunk at POS with the overlap, or without it if the
+overlap is not readable; returns None if the chunk is not readable"""
+        try:
+            return read_inferior(pos, min(size + self.overlap, end - pos))
+        except gdb.MemoryError as e:
+            debug("search: 0x%x: %s" % (pos, e))
+        if self.overlap > 0 and pos + size < end:
+            try:
+                return read_inferior(pos, size)
+            except gdb.MemoryError:
+                pass
+        return None
+
+    def matches(self, data, size, pos, last):
+        """Returns (offset, pattern index, matched data) in a chunk"""
+        hits = list()
+        scans = list()
+        if self.regex != None:
+            scans.append((self.regex, self.joined))
+        for (i, regex) in self.alone:
+            scans.append((regex, [ i ]))
+        for (regex, indices) in scans:
+            for m in regex.finditer(data):
+                if m.start() >= size:
+                    break
+                for i in indices:
+                    if pos + m.start() < last[i]:
+                        continue
+                    match = self.regexes[i].match(data, m.start())
+                    if match != None:
+                        last[i] = pos + max(match.end(), m.start() + 1)
+                        hits.append((m.start(), i, match.group()))
+        if self.alone:
+            hits.sort(key = lambda h: h[:2])
+        return hits
+
+    def search(self, address, length, chunk_size = None):
+        """Generate (address, label, matched data) in [address, address+length)
+
+Each chunk is read with 'overlap' more bytes than it covers, and only
+the matches starting in the chunk itself are reported."""
+        if chunk_size == None:
+            chunk_size = max(MEMORY_CHUNK_SIZE, self.overlap * 4)
+        end = address + length
+        pos = address
+        # The end of the last match of each pattern; a pattern does not
+        # match again inside its own match.
+        last = [ 0 ] * len(self.regexes)
+        # The start of the unreadable chunks in a row
+        failed = None
+        while pos < end:
+            size = min(chunk_size, end - pos)
+            data = self.read(pos, size, end)
+            if data == None:
+                if failed == None:
+                    failed = pos
+                self.skipped += size
+            else:
+                if failed != None:
+                    error("cannot read 0x%x-0x%x, skipped" % (failed, pos))
+                    failed = None
+                if self.literal != None:
+                    idx = data.find(self.literal)
+                    while 0 <= idx < size:
+                        yield (pos + idx, self.labels[0], self.literal)
+                        idx = data.find(self.literal, idx + 1)
+                else:
+                    for (offset, i, text) in self.matches(data, size, pos,
+                                                          last):
+                        yield (pos + offset, self.labels[i], text)
+            pos += size
+            self.scanned = pos - address
+        if failed != None:
+            error("cannot read 0x%x-0x%x, skipped" % (failed, end))
+
+class HexdumpSearchCommand(GdbDumpMemoryParent):
+    """Search patterns in the memory
+
+usage: hexdump search START_ADDR END_ADDR [##] PATTERN... [OPTION...]
+       hexdump search --all [##] PATTERN... [OPTION...]
+
+Search every PATTERN in the memory from START_ADDR to END_ADDR, or in
+every readable mapping of 'info proc mappings' with '--all', and print
+the address of each match as soon as it is found.  PATTERN is one of:
+
+  -x HEX      bytes in hexadecimal, e.g. -x deadbeef or -x "de ad be ef"
+  -s STRING   a string, encoded by each ENCODING below
+  -r REGEX    a Python regular expression for bytes
+  STRING      same as '-s STRING'
+
+OPTION is one of:
+
+  #ENCODING   encode STRINGs in ENCODING (see 'help iconv memory');
+              more than one ENCODING searches each encoding.  Without
+              ENCODING, STRINGs are searched as typed.
+  --max N     stop after N matches (default: SEARCH_MAX_HITS)
+
+'##' is needed only if START_ADDR or END_ADDR has a blank in it.
+
+All patterns are searched in a single pass over large chunks of the
+memory, except that a REGEX with groups or inline flags takes its own
+pass.  Matches crossing a chunk boundary are found, as long as a
+regular expression match is shorter than SEARCH_OVERLAP bytes.  The
+chunks that cannot be read are reported and skipped.
+
+For example, to find a magic number in a buffer:
+
+    (gdb) hexdump search buf buf+len -x deadbeef
+
+To find a user name in both EUC-KR and UTF-8 in all mappings:
+
+    (gdb) hexdump search --all -s "kim" #euc_kr #utf_8 --max 10"""
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "hexdump search", -1)
+
+    @lazy
+    def encodings(self):
+        return IconvEncodings()
+
+    def complete(self, text, word):
+        if text.find("##") < 0:
+            return gdb.COMPLETE_SYMBOL
+        if text.endswith("#" + word):
+            return self.encodings.complete(text, word)
+        return gdb.COMPLETE_NONE
+
+    def parse_arguments(self, args):
+        if args.find("##") >= 0:
+            (dump_args, sep, exec_args) = args.partition("##")
+            return (dump_args.strip(), exec_args.strip())
+        # Without '##', the addresses are the first two words.
+        words = args.split(None, 1)
+        if words and words[0] == "--all":
+            return ("--all", len(words) > 1 and words[1].strip() or "")
+        words = args.split(None, 2)
+        if len(words) < 3:
+            return (args.strip(), "")
+        return ("%s %s" % (words[0], words[1]), words[2].strip())
+
+    def native(self, args):
+        return True
+
+    def patterns(self, args):
+        """Returns (list of patterns for MemorySearch, max hits)"""
+        argv = gdb.string_to_argv(args)
+        encodings = [ a for a in argv if a.startswith("#") ]
+        argv = [ a for a in argv if not a.startswith("#") ]
+        codecs = list()
+        for enc in encodings:
+            codec = self.encodings.codec(enc)
+            if codec == None:
+                raise RuntimeError("unknown encoding %s" % enc)
+            codecs.append((self.encodings.name(enc), codec))
+        inputenc = locale.getpreferredencoding() or "ascii"
+
+        patterns = list()
+        max_hits = SEARCH_MAX_HITS
+        while argv:
+            opt = argv.pop(0)
+            if opt in ("-x", "-s", "-r", "--max"):
+                if not argv:
+                    raise RuntimeError("%s requires an argument" % opt)
+                value = argv.pop(0)
+            else:
+                (opt, value) = ("-s", opt)
+
+            if opt == "--max":
+                try:
+                    max_hits = int(value, 0)
+                except ValueError:
+                    raise RuntimeError("invalid --max value, '%s'" % value)
+            elif opt == "-x":
+                try:
+                    data = "".join(value.split()).decode("hex")
+                except TypeError:
+                    raise RuntimeError("invalid hex pattern, '%s'" % value)
+                patterns.append(("x:" + value, re.escape(data), data))
+            elif opt == "-r":
+                try:
+                    re.compile(value)
+                except re.error as e:
+                    raise RuntimeError("invalid regex '%s': %s" % (value, e))
+                patterns.append(("r:" + value, value, None))
+            elif not codecs:
+                patterns.append(('"%s"' % value, re.escape(value), value))
+            else:
+                try:
+                    text = value.decode(inputenc)
+                except UnicodeError:
+                    raise RuntimeError("pattern '%s' is not valid %s" %
+                                       (value, inputenc))
+                for (name, codec) in codecs:
+                    data = text.encode(codec)
+                    patterns.append(('"%s" in %s' % (value, name),
+                                     re.escape(data), data))
+        if not patterns:
+            raise RuntimeError("no pattern to search")
+        return (patterns, max_hits)
+
+    def search(self, regions, args):
+        (patterns, max_hits) = self.patterns(args)
+        searcher = MemorySearch(patterns)
+        hits = 0
+        scanned = 0
+        try:
+            for (start, end) in regions:
+                searcher.scanned = 0
+                for (addr, label, data) in searcher.search(start,
+                                                           end - start):
+                    preview = data[:16].translate(
+                        HexdumpFormatter.ascii_table)
+                    sys.stdout.write("0x%x: %s |%s|\n" %
+                                     (addr, label, preview))
+                    hits += 1
+                    if hits >= max_hits:
+                        sys.stderr.write("hexdump: stopped after %d "
+                                         "matches at 0x%x\n" %
+                                         (hits, addr))
+                        return True
+                scanned += searcher.scanned
+        except KeyboardInterrupt:
+            sys.stderr.write("hexdump: interrupted after %d bytes, "
+                             "%d matches\n" % (scanned + searcher.scanned,
+                                               hits))
+            return True
+        sys.stdout.write("%d matches in %d bytes" %
+                         (hits, scanned - searcher.skipped))
+        if searcher.skipped:
+            sys.stdout.write(", %d bytes unreadable" % searcher.skipped)
+        sys.stdout.write("\n")
+        return True
+
+    def process(self, address, length, args):
+        return self.search([ (address, address + length) ], args)
+
+    def invoke(self, args, from_tty):
+        (search_args, background) = split_background(args)
+        (dump_args, exec_args) = self.parse_arguments(search_args)
+        if dump_args != "--all":
+            return GdbDumpMemoryParent.invoke(self, args, from_tty)
+        if background:
+            print "%s: cannot run in the background" % self.stats_name
+            return
+        self.search_all(exec_args)
+
+    @timed
+    def search_all(self, exec_args):
+        try:
+            regions = [ (start, end) for (start, end, objfile)
+                        in proc_mappings() ]
+            self.search(regions, exec_args)
+        except RuntimeError as e:
+            print e
+
+class HexdumpEachCommand(BatchImpl, gdb.Command):
+    """Dump many values at once using hexdump(1)
+
+usage: hexdump each ELEMENTS [OPTION...] [## HEXDUMP-OPTION...]
+
+Dump each element of ELEMENTS with a header line, like 'hexdump value'
+does for a single value.  See 'help hexdump value' for HEXDUMP-OPTION.
+The elements are dumped in-process if possible; otherwise, a single
+tool run dumps every element with hexdump(1), see run_tool_batch().
+
+ELEMENTS is either an array slice, EXPR[LO..HI] optionally followed by
+a member access, or a linked list, '--list HEAD NEXT'.  OPTION is one
+of '--field NAME', '--size N' and '--max N'.  See BatchImpl for the
+details.  With a trailing '&', the elements are copied at once, and
+processed in the background; see 'help gdbx jobs'.
+
+For example, to dump the 'buf' member of 100 messages:
+
+    (gdb) hexdump each msgs[0..99].buf
+
+To dump the nodes of a linked list, following 'node->next':
+
+    (gdb) hexdump each --list head next ## -x"""
+
+    def __init__(self):
+        gdb.Command.__init__(self, "hexdump each", gdb.COMMAND_DATA, -1)
+        self.stats_name = "hexdump each"
+        self.impl = HexdumpImpl()
+        self.register("hexdump")
+
+    def complete(self, text, word):
+        return self.impl.complete(text, word)
+
+    def process_batch(self, batch, args, job = None):
+        out = job and job.out or sys.stdout
+        if self.impl.native(args):
+            for (label, address, data) in batch:
+                self.header(label, address, len(data), out)
+                self.impl.process(address, len(data), args,
+                                  data_reader(address, data), out)
+            return
+
+        # hexdump(1) runs over every element in a single tool run.
+        tmpdir = tempfile.mkdtemp(prefix="gdbx-")
+        try:
+            elements = self.save_batch(batch, tmpdir)
+            if not elements:
+                return
+            cmdlines = [ self.impl.commandline(os.path.join(tmpdir, name),
+                                               args)
+                         for (label, address, length, name) in elements ]
+            results = run_tool_batch(cmdlines, job and job.cancel)
+            for ((label, address, length, name), (status, output, err)) \
+                    in zip(elements, results):
+                self.header(label, address, length, out)
+                out.write(output)
+                out.write(err)
+        finally:
+            self.remove_batch(tmpdir)
+
+HexdumpCommand()
+HexdumpValueCommand()
+HexdumpMemoryCommand()
+HexdumpSnapshotCommand()
+HexdumpDiffCommand()
+HexdumpWatchCommand()
+HexdumpProfileCommand()
+HexdumpSearchCommand()
+HexdumpEachCommand()
+
+
+class IconvCommand(gdb.Command):
+    """Check the character encoding of the data"""
+    def __init__(self):
+        gdb.Command.__init__(self, "iconv", gdb.COMMAND_DATA, -1, True)
+
+class IconvEncodings(object):
+    encodings = None
+    codecs = dict()
+    sys_reloaded = False
+    completion_index = None
+    ngram_size = 2
+    replaces = "./:-()"
+    
+    @staticmethod
+    def supported_encodings():
+        ret = dict()
+        try:
+            p = subprocess.Popen([ICONV_PATH, "-l"], stdout=subprocess.PIPE)
+            outbuf = p.communicate()[0]
+            enclist = outbuf.split("\n")
+            for enc in enclist:
+                # 'enc' is something like "ANSI_X3.110-1983//"
+                enc = enc.rstrip("/")
+                alias = enc.lower()
+
+                for repl in IconvEncodings.replaces:
+                    alias = alias.replace(repl, "_")
+                
+                ret[alias] = enc
+        except:
+            print "error: cannot get supported encoding list"
+            raise
+        
+        return ret
+
+    @staticmethod
+    def cache_key():
+        st = os.stat(ICONV_PATH)
+        return { "path": ICONV_PATH, "size": st.st_size,
+                 "mtime": st.st_mtime }
+
+    @staticmethod
+    def load_cache():
+        """Return the encodings from ICONV_CACHE_PATH, or None if stale"""
+        import json
+        try:
+            with open(ICONV_CACHE_PATH) as f:
+                cache = json.load(f)
+            key = IconvEncodings.cache_key()
+            for k in key:
+                if cache.get(k) != key[k]:
+                    debug("iconv cache: %s is changed" % k)
+                    return None
+            return dict([ (str(a), str(e))
+                          for (a, e) in cache["encodings"].iteritems() ])
+        except (IOError, OSError, ValueError, KeyError, AttributeError) as e:
+            debug("iconv cache: cannot load %s: %s" % (ICONV_CACHE_PATH, e))
+            return None
+
+    @staticmethod
+    def save_cache(encodings):
+        import json
+        try:
+            cache = IconvEncodings.cache_key()
+            cache["encodings"] = encodings
+            dirname = os.path.dirname(ICONV_CACHE_PATH)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmpname = "%s.%d" % (ICONV_CACHE_PATH, os.getpid())
+            with open(tmpname, "w") as f:
+                json.dump(cache, f)
+            os.rename(tmpname, ICONV_CACHE_PATH)
+            return True
+        except (IOError, OSError) as e:
+            debug("iconv cache: cannot save %s: %s" % (ICONV_CACHE_PATH, e))
+            return False
+
+    @staticmethod
+    def table(rebuild = False):
+        """Return the encoding table, a dictionary maps aliases to names
+
+The table is loaded on the first call, from ICONV_CACHE_PATH if it is
+up to date, otherwise from iconv(1), then saved to the cache."""
+        if IconvEncodings.encodings == None or rebuild:
+            start = time.time()
+            encodings = None
+            if not rebuild:
+                encodings = IconvEncodings.load_cache()
+            if encodings == None:
+                encodings = IconvEncodings.supported_encodings()
+                IconvEncodings.save_cache(encodings)
+            IconvEncodings.encodings = encodings
+            IconvEncodings.codecs = dict()
+            IconvEncodings.completion_index = None
+            INIT_TIMES["IconvEncodings.table"] = time.time() - start
+        return IconvEncodings.encodings
+
+    @staticmethod
+    def setup():
+        """Set the default encoding from the locale, once
+
+The iconv commands that convert into the default encoding call this
+before they use it.  Other users of the encoding table, such as
+'hexdump search', leave the default encoding alone."""
+        if not IconvEncodings.sys_reloaded:
+            # sys.setdefaultencoding() is only available after reload(sys).
+            reload(sys)
+            set_default_encoding()
+            IconvEncodings.sys_reloaded = True
+            
+    def name(self, alias):
+        """Return the actual encoding name if exists, otherwise None"""
+        alias = alias.lstrip("#")
+        encodings = IconvEncodings.table()
+        if encodings.has_key(alias):
+            return encodings[alias]
+        return None
+
+    def codec(self, name):
+        """Return the Python codec name of the encoding 'name'
+
+'name' is either an actual encoding name or an alias.  Returns None if
+Python does not support the encoding."""
+        name = name.lstrip("#")
+        if name in IconvEncodings.codecs:
+            return IconvEncodings.codecs[name]
+        ret = None
+        for candidate in (self.name(name), name):
+            if candidate == None:
+                continue
+            try:
+                info = codecs.lookup(candidate)
+                # Skip bytes-to-bytes codecs such as 'hex' or 'zlib'.
+                if isinstance(info.decode("")[0], unicode):
+                    ret = info.name
+                    break
+            except (LookupError, TypeError):
+                pass
+        IconvEncodings.codecs[name] = ret
+        return ret
+
+    def complete(self, text, word):
+        """Callback for auto completion, used in gdb.Command.complete()
+
+Returns the aliases start with 'word'.  If there is none, returns the
+aliases contain 'word' instead, e.g. 'kr' gives 'euc_kr' and
+'iso_2022_kr'."""
+        debug("Encodings.complete(): text(%s) word(%s)" % (text, word))
+        ret = self.complete_prefix(word)
+        if not ret and len(word) >= IconvEncodings.ngram_size:
+            ret = self.complete_substring(word)
+        return ret
+
+    @staticmethod
+    def index():
+        """Return the completion index (sorted aliases, n-gram index)
+
+The n-gram index maps every n-gram of the aliases into the set of
+positions of the aliases in the sorted list.  Both are built once per
+encoding table."""
+        table = IconvEncodings.table()
+        if IconvEncodings.completion_index == None:
+            aliases = sorted([ a for a in table.iterkeys() if a ])
+            ngrams = dict()
+            n = IconvEncodings.ngram_size
+            for (pos, alias) in enumerate(aliases):
+                for i in xrange(len(alias) - n + 1):
+                    ngrams.setdefault(alias[i:i + n], set()).add(pos)
+            IconvEncodings.completion_index = (aliases, ngrams)
+        return IconvEncodings.completion_index
+
+    def complete_prefix(self, word):
+        import bisect
+        (aliases, ngrams) = IconvEncodings.index()
+        ret = list()
+        pos = bisect.bisect_left(aliases, word)
+        while pos < len(aliases) and aliases[pos].startswith(word):
+            ret.append(aliases[pos])
+            pos += 1
+        return ret
+
+    def complete_substring(self, word):
+        (aliases, ngrams) = IconvEncodings.index()
+        n = IconvEncodings.ngram_size
+        candidates = None
+        for i in xrange(len(word) - n + 1):
+            positions = ngrams.get(word[i:i + n], set())
+            if candidates == None:
+                candidates = positions
+            else:
+                candidates = candidates & positions
+            if not candidates:
+                return []
+        return [ aliases[pos] for pos in sorted(candidates)
+                 if word in aliases[pos] ]
+        
+class IconvEncodingCommand(gdb.Command):
+    """Set/get the current character encoding
+
+usage: iconv encoding [ENCODING]
+
+If ENCODING is not provided, this command shows the current system encoding.
+If provided, this command set the current system encoding to ENCODING.
+
+Once set, 'iconv value' and 'iconv memory' will try to convert the
+given data into ENCODING.
+
+Note that this changes the internal 'system default encoding' in
+Python runtime."""
+    
+    def __init__(self):
+        gdb.Command.__init__(self, "iconv encoding", gdb.COMMAND_DATA, -1)
+
+    @lazy
+    def encodings(self):
+        return IconvEncodings()
+        
+    def invoke(self, arg, from_tty):
+        arg = arg.strip()
+        debug("arg: '%s'" % arg)
+        IconvEncodings.setup()
+        if arg == "":
+            print sys.getdefaultencoding()
+        else:
+            enc = self.encodings.name(arg)
+            if enc != None:
+                try:
+                    sys.setdefaultencoding(enc)
+                except LookupError as e:
+                    error("encoding %s is not supported by Python" % enc)
+            else:
+                error("invalid encoding alias, %s." % arg)
+    def complete(self, text, word):
+        debug("iconv encoding complete: text(%s) word(%s)" % (text, word))
+        return self.encodings.complete(text, word)
+        
+class IconvRebuildCacheCommand(gdb.Command):
+    """Rebuild the cache of the encodings supported by iconv(1)
+
+usage: iconv rebuild-cache
+
+The list of the encodings is taken from 'iconv -l' once, and cached in
+ICONV_CACHE_PATH.  The cache is rebuilt automatically if the iconv(1)
+binary is changed.  Use this command to rebuild it anyway."""
+
+    def __init__(self):
+        gdb.Command.__init__(self, "iconv rebuild-cache", gdb.COMMAND_DATA,
+                             gdb.COMPLETE_NONE)
+
+    def invoke(self, arg, from_tty):
+        encodings = IconvEncodings.table(rebuild = True)
+        if os.path.exists(ICONV_CACHE_PATH):
+            sys.stdout.write("%d encodings are cached in %s\n" %
+                             (len(encodings), ICONV_CACHE_PATH))
+        else:
+            error("cannot write the cache, %s" % ICONV_CACHE_PATH)
+
+class IconvImpl(object):
+    def __init__(self):
+        pass
+
+    @lazy
+    def re_encoding(self):
+        return re.compile(r"([ ]*(#[a-z0-9_]+))+")
+
+    @lazy
+    def encodings(self):
+        return IconvEncodings()
+        
+    def partition(self, args):
+        m = self.re_encoding.search(args)
+        if m == None:
+            return (args, "")
+        else:
+            idx = m.start()
+            return (args[:idx], args[idx:])
+            
+    def format_error(self, errbuf):
+        """Format iconv(1)-related error message
+
+Currently, capture the only first line, removing iconv pathname"""
+        (msg, dummy1, dummy2) = errbuf.partition("\n")
+        idx = msg.find("iconv: ")
+        if idx >= 0:
+            return msg[idx:]
+        
+    def target_encodings(self, args):
+        """Return the list of the actual encoding names in 'args'"""
+        encodings = list()
+        for e in args.split():
+            realname = self.encodings.name(e)
+            if realname != None:
+                debug("  target encoding: %s" % self.encodings.name(e))
+                encodings.append(realname)
+            else:
+                error("unknown encoding alias %s, ignored" % e)
+        return encodings
+
+    def target_encoding(self):
+        """Return the encoding to convert into, the default encoding"""
+        IconvEncodings.setup()
+        return sys.getdefaultencoding()
+
+    def conversion(self, args):
+        """Return (target, [(name, codec)...]) of the encodings in 'args'
+
+The codec is the Python codec of an encoding, or None if iconv(1) is
+needed.  This sets up the default encoding and looks up the encoding
+table, which are shared by the whole process, so a background job gets
+the conversion from the main thread, see job_args()."""
+        target = self.target_encoding()
+        return (target, [ (name, self.encodings.codec(name))
+                          for name in self.target_encodings(args) ])
+
+    def tool_encodings(self, conversion):
+        """Return the encoding names of 'conversion' that need iconv(1)"""
+        return [ name for (name, codec) in conversion[1] if codec == None ]
+
+    def iconv_cmdline(self, filename, enc, target):
+        return [ICONV_PATH, "-t", target, "-f", enc, filename]
+
+    def iconv_codec(self, data, codec, target):
+        """Convert 'data' using Python codecs, returns (output, error)
+
+The output and the error message mimic iconv(1); the output is
+converted up to the first invalid sequence."""
+        err = ""
+        try:
+            text = data.decode(codec)
+        except UnicodeDecodeError as e:
+            text = data[:e.start].decode(codec)
+            if e.end >= len(data) and (e.reason.find("incomplete") >= 0 or
+                                       e.reason.find("end of data") >= 0):
+                err = "iconv: incomplete character or shift sequence " \
+                      "at end of buffer\n"
+            else:
+                err = "iconv: illegal input sequence at position %d\n" % \
+                      e.start
+        try:
+            out = text.encode(target)
+        except UnicodeEncodeError as e:
+            out = text[:e.start].encode(target)
+            err = "iconv: cannot convert\n"
+        return (out, err)
+
+    def convert(self, data, conversion, filename = None, outfile = None,
+                tool_results = None):
+        """Convert 'data' from every encodings of 'conversion' into the target
+
+'conversion' is the result of conversion().  Python codecs are used
+for the encodings known to Python, iconv(1) is used for the rest.  'filename' is the pathname of a file contains
+'data' for iconv(1).  If not provided, a temporary file is created on
+demand.  The iconv(1) conversions run at once on the tool pool, see
+run_tools().  If 'tool_results' is not None, iconv(1) is not run; the
+results are taken from 'tool_results' instead, an iterator of
+(status, output, error) of the iconv(1) encodings in order, see
+tool_encodings().  The result is written to 'outfile', or the standard
+output if 'outfile' is None, in the order of 'args'."""
+        outfile = outfile or sys.stdout
+        (target, encodings) = conversion
+        if not encodings:
+            error("no valid encoding is provided")
+            return True
+
+        width = max([ len(name) for (name, codec) in encodings ])
+
+        outfile.write("Target encoding is %s:\n" % target)
+
+        inp = None
+        try:
+            # (output, error) of each encoding
+            results = [ None ] * len(encodings)
+            tools = list()
+            requests = list()
+            for (i, (enc, codec)) in enumerate(encodings):
+                if codec != None:
+                    debug("decoding %s with Python codec %s" % (enc, codec))
+                    results[i] = self.iconv_codec(data, codec, target)
+                elif tool_results != None:
+                    (status, out, err) = next(tool_results)
+                    results[i] = (out, err)
+                elif filename != None:
+                    tools.append(i)
+                    requests.append((self.iconv_cmdline(filename, enc,
+                                                        target), None))
+                else:
+                    if inp == None:
+                        inp = ToolInput([ data ]).__enter__()
+                    tools.append(i)
+                    requests.append((self.iconv_cmdline(inp.path, enc,
+                                                        target), inp.feed()))
+            if requests:
+                for (i, (status, out, err)) in zip(tools,
+                                                   run_tools(requests)):
+                    results[i] = (out, err)
+
+            for ((enc, codec), (out, err)) in zip(encodings, results):
+                try:
+                    outfile.write("%*s: " % (width, enc))
+                    outfile.write("|%s|\n" % out)
+                except TypeError as e:
+                    outfile.write("\n")
+                    error("TypeError: %s" % e)
+                    error("Try to change the default encoding")
+                if err != "":
+                    outfile.write("\t%s\n" % self.format_error(err))
+        finally:
+            if inp != None:
+                inp.__exit__(None, None, None)
+        return True
+
+    def execute_iconv(self, filename, args):
+        debug("execute_iconv('%s', '%s')" % (filename, args))
+        with open(filename, "rb") as f:
+            data = f.read()
+        return self.convert(data, self.conversion(args), filename)
+
+    def process_iconv(self, address, length, args):
+        debug("process_iconv(0x%x, %d, '%s')" % (address, length, args))
+        return self.convert(read_memory(address, length),
+                            self.conversion(args))
+        
+    def complete_any(self, text, word):
+        debug("complete: text(%s), word(%s)" % (text, word))
+        if text.endswith("#" + word):
+            debug("complete for encoding...")
+            return self.encodings.complete(text, word)
+        else:
+            debug("complete for symbol...")
+            return gdb.COMPLETE_SYMBOL
+        
+class IconvValueCommand(GdbDumpValueParent, IconvImpl):
+    """Check the encoding of the value EXPR.
+
+usage: iconv value EXPR ENCODING [ENCODING]... [&]
+
+Send a value EXPR to iconv(1) command to check the encoding of the
+contents.  ENCODING is the source encoding of the memory region.  The
+target encoding is controlled via 'iconv encoding' command.
+
+If more than one ENCODING provided, the data is read once and
+converted for each ENCODING.  Python codecs are used when Python knows
+the ENCODING; otherwise iconv(1) is called for the ENCODING.
+
+ENCODING is an alias name that has a form '#name', where 'name' is
+a encoding name except these:
+
+  1. all capital letters are in lower-cases
+  2. all non-alpha-numeric characters are substituted to the
+     underline character('_').
+
+For example, to use the character encoding 'ISO_8859-10:1992', the
+ENCODING should be 'iso_8859_10_1992'.  Note that this command will
+support auto-completion for the ENCODING.
+
+For example, if you know want to make sure that the value 'buffer'
+contains Korean character, but you don't know the exact encoding, you
+may try following:
+
+    (gdb) iconv memory buffer buffer+100 #euc_kr #cp949 #utf-8
+
+Then it will try three times for the encoding 'EUC-KR', 'CP949', and
+'UTF-8'.
+
+A value over 'gdbx max-bytes' bytes is refused, or only a part of it
+is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the value is copied at once, and converted in the
+background; see 'help gdbx jobs'."""
+    # iconv value EXPR #ENCODING...
+    
+    background = True
+    sampling = True
+
+    def __init__(self):
+        GdbDumpValueParent.__init__(self, "iconv value", -1)
+        IconvImpl.__init__(self)
+
+    def complete(self, text, word):
+        return self.complete_any(text, word)
+
+    def execute(self, filename, args, chunks = None):
+        return self.execute_iconv(filename, args)
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        return self.process_iconv(address, length, args)
+
+    def job_args(self, args):
+        return self.conversion(args)
+
+    def process_job(self, job, address, data, conversion):
+        return self.convert(data[:], conversion, outfile = job.out)
+    
+    def parse_arguments(self, args):
+        return self.partition(args)
+        
+class IconvMemoryCommand(GdbDumpMemoryParent, IconvImpl):
+    """Check the encoding of the memory.
+
+usage: iconv memory START_ADDR END_ADDR ENCODING [ENCODING]... [&]
+
+Send a memory region to iconv(1) command to check the encoding of the
+contents.  ENCODING is the source encoding of the memory region.  The
+target encoding is controlled via 'iconv encoding' command.
+
+If more than one ENCODING provided, the data is read once and
+converted for each ENCODING.  Python codecs are used when Python knows
+the ENCODING; otherwise iconv(1) is called for the ENCODING.
+
+ENCODING is an alias name that has a form '#name', where 'name' is
+a encoding name except these:
+
+  1. all capital letters are in lower-cases
+  2. all non-alpha-numeric characters are substituted to the
+     underline character('_').
+
+For example, to use the character encoding 'ISO_8859-10:1992', the
+ENCODING should be 'iso_8859_10_1992'.  Note that this command will
+support auto-completion for the ENCODING.
+
+For example, if you know want to make sure that the memory from
+'buffer' to 'buffer+100' contains Korean character, but you don't know
+the exact encoding, you may try following:
+
+    (gdb) iconv memory buffer buffer+100 #euc_kr #cp949 #utf-8
+
+Then it will try three times for the encoding 'EUC-KR', 'CP949', and
+'UTF-8'.
+
+A memory region over 'gdbx max-bytes' bytes is refused, or only a part
+of it is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the memory is copied at once, and converted in
+the background; see 'help gdbx jobs'."""
+    # iconv value EXPR #ENCODING...
+    
+    background = True
+    sampling = True
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "iconv memory", -1)
+        IconvImpl.__init__(self)
+
+    def complete(self, text, word):
+        return self.complete_any(text, word)
+
+    def execute(self, filename, args, chunks = None):
+        return self.execute_iconv(filename, args)
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        return self.process_iconv(address, length, args)
+
+    def job_args(self, args):
+        return self.conversion(args)
+
+    def process_job(self, job, address, data, conversion):
+        return self.convert(data[:], conversion, outfile = job.out)
+    
+    def parse_arguments(self, args):
+        r = self.partition(args)
+        debug("parse_argument: partition: %s" % repr(r))
+        return r
+
+class IconvDetector(object):
+    """Score the encodings by the statistics of the decoded data
+
+Every candidate is decoded over growing prefixes of the data
+('samples'), and the candidates which clearly fail are dropped after
+each round, so only the promising ones decode the whole data.
+
+The score of an encoding is the product of:
+
+  validity   -- the share of the bytes that are valid in the encoding
+  printable  -- the share of the decoded characters that are printable
+  ascii      -- how well ASCII bytes are preserved as ASCII characters
+  compact    -- how many non-ASCII bytes are combined into one character,
+                which prefers multibyte encodings that decode cleanly
+  script     -- the share of Latin letters in the non-ASCII characters
+                next to ASCII letters, which punishes single-byte
+                encodings that mix foreign scripts into words"""
+
+    samples = (4 * 1024, 64 * 1024, 1024 * 1024)
+    # Candidates whose invalid byte rate is higher than this are dropped.
+    max_invalid = 0.05
+    # Candidates scoring lower than (best * prune_ratio) are dropped.
+    prune_ratio = 0.8
+
+    ascii_bytes = "".join(map(chr, range(0x80)))
+
+    def __init__(self):
+        self.re_unprintable = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f"
+                                         u"\x7f-\x9f\ue000-\uf8ff\ufffd]")
+        self.re_mixed = re.compile(u"(?<=[A-Za-z])[^\x00-\x7f]|"
+                                   u"[^\x00-\x7f](?=[A-Za-z])")
+        self.re_latin = re.compile(u"[\xc0-\u024f\u1e00-\u1eff]")
+
+    def byte_classes(self, data):
+        """Returns (ascii, high, zero) byte counts of 'data'"""
+        high = len(data.translate(None, IconvDetector.ascii_bytes))
+        return (len(data) - high, high, data.count("\0"))
+
+    def score(self, data, codec):
+        """Returns (score, invalid rate, decoded text) of 'data' in 'codec'"""
+        if not data:
+            return (0.0, 0.0, u"")
+        try:
+            text = data.decode(codec, "replace")
+        except (UnicodeError, LookupError, TypeError):
+            return (0.0, 1.0, u"")
+        # Each invalid sequence is replaced with U+FFFD, so the invalid
+        # bytes are the rest of the valid characters encoded back; U+FFFD
+        # encoded in the data itself is valid.
+        invalid = 0.0
+        if u"\ufffd" in text:
+            try:
+                valid = len(text.replace(u"\ufffd", u"").encode(codec))
+            except (UnicodeError, LookupError, TypeError):
+                valid = len(data) - text.count(u"\ufffd")
+            try:
+                marker = u"\ufffd".encode(codec)
+                valid += data.count(marker) * len(marker)
+            except UnicodeError:
+                pass
+            invalid = float(max(0, len(data) - valid)) / len(data)
+        if not text:
+            return (0.0, invalid, text)
+
+        (ascii_in, high_in, zero_in) = self.byte_classes(data)
+        ascii_out = len(text.encode("ascii", "ignore"))
+        nonascii_out = len(text) - ascii_out
+        unprintable = len(self.re_unprintable.findall(text))
+
+        printable = 1.0 - float(unprintable) / len(text)
+        if ascii_in > zero_in:
+            ascii = min(1.0, float(ascii_out - text.count(u"\0")) /
+                        (ascii_in - zero_in))
+            ascii = max(ascii, 0.0)
+        else:
+            ascii = 1.0
+        if high_in > 0:
+            compact = max(0.0, 1.0 - float(nonascii_out) / high_in)
+        else:
+            compact = 1.0
+        mixed = u"".join(self.re_mixed.findall(text))
+        if mixed:
+            latin = len(self.re_latin.findall(mixed))
+            script = 0.5 + 0.5 * latin / len(mixed)
+        else:
+            script = 1.0
+        return ((1.0 - invalid) * printable * ascii * script *
+                (0.5 + 0.5 * compact), invalid, text)
+
+    def detect(self, data, candidates, keep = None):
+        """Rank 'candidates', a list of Python codec names, for 'data'
+
+At most 'keep' candidates (default: twice DETECT_TOP) survive each
+round.  Returns a list of (score, invalid rate, codec, decoded text),
+the best first."""
+        if keep == None:
+            keep = DETECT_TOP * 2
+        results = list()
+        for size in IconvDetector.samples + (len(data),):
+            size = min(size, len(data))
+            sample = data[:size]
+            results = list()
+            for codec in candidates:
+                (score, invalid, text) = self.score(sample, codec)
+                results.append((score, invalid, codec, text))
+            results.sort(key=lambda r: (-r[0], r[1], r[2]))
+            debug("detect: %d candidates over %d bytes" % (len(results), size))
+            if size == len(data):
+                break
+
+            best = results and results[0][0] or 0.0
+            survivors = [ r[2] for r in results
+                          if r[1] <= IconvDetector.max_invalid and
+                             r[0] >= best * IconvDetector.prune_ratio ]
+            if survivors:
+                candidates = survivors[:keep]
+            else:
+                candidates = [ r[2] for r in results[:keep] ]
+        return results
+
+class IconvDetectCommand(GdbDumpMemoryParent, IconvImpl):
+    """Guess the character encoding of the memory.
+
+usage: iconv detect START_ADDR END_ADDR [--top N] [ENCODING...]
+
+Read the memory from START_ADDR to END_ADDR once, and score every
+encoding known to both iconv(1) and Python by the statistics of the
+decoded data.  Only the first DETECT_MAX_BYTES bytes of a larger region
+are read and scored.  The statistics are the rate of invalid sequences,
+the share of printable characters, and the byte classes of the data.
+Then, the best N encodings (default: 5) are shown with the beginning of
+the decoded text.
+
+If ENCODING (an alias name of the form '#name', see 'help iconv
+memory') is provided, only those encodings are scored.  Otherwise, the
+encodings in DETECT_ENCODINGS, or all encodings if it is None.
+
+For example, to guess the encoding of 100 bytes from 'buffer':
+
+    (gdb) iconv detect buffer buffer+100
+
+To pick the best of three encodings:
+
+    (gdb) iconv detect buffer buffer+100 --top 1 #euc_kr #cp949 #utf_8"""
+
+    preview_width = 40
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "iconv detect", -1)
+        IconvImpl.__init__(self)
+
+    @lazy
+    def detector(self):
+        return IconvDetector()
+
+    def complete(self, text, word):
+        return self.complete_any(text, word)
+
+    def parse_arguments(self, args):
+        m = re.search(r"\s(--top|#)", args)
+        if m == None:
+            return (args, "")
+        return (args[:m.start()], args[m.start():])
+
+    def execute(self, filename, args, chunks = None):
+        error("iconv detect requires a memory region")
+        return True
+
+    def native(self, args):
+        return True
+
+    def candidates(self, args):
+        """Returns a dictionary maps Python codec names to encoding names"""
+        aliases = [ a for a in args.split() if a.startswith("#") ]
+        if not aliases:
+            if DETECT_ENCODINGS != None:
+                aliases = DETECT_ENCODINGS
+            else:
+                aliases = IconvEncodings.table().keys()
+
+        ret = dict()
+        for alias in aliases:
+            name = self.encodings.name(alias)
+            if name == None:
+                error("unknown encoding alias %s, ignored" % alias)
+                continue
+            codec = self.encodings.codec(alias)
+            if codec == None:
+                debug("%s is not supported by Python, ignored" % name)
+                continue
+            ret.setdefault(codec, set()).add(name)
+        return ret
+
+    def process(self, address, length, args):
+        top = DETECT_TOP
+        m = re.search(r"--top(?:\s+|=)(\S+)", args)
+        if m != None:
+            try:
+                top = int(m.group(1), 0)
+            except ValueError:
+                raise RuntimeError("invalid --top value, '%s'" % m.group(1))
+
+        candidates = self.candidates(args)
+        if not candidates:
+            error("no encoding to try")
+            return True
+
+        size = length
+        if DETECT_MAX_BYTES != 0:
+            size = min(length, DETECT_MAX_BYTES)
+        data = read_memory(address, size)
+        results = self.detector.detect(data, candidates.keys(),
+                                       max(top * 2, DETECT_TOP))
+
+        target = self.target_encoding()
+        if size < length:
+            sys.stdout.write("the first %d of %d bytes, " % (size, length))
+        else:
+            sys.stdout.write("%d bytes, " % length)
+        sys.stdout.write("%d candidate codecs, target encoding is %s:\n" %
+                         (len(candidates), target))
+        names = dict()
+        for (score, invalid, codec, text) in results[:top]:
+            aliases = sorted(candidates[codec])
+            names[codec] = ", ".join(aliases[:2])
+            if len(aliases) > 2:
+                names[codec] += " (+%d)" % (len(aliases) - 2)
+        width = max(map(len, names.values()) + [ 8 ])
+        sys.stdout.write("rank  score  invalid  %-*s  preview\n" %
+                         (width, "encoding"))
+        for (rank, (score, invalid, codec, text)) in enumerate(results[:top]):
+            preview = self.detector.re_unprintable.sub(u".", text)
+            preview = preview.replace(u"\t", u".").replace(u"\n", u".")
+            preview = preview.replace(u"\r", u".")
+            preview = preview[:IconvDetectCommand.preview_width]
+            sys.stdout.write("%4d  %.3f  %6.2f%%  %-*s  |%s|\n" %
+                             (rank + 1, score, invalid * 100, width,
+                              names[codec],
+                              preview.encode(target, "replace")))
+        return True
+
+class StringScanner(object):
+    """Find the strings of several encodings in the inferior memory
+
+'encodings' is a list of (name, Python codec name).  Each encoding has
+a regular expression of the bytes that may form its characters, so the
+candidate runs are found in bulk by the regular expression engine:
+
+  ascii             printable ASCII and TAB
+  utf-8             from a UTF-8 multibyte sequence, the sequences and
+                    printable ASCII; the printable ASCII just before the
+                    run is added to it
+  utf-16-le/be      printable ASCII and TAB in UTF-16, like strings -el
+  others            printable ASCII, TAB and any byte over 0x7f
+
+Each regular expression starts with a character class, so the regular
+expression engine skips the other bytes quickly.  The runs are decoded,
+and split where the decoding fails or at control characters; the
+pieces of 'minimum' characters or more are the strings.  Except for
+ascii and UTF-16, a string needs a non-ASCII character, as pure ASCII
+is left to ascii."""
+
+    ascii = "\t" + "".join([ chr(c) for c in xrange(0x20, 0x7f) ])
+    re_ascii = "[\t\x20-\x7e]"
+    re_utf8 = ("[\xc2-\xf4](?:(?<=[\xc2-\xdf])[\x80-\xbf]|"
+               "(?<=[\xe0-\xef])[\x80-\xbf]{2}|"
+               "(?<=[\xf0-\xf4])[\x80-\xbf]{3})")
+    re_high = re.compile("[\x80-\xff]")
+    re_control = re.compile(u"[\x00-\x08\x0a-\x1f\x7f-\x9f\ufffd]+")
+
+    def __init__(self, encodings, minimum):
+        self.minimum = minimum
+        self.scanners = list()
+        for (name, codec) in encodings:
+            ascii = StringScanner.re_ascii
+            n = "{%d,}" % (minimum - 1)
+            (high, lead) = (False, False)
+            if codec == "ascii":
+                regex = "%s%s%s" % (ascii, ascii, n)
+            elif codec == "utf-8":
+                utf8 = StringScanner.re_utf8
+                regex = "%s(?:%s+|%s)*" % (utf8, ascii, utf8)
+                lead = True
+            elif codec == "utf-16-le":
+                regex = "%s\x00(?:%s\x00)%s" % (ascii, ascii, n)
+            elif codec == "utf-16-be":
+                regex = "\x00%s(?:\x00%s)%s" % (ascii, ascii, n)
+            else:
+                regex = "[\t\x20-\x7e\x80-\xff]{%d,}" % minimum
+                high = True
+            self.scanners.append({ "name": name, "codec": codec,
+                                   "regex": re.compile(regex), "high": high,
+                                   "lead": lead, "last": 0 })
+
+    def strings(self, scanner, data, start, end, address):
+        """Generate (address, -end, name, text) in the candidate data[start:end]"""
+        codec = scanner["codec"]
+        run = data[start:end]
+        if scanner["high"] and not StringScanner.re_high.search(run):
+            return
+        try:
+            text = run.decode(codec)
+            if not StringScanner.re_control.search(text):
+                yield (address + start, -(address + end), scanner["name"],
+                       text)
+                return
+        except UnicodeDecodeError:
+            pass
+        pos = 0
+        while pos < len(run):
+            try:
+                text = run[pos:].decode(codec)
+                size = len(run) - pos
+            except UnicodeDecodeError as e:
+                text = run[pos:pos + e.start].decode(codec)
+                size = max(e.end, e.start + 1)
+            offset = 0
+            for piece in StringScanner.re_control.split(text):
+                if len(piece) >= self.minimum and \
+                   (not scanner["high"] or
+                    StringScanner.re_high.search(piece.encode(codec))):
+                    skip = text.index(piece, offset)
+                    begin = address + start + pos + \
+                            len(text[:skip].encode(codec))
+                    yield (begin, -(begin + len(piece.encode(codec))),
+                           scanner["name"], piece)
+                offset += len(piece)
+            pos += size
+
+    def scan(self, address, length, chunk_size = None):
+        """Generate (address, name, text) in [address, address+length)
+
+The chunks are scanned with a carry: a run that ends near the end of a
+chunk may continue in the next chunk, so it is scanned again with the
+next chunk, unless it is longer than STRINGS_MAX_RUN bytes.  The
+strings are generated in the order of the addresses, and a string
+inside another string (e.g. ASCII in UTF-8) is not reported."""
+        if chunk_size == None:
+            chunk_size = STRINGS_CHUNK_SIZE
+        end = address + length
+        pos = address
+        buf = ""
+        bufaddr = address
+        pending = list()
+        cover = 0
+        tail = self.minimum * 4
+        minimum = self.minimum
+        ascii = StringScanner.ascii
+        while pos < end:
+            size = min(chunk_size, end - pos)
+            buf += read_inferior(pos, size)
+            pos += size
+            final = pos >= end
+
+            carry = final and len(buf) or max(0, len(buf) - tail)
+            for sc in self.scanners:
+                last = sc["last"] - bufaddr
+                lead = sc["lead"]
+                for m in sc["regex"].finditer(buf):
+                    (start, stop) = m.span()
+                    if start < last:
+                        continue
+                    if lead:
+                        # Add the ASCII before the run, after the last run
+                        seg = buf[max(last, 0, start - STRINGS_MAX_RUN):start]
+                        start -= len(seg) - len(seg.rstrip(ascii))
+                    # A character may be cut at the end of the chunk.
+                    if stop >= len(buf) - 3 and not final and \
+                       stop - start < STRINGS_MAX_RUN:
+                        carry = min(carry, start)
+                        break
+                    last = stop
+                    if stop - start >= minimum:
+                        pending.extend(self.strings(sc, buf, start, stop,
+                                                    bufaddr))
+                sc["last"] = bufaddr + last
+
+            limit = bufaddr + carry
+            pending.sort()
+            keep = list()
+            for hit in pending:
+                if hit[0] >= limit and not final:
+                    keep.append(hit)
+                elif -hit[1] > cover:
+                    cover = -hit[1]
+                    yield (hit[0], hit[2], hit[3])
+            pending = keep
+            buf = buf[carry:]
+            bufaddr += carry
+            self.scanned = pos - address
+
+class IconvStringsCommand(GdbDumpMemoryParent, IconvImpl):
+    """Find the human-readable strings in the memory, like strings(1)
+
+usage: iconv strings START_ADDR END_ADDR [--min N] [--max N] [ENCODING...]
+
+Scan the memory from START_ADDR to END_ADDR for the strings of at
+least N characters (default: STRINGS_MIN) in the encodings ENCODING,
+and print each string with its address and the encoding.  ENCODING is
+an alias name of the form '#name' (see 'help iconv memory'); by
+default, the encodings in STRINGS_ENCODINGS, i.e. ASCII, UTF-8, and
+UTF-16 (LE and BE, the ASCII range only).  Other encodings such as
+'#euc_kr' or '#shift_jis' need a Python codec.
+
+The memory is scanned in chunks of STRINGS_CHUNK_SIZE bytes, and the
+strings across the chunks are found as a whole.  The scan stops after
+N strings with '--max N' (default: STRINGS_MAX_HITS); Ctrl-C also stops
+it.
+
+For example, to find the Korean strings in the heap, in EUC-KR or
+UTF-8:
+
+    (gdb) iconv strings heap_start heap_end --min 2 #euc_kr #utf_8"""
+
+    def __init__(self):
+        GdbDumpMemoryParent.__init__(self, "iconv strings", -1)
+        IconvImpl.__init__(self)
+
+    def complete(self, text, word):
+        return self.complete_any(text, word)
+
+    def parse_arguments(self, args):
+        m = re.search(r"\s(--min|--max|#)", args)
+        if m == None:
+            return (args, "")
+        return (args[:m.start()], args[m.start():])
+
+    def execute(self, filename, args, chunks = None):
+        error("iconv strings requires a memory region")
+        return True
+
+    def native(self, args):
+        return True
+
+    def option(self, args, name, default):
+        m = re.search(r"--%s(?:\s+|=)(\S+)" % name, args)
+        if m == None:
+            return default
+        try:
+            return int(m.group(1), 0)
+        except ValueError:
+            raise RuntimeError("invalid --%s value, '%s'" %
+                               (name, m.group(1)))
+
+    def process(self, address, length, args):
+        minimum = max(1, self.option(args, "min", STRINGS_MIN))
+        max_hits = self.option(args, "max", STRINGS_MAX_HITS)
+        aliases = [ a for a in args.split() if a.startswith("#") ]
+        encodings = list()
+        for alias in aliases or STRINGS_ENCODINGS:
+            codec = self.encodings.codec(alias)
+            if codec == None:
+                error("%s is not supported by Python, ignored" % alias)
+                continue
+            name = self.encodings.name(alias) or alias.lstrip("#")
+            encodings.append((name, codec))
+        if not encodings:
+            error("no encoding to try")
+            return True
+
+        target = self.target_encoding()
+        width = max([ len(e[0]) for e in encodings ])
+        scanner = StringScanner(encodings, minimum)
+        scanner.scanned = 0
+        hits = 0
+        try:
+            for (addr, name, text) in scanner.scan(address, length):
+                sys.stdout.write("0x%x  %-*s  %s\n" %
+                                 (addr, width, name,
+                                  text.encode(target, "replace")))
+                hits += 1
+                if hits >= max_hits:
+                    sys.stdout.write("stopped after %d strings, "
+                                     "at 0x%x\n" % (hits, addr))
+                    return True
+        except KeyboardInterrupt:
+            sys.stdout.write("interrupted after %d of %d bytes, "
+                             "%d strings\n" % (scanner.scanned, length, hits))
+            return True
+        sys.stdout.write("%d strings in %d bytes\n" % (hits, length))
+        return True
+
+class IconvEachCommand(BatchImpl, IconvImpl, gdb.Command):
+    """Check the encoding of many values at once.
+
+usage: iconv each ELEMENTS [OPTION...] ENCODING [ENCODING]...
+
+Convert each element of ELEMENTS from every ENCODING, like 'iconv
+value' does for a single value, with a header line per element.  See
+'help iconv value' for ENCODING.  The encodings that Python does not
+know are converted by iconv(1), in a single tool run for all the
+elements, see run_tool_batch().
+
+ELEMENTS is either an array slice, EXPR[LO..HI] optionally followed by
+a member access, or a linked list, '--list HEAD NEXT'.  OPTION is one
+of '--field NAME', '--size N' and '--max N'.  See BatchImpl for the
+details.  With a trailing '&', the elements are copied at once, and
+processed in the background; see 'help gdbx jobs'.
+
+For example, to check the 'name' member of 100 users:
+
+    (gdb) iconv each users[0..99].name #euc_kr #utf_8"""
+
+    def __init__(self):
+        gdb.Command.__init__(self, "iconv each", gdb.COMMAND_DATA, -1)
+        self.stats_name = "iconv each"
+        IconvImpl.__init__(self)
+        self.register("iconv")
+
+    def complete(self, text, word):
+        return self.complete_any(text, word)
+
+    def parse_batch(self, args):
+        (spec, encodings) = self.partition(args)
+        (spec, opts, dummy) = BatchImpl.parse_batch(self, spec)
+        return (spec, opts, encodings)
+
+    def job_args(self, args):
+        return self.conversion(args)
+
+    def process_batch(self, batch, conversion, job = None):
+        out = job and job.out or sys.stdout
+        encodings = self.tool_encodings(conversion)
+        if not encodings:
+            for (label, address, data) in batch:
+                self.header(label, address, len(data), out)
+                self.convert(data, conversion, outfile = out)
+            return
+
+        # iconv(1) converts every element in a single tool run.
+        target = conversion[0]
+        tmpdir = tempfile.mkdtemp(prefix="gdbx-")
+        try:
+            elements = self.save_batch(batch, tmpdir)
+            if not elements:
+                return
+            cmdlines = [ self.iconv_cmdline(os.path.join(tmpdir, name), enc,
+                                            target)
+                         for (label, address, length, name) in elements
+                         for enc in encodings ]
+            results = run_tool_batch(cmdlines, job and job.cancel)
+            for (label, address, length, name) in elements:
+                path = os.path.join(tmpdir, name)
+                with open(path, "rb") as f:
+                    data = f.read()
+                self.header(label, address, length, out)
+                self.convert(data, conversion, path, out, results)
+        finally:
+            self.remove_batch(tmpdir)
+
+class XmllintCommand(gdb.Command):
+    """Check the XML using xmllint(1)"""
+    def __init__(self):
+        gdb.Command.__init__(self, "xmllint", gdb.COMMAND_DATA, -1, True)
+
+class XmllintImpl(object):
+    def complete(self, text, word):
+        if text.find("##") < 0:
+            return gdb.COMPLETE_SYMBOL
+        else:
+            return gdb.COMPLETE_NONE
+        
+    def partition(self, args):
+        idx = args.rfind("##")
+        if idx < 0:
+            return (args, "")
+        else:
+            return (args[:idx].strip(), args[idx+2:].strip())
+
+    def commandline(self, filename, args):
+        # args is something like '--format --schema http://asdfadf --debug'
+        return "%s %s %s" % (XMLLINT_PATH, args, filename)
+
+    def native(self, args):
+        tokens = args.split()
+        return "--wellformed" in tokens and \
+               not [ t for t in tokens if t not in ("--wellformed", "--noout") ]
+
+    def process(self, address, length, args, reader = iter_memory,
+                out = None):
+        """Check the well-formedness with expat, chunk by chunk
+
+Stops at the first error, and reports the inferior address of the
+offending byte.  'reader' is a function like iter_memory(), which
+generates the data chunks of a region.  The result is written to 'out',
+or the standard output if 'out' is None."""
+        import xml.parsers.expat
+        out = out or sys.stdout
+        parser = xml.parsers.expat.ParserCreate()
+        done = 0
+        try:
+            for (addr, data) in reader(address, length):
+                parser.Parse(data, False)
+                done += len(data)
+            parser.Parse("", True)
+        except xml.parsers.expat.ExpatError as e:
+            offset = parser.ErrorByteIndex
+            if offset < 0:
+                offset = done
+            out.write("error at 0x%x (offset %d, line %d, column %d): "
+                      "%s\n" % (address + offset, offset, e.lineno, e.offset,
+                                xml.parsers.expat.ErrorString(e.code)))
+            return True
+        except KeyboardInterrupt:
+            (out != sys.stdout and out or sys.stderr).write(
+                "xmllint: interrupted after %d of %d bytes (0x%x-0x%x)\n" %
+                (done, length, address, address + done))
+            return True
+        out.write("well-formed, %d bytes (0x%x-0x%x)\n" %
+                  (length, address, address + length))
+        return True
+
+    def execute(self, filename, args):
+        """Check the dump file of a value that is not in the memory"""
+        size = os.path.getsize(filename)
+        if size == 0:
+            return self.process(0, 0, args, data_reader(0, ""))
+        import mmap
+        with open(filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                return self.process(0, size, args, data_reader(0, data))
+            finally:
+                data.close()
+        
+class XmllintValueCommand(GdbDumpValueParent):
+    """Check the value of an expression as a full XML document
+
+Usage: xmllint value EXPR [## ARGUMENTS...] [&]
+
+Send the value of EXPR to xmllint(1) to check the validity.
+
+ARGUMENTS is the additional arguments that will be passed to
+xmllint(1).  If you use ARGUMENTS, make sure to separate them from
+EXPR using '##'.
+
+To validate 'xml_buffer', just use:
+
+    (gdb) xmllint value xml_buffer
+    
+To validate 'xml_buffer' and to indent for human-readability:
+    
+    (gdb) xmllint value xml_buffer ## --format
+
+If ARGUMENTS is '--wellformed', xmllint(1) is not used.  Instead, the
+value is checked in-process, chunk by chunk, whether it is a
+well-formed XML document.  On error, the address of the offending byte
+is reported:
+
+    (gdb) xmllint value xml_buffer ## --wellformed
+
+A value over 'gdbx max-bytes' bytes is refused, or only a part of it
+is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the value is copied at once, and checked in the
+background while you keep debugging; see 'help gdbx jobs'.
+"""
+    background = True
+    sampling = True
+
+    def __init__(self):
+        # xmllint value EXPR ## OPTIONS...
+        
+        GdbDumpValueParent.__init__(self, "xmllint value", -1)
+        self.impl = XmllintImpl()
+        
+    def complete(self, text, word):
+        debug("xmllint value complete: text(%s) word(%s)" % (text, word))
+        return self.impl.complete(text, word)
+
+    def parse_arguments(self, args):
+        return self.impl.partition(args)
+
+    def commandline(self, filename, args):
+        return self.impl.commandline(filename, args)
+
+    def execute(self, filename, args, chunks = None):
+        if self.native(args):
+            return self.impl.execute(filename, args)
+        return GdbDumpParent.execute(self, filename, args, chunks)
+
+    def native(self, args):
+        return self.impl.native(args)
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args)
+
+    def process_job(self, job, address, data, args):
+        if not self.native(args):
+            return GdbDumpParent.process_job(self, job, address, data, args)
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out)
+    
+class XmllintMemoryCommand(GdbDumpMemoryParent):
+    """Check the contents of memory as a full XML document
+
+Usage: xmllint memory START_ADDR END_ADDR [## ARGUMENTS...] [&]
+
+Send the memory from the address START_ADDR to the address END_ADDR to
+xmllint(1) to check the validity.
+
+ARGUMENTS is the additional arguments that will be passed to
+xmllint(1).  If you use ARGUMENTS, make sure to separate them from
+EXPR using '##'.
+
+To validate a memory from 'xml_buffer' to plus 100 units:
+
+    (gdb) xmllint memory xml_buffer xml_buffer+100
+
+If 'xml_buffer' is not an array of character, you may need to cast it:
+
+    (gdb) xmllint memory xml_buffer ((char*)xml_buffer)+100
+
+To validate and to indent for human-readability:
+    
+    (gdb) xmllint value xml_buffer xml_buffer+100 ## --format
+
+If ARGUMENTS is '--wellformed', xmllint(1) is not used.  Instead, the
+memory is checked in-process, chunk by chunk, whether it is a
+well-formed XML document, using a constant amount of memory however
+large the document is.  On error, the address of the offending byte is
+reported:
+
+    (gdb) xmllint memory xml_buffer xml_buffer+100 ## --wellformed
+
+A memory region over 'gdbx max-bytes' bytes is refused, or only a part
+of it is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the memory is copied at once, and checked in the
+background while you keep debugging; see 'help gdbx jobs':
+
+    (gdb) xmllint memory xml_buffer xml_buffer+500000000 ## --noout &
+"""
+    background = True
+    sampling = True
+
+    def __init__(self):
+        # xmllint value EXPR ## OPTIONS...
+        
+        GdbDumpMemoryParent.__init__(self, "xmllint memory", -1)
+        self.impl = XmllintImpl()
+        
+    def complete(self, text, word):
+        debug("xmllint memory complete: text(%s) word(%s)" % (text, word))
+        return self.impl.complete(text, word)
+
+    def parse_arguments(self, args):
+        return self.impl.partition(args)
+
+    def commandline(self, filename, args):
+        return self.impl.commandline(filename, args)
+
+    def execute(self, filename, args, chunks = None):
+        if self.native(args):
+            return self.impl.execute(filename, args)
+        return GdbDumpParent.execute(self, filename, args, chunks)
+
+    def native(self, args):
+        return self.impl.native(args)
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args)
+
+    def process_job(self, job, address, data, args):
+        if not self.native(args):
+            return GdbDumpParent.process_job(self, job, address, data, args)
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out)
+    
+class XmllintEachCommand(BatchImpl, gdb.Command):
+    """Check many values at once as full XML documents
+
+usage: xmllint each ELEMENTS [OPTION...] [## ARGUMENTS...]
+
+Check each element of ELEMENTS as a full XML document, like 'xmllint
+value' does for a single value.  With '## --wellformed', each element
+is checked in-process with a header line.  Otherwise, every element is
+saved into a file named after the element in a temporary directory,
+and xmllint(1) runs once over all the files.
+
+ELEMENTS is either an array slice, EXPR[LO..HI] optionally followed by
+a member access, or a linked list, '--list HEAD NEXT'.  OPTION is one
+of '--field NAME', '--size N' and '--max N'.  See BatchImpl for the
+details.  With a trailing '&', the elements are copied at once, and
+processed in the background; see 'help gdbx jobs'.
+
+For example, to check the 'body' member of 100 requests:
+
+    (gdb) xmllint each reqs[0..99].body ## --noout"""
+
+    def __init__(self):
+        gdb.Command.__init__(self, "xmllint each", gdb.COMMAND_DATA, -1)
+        self.stats_name = "xmllint each"
+        self.impl = XmllintImpl()
+        self.register("xmllint")
+
+    def complete(self, text, word):
+        return self.impl.complete(text, word)
+
+    def process_batch(self, batch, args, job = None):
+        out = job and job.out or sys.stdout
+        if self.impl.native(args):
+            for (label, address, data) in batch:
+                self.header(label, address, len(data), out)
+                self.impl.process(address, len(data), args,
+                                  data_reader(address, data), out)
+            return
+
+        tmpdir = tempfile.mkdtemp(prefix="gdbx-")
+        try:
+            files = [ e[3] for e in self.save_batch(batch, tmpdir) ]
+            if not files:
+                return
+            cmdline = "cd %s && %s" % \
+                      (tmpdir, self.impl.commandline(" ".join(files), args))
+            (status, dummy, err) = run_tool(cmdline, None, out,
+                                            job and job.cancel)
+            out.write(err)
+        finally:
+            self.remove_batch(tmpdir)
+
+IconvCommand()
+IconvEncodingCommand()
+IconvValueCommand()
+IconvMemoryCommand()
+IconvDetectCommand()
+IconvStringsCommand()
+IconvRebuildCacheCommand()
+IconvEachCommand()
+
+XmllintCommand()
+XmllintValueCommand()
+XmllintMemoryCommand()
+XmllintEachCommand()
+
+class JsonlintCommand(gdb.Command):
+    """Check the JSON in-process"""
+    def __init__(self):
+        gdb.Command.__init__(self, "jsonlint", gdb.COMMAND_DATA, -1, True)
+
+class JsonSyntaxError(Exception):
+    """A syntax error of JsonValidator at the byte 'offset' of the data"""
+    def __init__(self, offset, line, column, message):
+        Exception.__init__(self, message)
+        self.offset = offset
+        self.line = line
+        self.column = column
+        self.message = message
+
+class JsonValidator(object):
+    """Incremental validator of JSON text (RFC 8259)
+
+The data is given chunk by chunk to feed(), then finish() is called;
+both raise JsonSyntaxError at the first error.  Only the unfinished
+token at the end of a chunk is kept for the next chunk, and a string is
+checked as it goes, so the memory used does not depend on the size of
+the document, except for a few items per open object or array.
+
+The tokens are checked one by one, but an object or an array that is
+complete within a chunk is checked at once by the C scanner of the
+json module, and a run of members or elements whose values are not
+objects nor arrays is matched at once by a regular expression.  If
+either fails, the tokens are checked one by one to find the error.
+
+With 'lines', the data is JSON Lines: every line is a JSON value (a
+record), and blank lines are ignored.
+
+A NUL byte after a complete value ends the data, like a C string in a
+larger buffer.  The bytes of a string are not checked to be UTF-8."""
+
+    # The tokens, by the group number; a comma takes the whitespace
+    # around it
+    (COMMA, WS, NEWLINE, STRING, NUMBER, LITERAL, OPEN, CLOSE,
+     COLON) = range(1, 10)
+    token = r"""
+        ([ \t\r\n]*,[ \t\r\n]*)
+      | ([ \t\r\n]+)
+      | (\n)
+      | (")
+      | (-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+      | (true|false|null)
+      | ([{\[])
+      | ([}\]])
+      | (:)"""
+    re_string = re.compile(r'(?:[^"\\\x00-\x1f]+|\\(?:["\\/bfnrt]|'
+                           r'u[0-9a-fA-F]{4}))*')
+    # The start of an escape sequence cut by the end of a chunk
+    re_partial_escape = re.compile(r"\\(?:u[0-9a-fA-F]{0,3})?$")
+
+    # The runs of members and elements, see runs(); the strings of a run
+    # have no comma, so that the values of a run are counted by its commas
+    run_string = (r'"[^"\\\x00-\x1f,]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})'
+                  r'[^"\\\x00-\x1f,]*)*"')
+    run_scalar = (r'(?:%s|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?'
+                  r'(?:[eE][+-]?[0-9]+)?|true|false|null)' % run_string)
+
+    # What is expected next
+    (VALUE, FIRST_VALUE, FIRST_KEY, KEY, COLON_NEXT, NEXT, DONE) = range(7)
+
+    @classmethod
+    def runs(cls, ws):
+        """Returns the regular expressions of the runs, with whitespace WS
+
+The first two match one or more members, and one or more elements; the
+last two match the members and the elements after a value."""
+        member = "%s%s:%s%s" % (cls.run_string, ws, ws, cls.run_scalar)
+        more_members = "(?:%s,%s%s)*" % (ws, ws, member)
+        more_elements = "(?:%s,%s%s)*" % (ws, ws, cls.run_scalar)
+        return (re.compile(ws + member + more_members),
+                re.compile(ws + cls.run_scalar + more_elements),
+                re.compile(more_members), re.compile(more_elements))
+
+    def __init__(self, lines = False):
+        import json
+        self.lines = lines
+        if lines:
+            self.regex = re.compile(self.token.replace(r"\r\n", r"\r"),
+                                    re.X)
+            (self.re_members, self.re_elements, self.re_more_members,
+             self.re_more_elements) = self.runs(r"[ \t\r]*")
+        else:
+            self.regex = re.compile(self.token, re.X)
+            (self.re_members, self.re_elements, self.re_more_members,
+             self.re_more_elements) = self.runs(r"[ \t\r\n]*")
+        self.scan_once = json.JSONDecoder(parse_float = str,
+                                          parse_int = str,
+                                          parse_constant = self.constant
+                                          ).scan_once
+        self.state = self.VALUE
+        # The open objects and arrays, as '{' or '[', with the number of
+        # the members or the elements of each
+        self.stack = bytearray()
+        self.counts = list()
+        # The bytes of the current token that span chunks
+        self.pending = ""
+        # The offset of the end of the data fed so far
+        self.offset = 0
+        # The number of newlines so far, and the offset of the current line
+        self.line = 0
+        self.line_start = 0
+        self.in_string = False
+        self.string_is_key = False
+        # True once a NUL byte ended the data
+        self.ended = False
+
+        self.max_depth = 0
+        self.objects = 0
+        self.arrays = 0
+        self.members = 0
+        self.elements = 0
+        # The number of the members or the elements of the largest object
+        # or array
+        self.largest = 0
+        self.records = 0
+
+    def constant(self, name):
+        # NaN and Infinity are not JSON
+        raise ValueError(name)
+
+    def fail(self, offset, message):
+        raise JsonSyntaxError(offset, self.line + 1,
+                              offset - self.line_start + 1, message)
+
+    def unexpected(self, offset, c):
+        """Fail for the unexpected byte 'c' at 'offset'"""
+        expected = { self.VALUE: "a value",
+                     self.FIRST_VALUE: "a value or ']'",
+                     self.FIRST_KEY: "a string or '}'",
+                     self.KEY: "a string",
+                     self.COLON_NEXT: "':'",
+                     self.NEXT: "',' or '%s'" %
+                     (self.stack and self.stack[-1] == ord("{")
+                      and "}" or "]"),
+                     self.DONE: self.lines and "the end of the line"
+                     or "the end of the data" }[self.state]
+        if " " <= c <= "~":
+            got = "'%s'" % c
+        else:
+            got = "byte 0x%02x" % ord(c)
+        self.fail(offset, "expected %s, got %s" % (expected, got))
+
+    def newlines(self, buf, pos, end, base):
+        """Count the lines of buf[pos:end]"""
+        count = buf.count("\n", pos, end)
+        if count:
+            self.line += count
+            self.line_start = base + buf.rindex("\n", pos, end) + 1
+
+    def value_done(self):
+        if self.stack:
+            self.counts[-1] += 1
+            self.state = self.NEXT
+        else:
+            self.state = self.DONE
+            self.records += 1
+
+    def scan(self, buf, pos, base):
+        """Check the object or the array at 'pos' at once; returns the end,
+or 'pos' if it is not complete or not valid within 'buf'."""
+        try:
+            (value, end) = self.scan_once(buf, pos)
+        except (StopIteration, ValueError, RuntimeError):
+            return pos
+        if self.lines and buf.find("\n", pos, end) >= 0:
+            return pos
+        self.newlines(buf, pos, end, base)
+        (objects, arrays, members, elements) = (0, 0, 0, 0)
+        (max_depth, largest) = (self.max_depth, self.largest)
+        stack = [ (value, len(self.stack) + 1) ]
+        while stack:
+            (value, depth) = stack.pop()
+            if depth > max_depth:
+                max_depth = depth
+            size = len(value)
+            if size > largest:
+                largest = size
+            if type(value) is dict:
+                objects += 1
+                members += size
+                value = value.itervalues()
+            else:
+                arrays += 1
+                elements += size
+            for item in value:
+                if type(item) is dict or type(item) is list:
+                    stack.append((item, depth + 1))
+        self.objects += objects
+        self.arrays += arrays
+        self.members += members
+        self.elements += elements
+        (self.max_depth, self.largest) = (max_depth, largest)
+        return end
+
+    def run(self, buf, pos, base, final):
+        """Match a run of members or elements at 'pos'; returns the end"""
+        state = self.state
+        if state == self.NEXT:
+            regex = self.stack[-1] == ord("{") and self.re_more_members \
+                    or self.re_more_elements
+        elif state == self.FIRST_KEY or state == self.KEY:
+            regex = self.re_members
+        elif state == self.FIRST_VALUE or \
+             (state == self.VALUE and self.stack[-1] == ord("[")):
+            regex = self.re_elements
+        else:
+            return pos
+        m = regex.match(buf, pos)
+        if m == None:
+            return pos
+        end = m.end()
+        if not final and end + 3 > len(buf):
+            # The last value may be a number that goes on in the next
+            # chunk; leave it to the tokens, from the last comma.
+            end = buf.rfind(",", pos, end)
+        if end <= pos:
+            return pos
+        count = buf.count(",", pos, end)
+        if state != self.NEXT:
+            count += 1
+        self.counts[-1] += count
+        self.state = self.NEXT
+        self.newlines(buf, pos, end, base)
+        return end
+
+    def feed(self, data, final = False):
+        if self.ended:
+            return
+        buf = self.pending + data
+        base = self.offset - len(self.pending)
+        self.offset += len(data)
+        n = len(buf)
+        pos = 0
+        regex = self.regex
+        while pos < n:
+            if self.in_string:
+                end = self.re_string.match(buf, pos).end()
+                if end < n and buf[end] == "\"":
+                    self.in_string = False
+                    pos = end + 1
+                    if self.string_is_key:
+                        self.state = self.COLON_NEXT
+                    else:
+                        self.value_done()
+                    continue
+                if end == n:
+                    pos = n
+                    break
+                if not final and self.re_partial_escape.match(buf, end):
+                    pos = end
+                    break
+                if buf[end] == "\\":
+                    self.fail(base + end, "invalid escape in a string")
+                self.fail(base + end, "unescaped control character 0x%02x "
+                          "in a string" % ord(buf[end]))
+
+            c = buf[pos]
+            if (c == "{" or c == "[") and self.state <= self.FIRST_VALUE:
+                end = self.scan(buf, pos, base)
+                if end > pos:
+                    pos = end
+                    self.value_done()
+                    continue
+            elif self.stack:
+                pos = self.run(buf, pos, base, final)
+                if pos >= n:
+                    break
+
+            m = regex.match(buf, pos)
+            if m == None:
+                if buf[pos] == "\0" and (self.state == self.DONE or
+                                         (self.state == self.VALUE and
+                                          self.lines and not self.stack)):
+                    self.ended = True
+                    self.offset = base + pos
+                    pos = n
+                    break
+                if not final and n - pos < 6:
+                    # Maybe a literal cut by the end of the chunk
+                    break
+                self.unexpected(base + pos, buf[pos])
+            kind = m.lastindex
+            end = m.end()
+            if kind == self.WS:
+                self.newlines(buf, pos, end, base)
+                pos = end
+                continue
+            if kind == self.NEWLINE:
+                if self.state == self.DONE:
+                    self.state = self.VALUE
+                elif self.state != self.VALUE or self.stack:
+                    self.fail(base + pos, "newline inside a record")
+                self.line += 1
+                self.line_start = base + end
+                pos = end
+                continue
+            if kind == self.NUMBER and not final and end + 3 > n:
+                # The number may go on in the next chunk, e.g. '1.' or '1e+'
+                break
+
+            state = self.state
+            if kind == self.STRING:
+                if state == self.FIRST_KEY or state == self.KEY:
+                    self.string_is_key = True
+                elif state <= self.FIRST_VALUE:
+                    self.string_is_key = False
+                else:
+                    self.unexpected(base + pos, buf[pos])
+                self.in_string = True
+            elif kind == self.NUMBER or kind == self.LITERAL:
+                if state > self.FIRST_VALUE:
+                    self.unexpected(base + pos, buf[pos])
+                self.value_done()
+            elif kind == self.OPEN:
+                if state > self.FIRST_VALUE:
+                    self.unexpected(base + pos, buf[pos])
+                c = buf[pos]
+                self.stack.append(c)
+                self.counts.append(0)
+                if c == "{":
+                    self.objects += 1
+                    self.state = self.FIRST_KEY
+                else:
+                    self.arrays += 1
+                    self.state = self.FIRST_VALUE
+                if len(self.stack) > self.max_depth:
+                    self.max_depth = len(self.stack)
+            elif kind == self.CLOSE:
+                c = buf[pos]
+                top = self.stack and chr(self.stack[-1])
+                if not (state == self.NEXT or
+                        (state == self.FIRST_KEY and c == "}") or
+                        (state == self.FIRST_VALUE and c == "]")) or \
+                        top != (c == "}" and "{" or "["):
+                    self.unexpected(base + pos, c)
+                self.stack.pop()
+                count = self.counts.pop()
+                if c == "}":
+                    self.members += count
+                else:
+                    self.elements += count
+                if count > self.largest:
+                    self.largest = count
+                self.value_done()
+            elif kind == self.COLON:
+                if state != self.COLON_NEXT:
+                    self.unexpected(base + pos, buf[pos])
+                self.state = self.VALUE
+            else:
+                if state != self.NEXT:
+                    comma = buf.index(",", pos)
+                    self.newlines(buf, pos, comma, base)
+                    self.unexpected(base + comma, ",")
+                if end - pos > 1:
+                    self.newlines(buf, pos, end, base)
+                self.state = self.stack[-1] == ord("{") and self.KEY \
+                             or self.VALUE
+            pos = end
+
+        self.pending = buf[pos:]
+
+    def finish(self):
+        """Check the end of the data"""
+        self.feed("", True)
+        if self.ended:
+            return
+        if self.in_string:
+            self.fail(self.offset, "unterminated string")
+        if self.stack:
+            self.fail(self.offset, "unexpected end of the data, %d objects "
+                      "or arrays not closed" % len(self.stack))
+        if self.lines:
+            if self.state != self.DONE and self.state != self.VALUE:
+                self.fail(self.offset, "unexpected end of the data")
+        elif self.state != self.DONE:
+            self.fail(self.offset, self.state == self.VALUE and
+                      self.records == 0 and "no JSON value" or
+                      "unexpected end of the data")
+
+    def summary(self):
+        """Returns the statistics as a line"""
+        return ("%s%d objects (%d members), %d arrays (%d elements), "
+                "max depth %d, largest %d" %
+                (self.lines and "%d records, " % self.records or "",
+                 self.objects, self.members, self.arrays, self.elements,
+                 self.max_depth, self.largest))
+
+class JsonlintImpl(object):
+    def complete(self, text, word):
+        if text.find("##") < 0:
+            return gdb.COMPLETE_SYMBOL
+        else:
+            return gdb.COMPLETE_NONE
+
+    def partition(self, args):
+        idx = args.rfind("##")
+        if idx < 0:
+            return (args, "")
+        else:
+            return (args[:idx].strip(), args[idx+2:].strip())
+
+    def validator(self, args):
+        for token in args.split():
+            if token != "--lines":
+                raise RuntimeError("jsonlint: unknown option '%s'" % token)
+        return JsonValidator("--lines" in args.split())
+
+    def process(self, address, length, args, reader = iter_memory,
+                out = None):
+        """Check the JSON text, chunk by chunk
+
+Stops at the first error, and reports the inferior address of the
+offending byte.  'reader' is a function like iter_memory(), which
+generates the data chunks of a region.  The result is written to 'out',
+or the standard output if 'out' is None."""
+        out = out or sys.stdout
+        validator = self.validator(args)
+        done = 0
+        try:
+            for (addr, data) in reader(address, length):
+                validator.feed(data)
+                done += len(data)
+                if validator.ended:
+                    break
+            validator.finish()
+        except JsonSyntaxError as e:
+            out.write("error at 0x%x (offset %d, line %d, column %d): "
+                      "%s\n" % (address + e.offset, e.offset, e.line,
+                                e.column, e.message))
+            return True
+        except KeyboardInterrupt:
+            (out != sys.stdout and out or sys.stderr).write(
+                "jsonlint: interrupted after %d of %d bytes (0x%x-0x%x)\n" %
+                (done, length, address, address + done))
+            return True
+        size = validator.offset
+        out.write("valid, %d bytes (0x%x-0x%x)%s\n" %
+                  (size, address, address + size,
+                   validator.ended and ", ended by NUL" or ""))
+        out.write("%s\n" % validator.summary())
+        return True
+
+    def execute(self, filename, args):
+        """Check the dump file of a value that is not in the memory"""
+        size = os.path.getsize(filename)
+        if size == 0:
+            return self.process(0, 0, args, data_reader(0, ""))
+        import mmap
+        with open(filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                return self.process(0, size, args, data_reader(0, data))
+            finally:
+                data.close()
+
+class JsonlintValueCommand(GdbDumpValueParent):
+    """Check the value of an expression as a JSON text
+
+Usage: jsonlint value EXPR [## --lines] [&]
+
+Check whether the value of EXPR is a valid JSON text (RFC 8259).  The
+value is checked in-process, chunk by chunk, using a constant amount of
+memory however large the text is.  On error, the address of the
+offending byte is reported, with the line and the column:
+
+    (gdb) jsonlint value resp->body
+    error at 0x6020a7 (offset 71, line 3, column 12): expected ',' or '}', got '"'
+
+Otherwise, the numbers of the objects and their members, and of the
+arrays and their elements are shown, with the maximum depth of the
+nesting and the size of the largest object or array.  A NUL byte
+after the value ends the text, so a buffer larger than its contents is
+fine.
+
+With '## --lines', the value is JSON Lines, a JSON value per line,
+which is common in the line-based protocols and logs:
+
+    (gdb) jsonlint value conn->rbuf ## --lines
+
+A value over 'gdbx max-bytes' bytes is refused, or only a part of it
+is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the value is copied at once, and checked in the
+background while you keep debugging; see 'help gdbx jobs'.
+"""
+    background = True
+    sampling = True
+
+    def __init__(self):
+        # jsonlint value EXPR ## OPTIONS...
+
+        GdbDumpValueParent.__init__(self, "jsonlint value", -1)
+        self.impl = JsonlintImpl()
+
+    def complete(self, text, word):
+        debug("jsonlint value complete: text(%s) word(%s)" % (text, word))
+        return self.impl.complete(text, word)
+
+    def parse_arguments(self, args):
+        return self.impl.partition(args)
+
+    def execute(self, filename, args, chunks = None):
+        return self.impl.execute(filename, args)
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args)
+
+    def process_job(self, job, address, data, args):
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out)
+
+class JsonlintMemoryCommand(GdbDumpMemoryParent):
+    """Check the contents of memory as a JSON text
+
+Usage: jsonlint memory START_ADDR END_ADDR [## --lines] [&]
+
+Check whether the memory from the address START_ADDR to the address
+END_ADDR is a valid JSON text, like 'jsonlint value' does; see 'help
+jsonlint value' for the output and '--lines'.  The memory is read in
+chunks, so even a document of hundreds of megabytes is checked with a
+constant amount of memory:
+
+    (gdb) jsonlint memory buf buf+len
+
+A memory region over 'gdbx max-bytes' bytes is refused, or only a part
+of it is processed; see 'help set gdbx max-bytes'.
+
+With a trailing '&', the memory is copied at once, and checked in the
+background while you keep debugging; see 'help gdbx jobs'.
+"""
+    background = True
+    sampling = True
+
+    def __init__(self):
+        # jsonlint memory START_ADDR END_ADDR ## OPTIONS...
+
+        GdbDumpMemoryParent.__init__(self, "jsonlint memory", -1)
+        self.impl = JsonlintImpl()
+
+    def complete(self, text, word):
+        debug("jsonlint memory complete: text(%s) word(%s)" % (text, word))
+        return self.impl.complete(text, word)
+
+    def parse_arguments(self, args):
+        return self.impl.partition(args)
+
+    def execute(self, filename, args, chunks = None):
+        return self.impl.execute(filename, args)
+
+    def native(self, args):
+        return True
+
+    def process(self, address, length, args):
+        return self.impl.process(address, length, args)
+
+    def process_job(self, job, address, data, args):
+        return self.impl.process(address, len(data), args,
+                                 job.reader(address, data), job.out)
+
+JsonlintCommand()
+JsonlintValueCommand()
+JsonlintMemoryCommand()
+
+class GdbxCommand(gdb.Command):
+    """Inspect and control gdbx.py itself"""
+    def __init__(self):
+        gdb.Command.__init__(self, "gdbx", gdb.COMMAND_SUPPORT, -1, True)
+
+class GdbxStartupCommand(gdb.Command):
+    """Show the time spent to load gdbx.py
+
+usage: gdbx startup
+
+Show the time spent to load gdbx.py, and the time spent to initialize
+each backend that is deferred until the first use of the commands."""
+    def __init__(self):
+        gdb.Command.__init__(self, "gdbx startup", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
+
+    def invoke(self, arg, from_tty):
+        sys.stdout.write("gdbx.py loaded in %.3f ms\n" % (LOAD_TIME * 1000))
+        for name in sorted(INIT_TIMES.iterkeys()):
+            sys.stdout.write("  %-32s initialized in %.3f ms\n" %
+                             (name, INIT_TIMES[name] * 1000))
+
+class ExportWriter(object):
+    """Writer of the export file of 'gdbx export'
+
+The format is described in gdbxexport.py, which also reads the file
+without gdb.  The regions are streamed into the file as they are read,
+and the index is written at the end, then the header is updated."""
+
+    MAGIC = "GDBXEXP\0"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIIQQ")
+    ENTRY = struct.Struct("<QQQQQIIII")
+    FLAG_ZLIB = 1
+
+    def __init__(self, path, level = 0):
+        self.file = open(path, "wb")
+        self.level = level
+        self.entries = list()
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0, 0, 0))
+
+    def add(self, label, typename, address, length):
+        """Copy LENGTH bytes at ADDRESS as a region; returns the stored size
+
+With compression, a region is stored raw if its first chunk does not
+shrink by 10%."""
+        import zlib
+        offset = self.file.tell()
+        compressor = None
+        flags = 0
+        for (addr, data) in iter_memory(address, length):
+            if addr == address and self.level > 0:
+                compressor = zlib.compressobj(self.level)
+                head = compressor.compress(data) + \
+                       compressor.flush(zlib.Z_SYNC_FLUSH)
+                if len(head) < len(data) * 0.9:
+                    flags = self.FLAG_ZLIB
+                    self.file.write(head)
+                    continue
+                compressor = None
+            if compressor != None:
+                data = compressor.compress(data)
+            self.file.write(data)
+        if compressor != None:
+            self.file.write(compressor.flush())
+        stored = self.file.tell() - offset
+        self.entries.append((address, length, offset, stored, flags,
+                             label.encode("utf-8"), typename.encode("utf-8")))
+        return stored
+
+    def close(self):
+        self.entries.sort(key = lambda e: (e[0], e[1]))
+        index = self.file.tell()
+        strings = list()
+        pos = 0
+        reach = 0
+        for (address, length, offset, stored, flags,
+             label, typename) in self.entries:
+            reach = max(reach, address + length)
+            self.file.write(self.ENTRY.pack(address, length, offset, stored,
+                                            reach, flags, pos, len(label),
+                                            len(typename)))
+            strings.append(label + typename)
+            pos += len(label) + len(typename)
+        self.file.write("".join(strings))
+        self.file.seek(0)
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                         len(self.entries), index,
+                                         index + len(self.entries) *
+                                         self.ENTRY.size))
+        self.file.close()
+
+class GdbxExportCommand(gdb.Command):
+    """Export many regions of the inferior memory into a file
+
+usage: gdbx export [-z] FILE REGION...
+
+Write every REGION into a single FILE with an index of the addresses,
+the lengths, the labels and the type names of the regions, so that
+they can be analysed offline, e.g. the buffers of a core file.  REGION
+is one of:
+
+  EXPR                  the value of EXPR, labeled as EXPR
+  START..END            the memory from START to END
+  LABEL=EXPR            the value of EXPR, labeled as LABEL
+  LABEL=START..END      the memory from START to END, labeled as LABEL
+
+Quote a REGION that contains blanks.  With '-z', the regions are
+compressed with zlib unless they do not shrink.
+
+FILE is read by gdbxexport.py, without gdb:
+
+    (gdb) gdbx export /tmp/bufs.gdbx -z inbuf outbuf 'hdr=*req->hdr'
+    $ python gdbxexport.py /tmp/bufs.gdbx
+    $ python gdbxexport.py /tmp/bufs.gdbx 0x601040 64 | hexdump -C"""
+    def __init__(self):
+        gdb.Command.__init__(self, "gdbx export", gdb.COMMAND_DATA,
+                             gdb.COMPLETE_FILENAME)
+        self.stats_name = "gdbx export"
+
+    def region(self, arg):
+        """Returns (label, type name, address, length) of REGION"""
+        m = re.match(r"^([A-Za-z_][\w.]*)=(.*)$", arg)
+        label = arg
+        if m != None and not m.group(2).startswith("="):
+            (label, arg) = m.groups()
+        if ".." in arg:
+            (start, end) = [ int(gdb.parse_and_eval(e))
+                             for e in arg.split("..", 1) ]
+            if end < start:
+                raise RuntimeError("%s: invalid memory address range" % label)
+            return (label, "", start, end - start)
+        value = gdb.parse_and_eval(arg)
+        if value.address == None:
+            raise RuntimeError("%s: not in the inferior memory" % label)
+        return (label, str(value.type), int(value.address), value.type.sizeof)
+
+    @timed
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        level = 0
+        if argv and argv[0] == "-z":
+            level = 6
+            argv.pop(0)
+        if len(argv) < 2:
+            error("usage: gdbx export [-z] FILE REGION...")
+            return
+        try:
+            with stats.phase("parse"):
+                regions = [ self.region(a) for a in argv[1:] ]
+            writer = ExportWriter(os.path.expanduser(argv[0]), level)
+            total = 0
+            stored = 0
+            try:
+                for (label, typename, address, length) in regions:
+                    stored += writer.add(label, typename, address, length)
+                    total += length
+            finally:
+                writer.close()
+            sys.stdout.write("%d regions, %d bytes (%d bytes stored) "
+                             "exported to %s\n" %
+                             (len(regions), total, stored, argv[0]))
+        except (RuntimeError, IOError) as e:
+            print e
+
+class GdbxStatsCommand(gdb.Command):
+    """Show the timing of the gdbx commands
+
+usage: gdbx stats [reset]
+
+For each command run so far, show the number of runs, the total time,
+the median and the 99th percentile of the latest STATS_SAMPLES runs,
+the bytes read from the inferior and the throughput.  Then, show how
+the time is spent: parsing the arguments, reading the inferior memory,
+running the external tools, writing the output, and the rest.
+
+With 'reset', clear the statistics.
+
+To log every run as a JSON line, call set_debug_file(PATHNAME, True)."""
     def __init__(self):
-        if IconvEncodings.encodings == None:
-            IconvEncodings.encodings = IconvEncodings.supported_encodings()
-            reload(sys)
-            
-    def name(self, alias):
-        """Return the actual encoding name if exists, otherwise None"""
-        alias = alias.lstrip("#")
-        if IconvEncodings.encodings.has_key(alias):
-            return IconvEncodings.encodings[alias]
-        return None
+        gdb.Command.__init__(self, "gdbx stats", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
 
-    def complete(self, text, word):
-        """Callback for auto completion, used in gdb.Command.complete()"""
-        ret = list()
+    def percentile(self, samples, p):
+        samples = sorted(samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
 
-        debug("Encodings.complete(): text(%s) word(%s)" % (text, word))
-        for a in IconvEncodings.encodings.iterkeys():
-            #debug("    enc(%s)" % a)
-            if a.find(word) == 0:
-                ret.append(a)
-        return ret
-        
-class IconvEncodingCommand(gdb.Command):
-    """Set/get the current character encoding
+    def invoke(self, arg, from_tty):
+        if arg.strip() == "reset":
+            stats.clear()
+            return
+        if not stats.commands:
+            sys.stdout.write("no commands run yet\n")
+            return
+        sys.stdout.write("%-18s %6s %10s %10s %10s %12s %10s\n" %
+                         ("command", "count", "total(ms)", "p50(ms)",
+                          "p99(ms)", "bytes", "MB/s"))
+        for (name, agg) in stats.commands.iteritems():
+            sys.stdout.write("%-18s %6d %10.1f %10.1f %10.1f %12d %10.1f\n" %
+                             (name, agg["count"], agg["total"] * 1000,
+                              self.percentile(agg["samples"], 0.5) * 1000,
+                              self.percentile(agg["samples"], 0.99) * 1000,
+                              agg["bytes"],
+                              agg["total"] and
+                              agg["bytes"] / agg["total"] / 1048576 or 0.0))
+        sys.stdout.write("\n%-18s" % "command")
+        for phase in CommandStats.PHASES:
+            sys.stdout.write(" %10s" % phase)
+        sys.stdout.write("\n")
+        for (name, agg) in stats.commands.iteritems():
+            sys.stdout.write("%-18s" % name)
+            for phase in CommandStats.PHASES:
+                sys.stdout.write(" %9.1f%%" %
+                                 (agg["total"] and agg["phases"][phase] * 100 /
+                                  agg["total"] or 0.0))
+            sys.stdout.write("\n")
 
-usage: iconv encoding [ENCODING]
+class GdbxJobsCommand(gdb.Command):
+    """List the background jobs of gdbx
 
-If ENCODING is not provided, this command shows the current system encoding.
-If provided, this command set the current system encoding to ENCODING.
+usage: gdbx jobs [N]
 
-Once set, 'iconv value' and 'iconv memory' will try to convert the
-given data into ENCODING.
+A data command followed by '&' (e.g. 'xmllint memory A B ## --noout &')
+copies the data at once, then processes it in a background thread, so
+that you can keep debugging meanwhile.  When a job is done, its output
+is shown, up to JOB_OUTPUT_MAX bytes.
 
-Note that this changes the internal 'system default encoding' in
-Python runtime."""
-    
+Without N, list the jobs with their states, the elapsed time and the
+progress.  With N, show the whole output of the job N so far.
+
+Use 'gdbx kill N' to stop a running job, or to forget a finished job."""
     def __init__(self):
-        gdb.Command.__init__(self, "iconv encoding", gdb.COMMAND_DATA, -1)
-        self.encodings = IconvEncodings()
-        
+        gdb.Command.__init__(self, "gdbx jobs", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
+
     def invoke(self, arg, from_tty):
         arg = arg.strip()
-        debug("arg: '%s'" % arg)
-        if arg == "":
-            print sys.getdefaultencoding()
-        else:
-            enc = self.encodings.name(arg)
-            if enc != None:
-                try:
-                    sys.setdefaultencoding(enc)
-                except LookupError as e:
-                    error("encoding %s is not supported by Python" % enc)
-            else:
-                error("invalid encoding alias, %s." % arg)
-    def complete(self, text, word):
-        debug("iconv encoding complete: text(%s) word(%s)" % (text, word))
-        return self.encodings.complete(text, word)
-        
-class IconvImpl(object):
+        if arg:
+            job = jobs.get(int(gdb.parse_and_eval(arg)))
+            if job == None:
+                error("no job %s" % arg)
+                return
+            sys.stdout.write(job.output())
+            return
+        for job in jobs.itervalues():
+            sys.stdout.write("%s\n" % job.status())
+
+class GdbxKillCommand(gdb.Command):
+    """Stop a background job of gdbx
+
+usage: gdbx kill N...
+
+Stop the running job N; the tool of the job, if any, is killed.  If
+the job N is already finished, forget the job and its output."""
     def __init__(self):
-        self.re_encoding = re.compile(r"([ ]*(#[a-z0-9_]+))+")
-        self.encodings = IconvEncodings()
-        
-    def partition(self, args):
-        m = self.re_encoding.search(args)
-        if m == None:
-            return (args, "")
-        else:
-            idx = m.start()
-            return (args[:idx], args[idx:])
-            
-    def format_error(self, errbuf):
-        """Format iconv(1)-related error message
+        gdb.Command.__init__(self, "gdbx kill", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
 
-Currently, capture the only first line, removing iconv pathname"""
-        (msg, dummy1, dummy2) = errbuf.partition("\n")
-        idx = msg.find("iconv: ")
-        if idx >= 0:
-            return msg[idx:]
-        
-    def execute_iconv(self, filename, args):
-        debug("execute_iconv('%s', '%s')" % (filename, args))
-        encodings = list()
-        for e in args.split():
-            realname = self.encodings.name(e)
-            if realname != None:
-                debug("  target encoding: %s" % self.encodings.name(e))
-                encodings.append(realname)
+    def invoke(self, arg, from_tty):
+        for num in arg.split():
+            job = jobs.get(int(gdb.parse_and_eval(num)))
+            if job == None:
+                error("no job %s" % num)
+            elif job.finished == None:
+                job.cancel.set()
             else:
-                error("unknown encoding alias %s, ignored" % e)
-                
-        target = sys.getdefaultencoding()
+                jobs.pop(job.num).close()
 
-        width = max(map(len, encodings))
+def _number_ranges(nums):
+    """Returns the sorted numbers NUMS as a string like '1-3,5,8-9'"""
+    ranges = list()
+    for num in sorted(nums):
+        if ranges and ranges[-1][1] + 1 == num:
+            ranges[-1][1] = num
+        else:
+            ranges.append([ num, num ])
+    return ",".join([ lo == hi and "%d" % lo or "%d-%d" % (lo, hi)
+                      for (lo, hi) in ranges ])
 
-        sys.stdout.write("Target encoding is %s:\n" % target)
-        
-        for enc in encodings:
-            cmdline = [ICONV_PATH, "-t", target, "-f", enc, filename]
-            debug("cmdline: %s" % cmdline)
-            p = subprocess.Popen(cmdline,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            (out, err) = p.communicate()
-            status = p.wait()
+class GdbxForeachThreadCommand(BatchImpl, gdb.Command):
+    """Process an expression of every thread at once
 
-            try:
-                sys.stdout.write("%*s: " % (width, enc))
-                sys.stdout.write("|%s|\n" % out)
-            except TypeError as e:
-                sys.stdout.write("\n")
-                error("TypeError: %s" % e)
-                error("Try to change the default encoding")
-            if err != "":
-                sys.stdout.write("\t%s\n" % self.format_error(err))
-        return True
-        
-    def complete_any(self, text, word):
-        try:
-            prevchar = text[-(len(word) + 1)]
-        except:
-            prevchar = ""
-        debug("complete: text(%s), word(%s), prev(%s)" % \
-              (text, word, prevchar))
-        if prevchar == "#":
-            debug("complete for encoding...")
-            return self.encodings.complete(text, word)
-        else:
-            debug("complete for symbol...")
-            return gdb.COMPLETE_SYMBOL
-        
-class IconvValueCommand(GdbDumpValueParent, IconvImpl):
-    """Check the encoding of the value EXPR.
+usage: gdbx foreach-thread EXPR [OPTION...] -- TOOL [ARGUMENTS...] [&]
 
-usage: iconv memory EXPR ENCODING [ENCODING]...
+Evaluate EXPR in each thread of the selected inferior, then process
+all the values at once with TOOL, which is 'hexdump', 'iconv' or
+'xmllint', like 'TOOL each' does; ARGUMENTS is what follows '##' for
+'hexdump each' and 'xmllint each', and the encodings for 'iconv each'.
+This is much faster than 'thread apply all hexdump value EXPR' with
+many threads: the addresses of all the values are resolved first, the
+memory is read in batches where the neighbouring values are read
+together, and the values are processed in-process, or by a single run
+of the external tool over all the values.
 
-Send a value EXPR to iconv(1) command to check the encoding of the
-contents.  ENCODING is the source encoding of the memory region.  The
-target encoding is controlled via 'iconv encoding' command.
+The values with the same bytes are processed once, with a header that
+lists all their threads.  The address in the header is of the first
+one.  The threads where EXPR cannot be evaluated are reported, and
+skipped.
 
-If more than one ENCODING provided, iconv(1) is called several times
-for each ENCODING.
+OPTION is one of these:
 
-ENCODING is an alias name that has a form '#name', where 'name' is
-a encoding name except these:
+  --frame N                 evaluate EXPR in the frame N of each thread,
+                            instead of the innermost frame
+  --size N                  process N bytes at EXPR if it is a pointer,
+                            instead of the pointed object
+  --max N                   stop after N threads (default: EACH_MAX)
 
-  1. all capital letters are in lower-cases
-  2. all non-alpha-numeric characters are substituted to the
-     underline character('_').
+The selected thread and frame are restored afterwards.  With a trailing
+'&', the values are copied at once, and processed in the background;
+see 'help gdbx jobs'.
 
-For example, to use the character encoding 'ISO_8859-10:1992', the
-ENCODING should be 'iso_8859_10_1992'.  Note that this command will
-support auto-completion for the ENCODING.
+For example, to check the request buffer of every worker thread:
 
-For example, if you know want to make sure that the value 'buffer'
-contains Korean character, but you don't know the exact encoding, you
-may try following:
+    (gdb) gdbx foreach-thread req->buf --frame 2 --size req->len -- hexdump -C
+    (gdb) gdbx foreach-thread tls_name -- iconv #utf_8"""
 
-    (gdb) iconv memory buffer buffer+100 #euc_kr #cp949 #utf-8
+    re_separator = re.compile(r"(?:^|\s)--(?:\s+|$)")
 
-Then it will try three times for the encoding 'EUC-KR', 'CP949', and
-'UTF-8'."""
-    # iconv value EXPR #ENCODING...
-    
     def __init__(self):
-        GdbDumpValueParent.__init__(self, "iconv value", -1)
-        IconvImpl.__init__(self)
+        gdb.Command.__init__(self, "gdbx foreach-thread", gdb.COMMAND_DATA,
+                             gdb.COMPLETE_EXPRESSION)
+        self.stats_name = "gdbx foreach-thread"
 
-    def complete(self, text, word):
-        return self.complete_any(text, word)
+    def parse_batch(self, args):
+        """Returns (EXPR, options, (the 'each' command of TOOL, arguments,
+EXPR))"""
+        m = self.re_separator.search(args)
+        if m == None:
+            raise RuntimeError("usage: gdbx foreach-thread EXPR [OPTION...] "
+                               "-- TOOL [ARGUMENTS...]")
+        (spec, tool) = (args[:m.start()], args[m.end():].strip())
+        (tool, sep, tool_args) = tool.partition(" ")
+        if tool not in each_commands:
+            raise RuntimeError("unknown tool '%s'; one of %s" %
+                               (tool, ", ".join(sorted(each_commands))))
+        opts = { "size": None, "max": EACH_MAX, "frame": 0 }
+        for name in ("size", "max", "frame"):
+            m = re.search(r"(^|\s)--%s(?:\s+|=)(\S+)" % name, spec)
+            if m != None:
+                opts[name] = int(gdb.parse_and_eval(m.group(2)))
+                spec = spec[:m.start()] + spec[m.end():]
+        spec = spec.strip()
+        if not spec:
+            raise RuntimeError("no expression")
+        return (spec, opts, (each_commands[tool], tool_args.strip(), spec))
 
-    def execute(self, filename, args):
-        return self.execute_iconv(filename, args)
-    
-    def parse_arguments(self, args):
-        return self.partition(args)
-        
-class IconvMemoryCommand(GdbDumpMemoryParent, IconvImpl):
-    """Check the encoding of the memory.
+    def select_frame(self, level):
+        frame = gdb.newest_frame()
+        for i in xrange(level):
+            frame = frame.older()
+            if frame == None:
+                raise RuntimeError("no frame %d" % level)
+        frame.select()
+
+    def resolve(self, expr, opts):
+        """Returns a list of (thread number, address, length) of EXPR"""
+        threads = sorted(gdb.selected_inferior().threads(),
+                         key = lambda t: t.num)
+        if not threads:
+            raise RuntimeError("no threads")
+        ret = list()
+        # Threads by the error message
+        failures = collections.OrderedDict()
+        thread = gdb.selected_thread()
+        try:
+            frame = gdb.selected_frame()
+        except RuntimeError:
+            frame = None
+        try:
+            for t in threads[:opts["max"]]:
+                try:
+                    t.switch()
+                    self.select_frame(opts["frame"])
+                    (address, length) = self.element(gdb.parse_and_eval(expr),
+                                                     opts)
+                    if address == 0:
+                        raise RuntimeError("null pointer")
+                    ret.append((t.num, address, length))
+                except RuntimeError as e:
+                    failures.setdefault(str(e), list()).append(t.num)
+        finally:
+            if thread != None:
+                thread.switch()
+                if frame != None and frame.is_valid():
+                    frame.select()
+        for (message, nums) in failures.iteritems():
+            error("%s: thread%s %s: %s" % (expr, len(nums) > 1 and "s" or "",
+                                           _number_ranges(nums), message))
+        return ret
 
-usage: iconv memory START_ADDR END_ADDR ENCODING [ENCODING]...
+    def job_args(self, args):
+        (command, tool_args, expr) = args
+        return (command, command.job_args(tool_args), expr)
 
-Send a memory region to iconv(1) command to check the encoding of the
-contents.  ENCODING is the source encoding of the memory region.  The
-target encoding is controlled via 'iconv encoding' command.
+    def process_batch(self, batch, args, job = None):
+        (command, tool_args, expr) = args
+        out = job and job.out or sys.stdout
+        # [ thread numbers, address, data ] by the data
+        groups = collections.OrderedDict()
+        count = 0
+        for (num, address, data) in batch:
+            group = groups.get(data)
+            if group == None:
+                groups[data] = [ [ num ], address, data ]
+            else:
+                group[0].append(num)
+            count += 1
+        if count == 0:
+            return
+        out.write("%d threads, %d distinct values\n" % (count, len(groups)))
+        command.process_batch([ ("%s [thread%s %s]" %
+                                 (expr, len(nums) > 1 and "s" or "",
+                                  _number_ranges(nums)), address, data)
+                                for (nums, address, data)
+                                in groups.itervalues() ], tool_args, job)
 
-If more than one ENCODING provided, iconv(1) is called several times
-for each ENCODING.
+class GdbxCacheCommand(gdb.Command):
+    """Manage the inferior memory cache of gdbx"""
+    def __init__(self):
+        gdb.Command.__init__(self, "gdbx cache", gdb.COMMAND_SUPPORT, -1,
+                             True)
 
-ENCODING is an alias name that has a form '#name', where 'name' is
-a encoding name except these:
+class GdbxCacheStatsCommand(gdb.Command):
+    """Show the statistics of the inferior memory cache
 
-  1. all capital letters are in lower-cases
-  2. all non-alpha-numeric characters are substituted to the
-     underline character('_').
+usage: gdbx cache stats
 
-For example, to use the character encoding 'ISO_8859-10:1992', the
-ENCODING should be 'iso_8859_10_1992'.  Note that this command will
-support auto-completion for the ENCODING.
+The commands of gdbx read the inferior memory through a cache, which
+is dropped whenever the inferior runs.  The cache size is controlled by
+'set gdbx cache-size'."""
+    def __init__(self):
+        gdb.Command.__init__(self, "gdbx cache stats", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
 
-For example, if you know want to make sure that the memory from
-'buffer' to 'buffer+100' contains Korean character, but you don't know
-the exact encoding, you may try following:
+    def invoke(self, arg, from_tty):
+        c = memory_cache
+        total = c.hits + c.misses
+        sys.stdout.write("hits: %d, misses: %d (%.1f%% hit ratio)\n" %
+                         (c.hits, c.misses,
+                          total and c.hits * 100.0 / total or 0.0))
+        sys.stdout.write("uncached reads: %d, invalidations: %d\n" %
+                         (c.uncached, c.invalidations))
+        sys.stdout.write("%d bytes held in %d pages (limit %d bytes)\n" %
+                         (c.size, len(c.pages), MEMORY_CACHE_SIZE))
 
-    (gdb) iconv memory buffer buffer+100 #euc_kr #cp949 #utf-8
+class GdbxCacheClearCommand(gdb.Command):
+    """Drop the inferior memory cache, and the type layouts of 'hexdump value'
 
-Then it will try three times for the encoding 'EUC-KR', 'CP949', and
-'UTF-8'."""
-    # iconv value EXPR #ENCODING...
-    
+usage: gdbx cache clear"""
     def __init__(self):
-        GdbDumpMemoryParent.__init__(self, "iconv memory", -1)
-        IconvImpl.__init__(self)
+        gdb.Command.__init__(self, "gdbx cache clear", gdb.COMMAND_SUPPORT,
+                             gdb.COMPLETE_NONE)
 
-    def complete(self, text, word):
-        return self.complete_any(text, word)
+    def invoke(self, arg, from_tty):
+        memory_cache.clear()
+        TypeLayout.clear()
 
-    def execute(self, filename, args):
-        return self.execute_iconv(filename, args)
-    
-    def parse_arguments(self, args):
-        r = self.partition(args)
-        debug("parse_argument: partition: %s" % repr(r))
-        return r
+class SetGdbxCommand(gdb.Command):
+    """Set gdbx variables"""
+    def __init__(self):
+        gdb.Command.__init__(self, "set gdbx", gdb.COMMAND_DATA,
+                             gdb.COMPLETE_NONE, True)
 
-class XmllintCommand(gdb.Command):
-    """Check the XML using xmllint(1)"""
+class ShowGdbxCommand(gdb.Command):
+    """Show gdbx variables"""
     def __init__(self):
-        gdb.Command.__init__(self, "xmllint", gdb.COMMAND_DATA, -1, True)
+        gdb.Command.__init__(self, "show gdbx", gdb.COMMAND_DATA,
+                             gdb.COMPLETE_NONE, True)
 
-class XmllintImpl(object):
-    def complete(self, text, word):
-        if text.find("##") < 0:
-            return gdb.COMPLETE_SYMBOL
-        else:
-            return gdb.COMPLETE_NONE
-        
-    def partition(self, args):
-        idx = args.rfind("##")
-        if idx < 0:
-            return (args, "")
-        else:
-            return (args[:idx].strip(), args[idx+2:].strip())
+class GdbxCacheSizeParameter(gdb.Parameter):
+    """Maximum number of bytes held in the inferior memory cache.
+Zero disables the cache."""
+    set_doc = "Set the size of the gdbx memory cache."
+    show_doc = "Show the size of the gdbx memory cache."
 
-    def commandline(self, filename, args):
-        # args is something like '--format --schema http://asdfadf --debug'
-        return "%s %s %s" % (XMLLINT_PATH, args, filename)
-        
-class XmllintValueCommand(GdbDumpValueParent):
-    """Check the value of an expression as a full XML document
+    def __init__(self):
+        gdb.Parameter.__init__(self, "gdbx cache-size", gdb.COMMAND_DATA,
+                               gdb.PARAM_ZUINTEGER)
+        self.value = MEMORY_CACHE_SIZE
 
-Usage: xmllint value EXPR [## ARGUMENTS...]
+    def get_set_string(self):
+        global MEMORY_CACHE_SIZE
+        MEMORY_CACHE_SIZE = self.value
+        if MEMORY_CACHE_SIZE < memory_cache.size:
+            memory_cache.clear()
+        return ""
 
-Send the value of EXPR to xmllint(1) to check the validity.
+    def get_show_string(self, svalue):
+        return "The size of the gdbx memory cache is %s bytes." % svalue
 
-ARGUMENTS is the additional arguments that will be passed to
-xmllint(1).  If you use ARGUMENTS, make sure to separate them from
-EXPR using '##'.
+class GdbxMaxBytesParameter(gdb.Parameter):
+    """Maximum number of bytes of a region that the value and memory
+commands of hexdump, iconv and xmllint process as a whole.  Zero means
+no limit.
 
-To validate 'xml_buffer', just use:
+The size is known from the type of the value or from the address range
+before anything is read, so a region over the limit is refused at once,
+or only a part of it is read and processed, as 'set gdbx sampling'
+says.  The data that is not in the inferior memory cannot be sampled,
+so it is always refused."""
+    set_doc = "Set the maximum size of a region of the gdbx commands."
+    show_doc = "Show the maximum size of a region of the gdbx commands."
 
-    (gdb) xmllint value xml_buffer
-    
-To validate 'xml_buffer' and to indent for human-readability:
-    
-    (gdb) xmllint value xml_buffer ## --format
-"""
     def __init__(self):
-        # xmllint value EXPR ## OPTIONS...
-        
-        GdbDumpValueParent.__init__(self, "xmllint value", -1)
-        self.impl = XmllintImpl()
-        
-    def complete(self, text, word):
-        debug("xmllint value complete: text(%s) word(%s)" % (text, word))
-        return self.impl.complete(text, word)
+        gdb.Parameter.__init__(self, "gdbx max-bytes", gdb.COMMAND_DATA,
+                               gdb.PARAM_ZUINTEGER)
+        self.value = MAX_BYTES
 
-    def parse_arguments(self, args):
-        return self.impl.partition(args)
+    def get_set_string(self):
+        global MAX_BYTES
+        MAX_BYTES = self.value
+        return ""
 
-    def commandline(self, filename, args):
-        return self.impl.commandline(filename, args)
-    
-class XmllintMemoryCommand(GdbDumpMemoryParent):
-    """Check the contents of memory as a full XML document
+    def get_show_string(self, svalue):
+        return "The gdbx commands process at most %s bytes of a region." % \
+               svalue
 
-Usage: xmllint memory START_ADDR END_ADDR [## ARGUMENTS...]
+class GdbxSamplingParameter(gdb.Parameter):
+    """What the gdbx commands do with a region over 'gdbx max-bytes'.
 
-Send the memory from the address START_ADDR to the address END_ADDR to
-xmllint(1) to check the validity.
+'error' refuses the region.  'head' and 'tail' process the first or the
+last SAMPLE_BYTES bytes of the region, and 'stride' processes
+SAMPLE_PIECES evenly spaced pieces of SAMPLE_BYTES bytes in total.
+Each processed part has a header with its addresses, and the skipped
+ranges are shown between them, e.g.
 
-ARGUMENTS is the additional arguments that will be passed to
-xmllint(1).  If you use ARGUMENTS, make sure to separate them from
-EXPR using '##'.
+    (gdb) set gdbx sampling stride
+    (gdb) hexdump memory buf buf+0x100000000
+    hexdump memory: 4294967296 bytes (0x7f0000000000-0x7f0100000000) is over the limit of 268435456 bytes, stride sampling
+    ==> stride 1/16: 0x7f0000000000-0x7f0000001000, 4096 bytes <==
+    ...
+    --- skipped 0x7f0000001000-0x7f0011110f00 (286326784 bytes) ---"""
+    set_doc = "Set how the gdbx commands sample a region over the limit."
+    show_doc = "Show how the gdbx commands sample a region over the limit."
 
-To validate a memory from 'xml_buffer' to plus 100 units:
+    def __init__(self):
+        gdb.Parameter.__init__(self, "gdbx sampling", gdb.COMMAND_DATA,
+                               gdb.PARAM_ENUM,
+                               ["error", "head", "tail", "stride"])
+        self.value = SAMPLING
 
-    (gdb) xmllint memory xml_buffer xml_buffer+100
+    def get_set_string(self):
+        global SAMPLING
+        SAMPLING = self.value
+        return ""
 
-If 'xml_buffer' is not an array of character, you may need to cast it:
+    def get_show_string(self, svalue):
+        return "A region over the limit is handled by '%s'." % svalue
 
-    (gdb) xmllint memory xml_buffer ((char*)xml_buffer)+100
+class GdbxTransportParameter(gdb.Parameter):
+    """How the data is passed to the external tools (hexdump, iconv, xmllint).
+
+'memfd' writes the data into an anonymous memory file (memfd_create(2)),
+'pipe' writes it on the standard input of the tool, and 'file' writes
+it into a temporary file.  If memfd_create(2) is not available, 'memfd'
+falls back to 'file'."""
+    set_doc = "Set how the data is passed to the external tools."
+    show_doc = "Show how the data is passed to the external tools."
 
-To validate and to indent for human-readability:
-    
-    (gdb) xmllint value xml_buffer xml_buffer+100 ## --format
-"""
     def __init__(self):
-        # xmllint value EXPR ## OPTIONS...
-        
-        GdbDumpMemoryParent.__init__(self, "xmllint memory", -1)
-        self.impl = XmllintImpl()
-        
-    def complete(self, text, word):
-        debug("xmllint memory complete: text(%s) word(%s)" % (text, word))
-        return self.impl.complete(text, word)
+        gdb.Parameter.__init__(self, "gdbx transport", gdb.COMMAND_DATA,
+                               gdb.PARAM_ENUM, ["memfd", "pipe", "file"])
+        self.value = TOOL_TRANSPORT
 
-    def parse_arguments(self, args):
-        return self.impl.partition(args)
+    def get_set_string(self):
+        global TOOL_TRANSPORT
+        TOOL_TRANSPORT = self.value
+        return ""
 
-    def commandline(self, filename, args):
-        return self.impl.commandline(filename, args)
-    
+    def get_show_string(self, svalue):
+        return "The data is passed to the external tools by %s." % svalue
 
-set_default_encoding()
+class GdbxPoolSizeParameter(gdb.Parameter):
+    """Number of the helper processes that run the external tools.
 
-IconvCommand()
-IconvEncodingCommand()
-IconvValueCommand()
-IconvMemoryCommand()
+The tools (hexdump, iconv, xmllint) are started by these long-lived
+processes instead of by gdb, which is slow to fork with a large address
+space, and the conversions of an 'iconv' command run on them at once.
+Zero, the default, runs every tool directly from gdb.  The pool is
+opt-in: a few processes pay off when gdb is large enough that forking
+it is slow, e.g. over 1 GB of memory with large symbol tables."""
+    set_doc = "Set the number of the gdbx tool processes."
+    show_doc = "Show the number of the gdbx tool processes."
 
-XmllintCommand()
-XmllintValueCommand()
-XmllintMemoryCommand()
+    def __init__(self):
+        gdb.Parameter.__init__(self, "gdbx pool-size", gdb.COMMAND_DATA,
+                               gdb.PARAM_ZUINTEGER)
+        self.value = POOL_SIZE
+
+    def get_set_string(self):
+        global POOL_SIZE
+        POOL_SIZE = self.value
+        return ""
+
+    def get_show_string(self, svalue):
+        return "The external tools run on %s gdbx tool processes." % svalue
+
+GdbxCommand()
+GdbxStartupCommand()
+GdbxStatsCommand()
+GdbxJobsCommand()
+GdbxExportCommand()
+GdbxKillCommand()
+GdbxForeachThreadCommand()
+GdbxCacheCommand()
+GdbxCacheStatsCommand()
+GdbxCacheClearCommand()
+
+SetGdbxCommand()
+ShowGdbxCommand()
+GdbxCacheSizeParameter()
+GdbxTransportParameter()
+GdbxMaxBytesParameter()
+GdbxSamplingParameter()
+GdbxPoolSizeParameter()
+
+memory_cache.connect()
+if hasattr(gdb.events, "new_objfile"):
+    gdb.events.new_objfile.connect(TypeLayout.clear)
+
+LOAD_TIME = time.time() - _load_start
+debug("gdbx.py loaded in %.3f ms" % (LOAD_TIME * 1000))
 
 #set_debug_file("/dev/pts/13")
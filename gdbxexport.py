@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Reader of the memory regions exported by 'gdbx export'
+# Copyright (C) 2010   Seong-Kook Shin <cinsky@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Read the memory regions exported by 'gdbx export', without gdb
+
+The export file is a single container of many regions:
+
+  header      MAGIC, VERSION, region count, index offset, strings offset
+  data        the contents of the regions, one after another, each is
+              either raw or a zlib stream
+  index       one fixed-size entry per region, sorted by address:
+              address, length, data offset, stored size, reach, flags,
+              label offset, label length, type name length, where
+              'reach' is the highest end address of the regions up to
+              this entry, to find overlapping regions quickly
+  strings     the labels and the type names; the type name of a region
+              follows its label
+
+All integers are little-endian.  The file is mapped with mmap(2), and
+the index is searched in place with a binary search, so opening even a
+huge export is cheap, and raw regions are returned without copying:
+
+    import gdbxexport
+    ex = gdbxexport.ExportFile("core.gdbx")
+    for r in ex:
+        print r.label, r.type, hex(r.address), r.length
+    region = ex.find(0x601040)          # the region containing it
+    data = ex.read(0x601040, 64)        # bytes, may span regions
+
+Run as a script to list the regions of an export, or to write the
+memory at ADDRESS to the standard output:
+
+    python gdbxexport.py FILE [ADDRESS [LENGTH]]"""
+
+import sys
+import mmap
+import struct
+import bisect
+import zlib
+
+MAGIC = b"GDBXEXP\0"
+VERSION = 1
+
+# magic, version, region count, index offset, strings offset
+HEADER = struct.Struct("<8sIIQQ")
+# address, length, data offset, stored size, reach, flags, label offset,
+# label length, type name length
+ENTRY = struct.Struct("<QQQQQIIII")
+
+FLAG_ZLIB = 1
+
+try:
+    _view = buffer
+except NameError:
+    def _view(data, offset, length):
+        return memoryview(data)[offset:offset + length]
+
+class FormatError(Exception):
+    pass
+
+class Region(object):
+    """A region in an export file"""
+    def __init__(self, export, index):
+        (self.address, self.length, self.offset, self.stored, self.reach,
+         self.flags, label, label_len,
+         type_len) = ENTRY.unpack_from(export.map, export.entry(index))
+        strings = export.strings
+        self.export = export
+        self.index = index
+        self.label = export.map[strings + label:
+                                strings + label + label_len].decode("utf-8")
+        pos = strings + label + label_len
+        self.type = export.map[pos:pos + type_len].decode("utf-8")
+
+    @property
+    def end(self):
+        return self.address + self.length
+
+    @property
+    def compressed(self):
+        return self.flags & FLAG_ZLIB != 0
+
+    def data(self):
+        """The contents; a view into the mapped file if not compressed"""
+        if self.compressed:
+            return self.export.inflate(self)
+        return _view(self.export.map, self.offset, self.length)
+
+    def __repr__(self):
+        return "<Region %s 0x%x-0x%x%s>" % (self.label, self.address,
+                                           self.end,
+                                           self.compressed and " zlib" or "")
+
+class _Addresses(object):
+    """The start addresses of the index, as a sequence for bisect"""
+    def __init__(self, export):
+        self.export = export
+
+    def __len__(self):
+        return self.export.count
+
+    def __getitem__(self, index):
+        return struct.unpack_from("<Q", self.export.map,
+                                  self.export.entry(index))[0]
+
+class ExportFile(object):
+    """An export file of 'gdbx export', mapped in memory"""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise FormatError("%s: too short" % path)
+        (magic, version, self.count, self.index,
+         self.strings) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise FormatError("%s: not an export of gdbx" % path)
+        if version != VERSION:
+            raise FormatError("%s: unsupported version %d" % (path, version))
+        self.addresses = _Addresses(self)
+        # The last inflated region, (index, data)
+        self.inflated = (None, None)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def entry(self, index):
+        return self.index + index * ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("region index out of range")
+        return Region(self, index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield Region(self, index)
+
+    def inflate(self, region):
+        if self.inflated[0] != region.index:
+            data = zlib.decompress(self.map[region.offset:
+                                            region.offset + region.stored])
+            self.inflated = (region.index, data)
+        return self.inflated[1]
+
+    def find(self, address):
+        """Returns the region that contains ADDRESS, or None"""
+        index = bisect.bisect_right(self.addresses, address) - 1
+        # Regions may overlap; look back while some region before may
+        # still cover ADDRESS.
+        while index >= 0:
+            region = Region(self, index)
+            if address < region.end:
+                return region
+            if region.reach <= address:
+                break
+            index -= 1
+        return None
+
+    def read(self, address, length):
+        """Returns LENGTH bytes at ADDRESS, which may span regions
+
+Raises KeyError if any of the bytes is not in the export."""
+        parts = list()
+        end = address + length
+        while address < end:
+            region = self.find(address)
+            if region == None:
+                raise KeyError("0x%x is not in the export" % address)
+            size = min(end, region.end) - address
+            start = address - region.address
+            parts.append(bytes(region.data()[start:start + size]))
+            address += size
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+def main(argv):
+    if len(argv) not in (1, 2, 3):
+        sys.stderr.write("usage: %s FILE [ADDRESS [LENGTH]]\n" %
+                         sys.argv[0])
+        return 2
+    with ExportFile(argv[0]) as ex:
+        if len(argv) == 1:
+            for r in ex:
+                sys.stdout.write("0x%016x-0x%016x %10d %-4s %s%s\n" %
+                                 (r.address, r.end, r.length,
+                                  r.compressed and "zlib" or "raw", r.label,
+                                  r.type and " (%s)" % r.type or ""))
+            return 0
+        address = int(argv[1], 0)
+        if len(argv) == 3:
+            try:
+                data = ex.read(address, int(argv[2], 0))
+            except KeyError as e:
+                sys.stderr.write("%s\n" % e.args[0])
+                return 1
+        else:
+            region = ex.find(address)
+            if region == None:
+                sys.stderr.write("0x%x is not in the export\n" % address)
+                return 1
+            data = region.data()[address - region.address:]
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        out.write(bytes(data))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+
+# Tests of the gdbx.py internals without gdb
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Tests of the gdbx.py internals without gdb
+
+usage: python2 -m unittest discover tests
+
+The gdb module is replaced by bench/gdb.py, as bench/bench_gdbx.py
+does, so the formatters, the scanners and the validators are tested
+on the synthetic memory of its regions."""
+
+import sys
+import os
+import re
+import imp
+import json
+import signal
+import socket
+import unittest
+import tempfile
+import threading
+import StringIO
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+
+sys.path.insert(0, os.path.join(ROOT_DIR, "bench"))
+import gdb
+
+gdbx = imp.load_source("gdbx", os.path.join(ROOT_DIR, "gdbx.py"))
+gdbxexport = imp.load_source("gdbxexport",
+                             os.path.join(ROOT_DIR, "gdbxexport.py"))
+
+def chunked(data, size):
+    """Split DATA into the chunks of SIZE bytes"""
+    return [ data[i:i + size] for i in xrange(0, len(data), size) ]
+
+class MemoryTestCase(unittest.TestCase):
+    """A test case with its own regions of the inferior memory"""
+    def setUp(self):
+        gdb.regions[:] = []
+        gdb.patches.clear()
+        gdbx.memory_cache.clear()
+
+    tearDown = setUp
+
+class HexdumpFormatterTest(unittest.TestCase):
+    data = "0123456789abcdefXYZ" + "\0" * 40 + "\n"
+
+    def format(self, data, *args):
+        fmt = gdbx.HexdumpFormatter(*args)
+        return fmt.feed(data) + fmt.finish()
+
+    def line(self, offset, hexes, text):
+        """Returns a line of the canonical display"""
+        return "%-60s|%s|" % ("%08x  %s" % (offset, hexes), text)
+
+    def test_canonical(self):
+        self.assertEqual(self.format("0123456789abcdefXYZ\n").splitlines(),
+                         [ self.line(0, "30 31 32 33 34 35 36 37  "
+                                     "38 39 61 62 63 64 65 66",
+                                     "0123456789abcdef"),
+                           self.line(0x10, "58 59 5a 0a", "XYZ."),
+                           "00000014" ])
+
+    def test_default(self):
+        self.assertEqual(self.format("0123456789abcdef\x01", None),
+                         "0000000 3130 3332 3534 3736 3938 6261 6463 6665 \n"
+                         "0000010 0001                                    \n"
+                         "0000011\n")
+
+    def test_squeeze(self):
+        zeros = "00 00 00 00 00 00 00 00  00 00 00 00 00 00 00 00"
+        self.assertEqual(self.format("\0" * 64 + "x").splitlines(),
+                         [ self.line(0, zeros, "." * 16), "*",
+                           self.line(0x40, "78", "x"), "00000041" ])
+        self.assertEqual(len(self.format("\0" * 64, "C", False)
+                             .splitlines()), 5)
+
+    def test_offset(self):
+        self.assertEqual(self.format("ab", "C", True, 0x20).splitlines(),
+                         [ self.line(0x20, "61 62", "ab"), "00000022" ])
+
+    def test_chunks(self):
+        # The output does not depend on how the data is split.
+        for format in gdbx.HexdumpFormatter.formats:
+            whole = self.format(self.data, format)
+            for size in (1, 3, 7, 16, 17, 64):
+                fmt = gdbx.HexdumpFormatter(format)
+                out = "".join([ fmt.feed(c)
+                                for c in chunked(self.data, size) ])
+                self.assertEqual(out + fmt.finish(), whole,
+                                 "format %s, chunks of %d" % (format, size))
+
+class DiffRunsTest(unittest.TestCase):
+    def slow_runs(self, a, b, offset):
+        """The runs of the changed bytes, byte by byte"""
+        runs = list()
+        for i in xrange(len(a)):
+            if a[i] != b[i]:
+                if runs and runs[-1][1] == offset + i:
+                    runs[-1] = (runs[-1][0], offset + i + 1)
+                else:
+                    runs.append((offset + i, offset + i + 1))
+        return runs
+
+    def test_equal(self):
+        self.assertEqual(list(gdbx.diff_runs("x" * 1000, "x" * 1000)), [])
+
+    def test_runs(self):
+        a = "abcdefgh" * 1000
+        b = bytearray(a)
+        for (start, end) in ((0, 1), (402, 403), (406, 408), (1023, 1025),
+                             (4000, 4100), (7999, 8000)):
+            b[start:end] = "X" * (end - start)
+        b = str(b)
+        for block in (1, 16, 64, 4096, 64 * 1024):
+            self.assertEqual(list(gdbx.diff_runs(a, b, 0x1000, block)),
+                             self.slow_runs(a, b, 0x1000),
+                             "block of %d" % block)
+
+    def test_block_boundary(self):
+        # A run across blocks is reported once.
+        a = "\0" * 256
+        b = "\0" * 60 + "\1" * 10 + "\0" * 186
+        self.assertEqual(list(gdbx.diff_runs(a, b, 0, 64)), [ (60, 70) ])
+
+class AnnotatedFormatterTest(unittest.TestCase):
+    int_type = gdb.Type("int", 4)
+    char_type = gdb.Type("char", 1)
+    short_type = gdb.Type("short", 2)
+    # struct rec { int id; char flag; short len; int next; }
+    rec = gdb.Type("struct rec", 12, gdb.TYPE_CODE_STRUCT,
+                   fields = [ gdb.Field("id", int_type, 0),
+                              gdb.Field("flag", char_type, 32),
+                              gdb.Field("len", short_type, 48),
+                              gdb.Field("next", int_type, 64) ])
+    data = "".join([ chr(c) for c in range(48) ])
+
+    def format(self, layout, data, offset = 0):
+        fmt = gdbx.AnnotatedFormatter(layout, offset)
+        return (fmt.feed(data) + fmt.finish()).splitlines()
+
+    def test_layout(self):
+        layout = gdbx.TypeLayout(self.rec.array(4))
+        self.assertEqual((layout.size, layout.count), (12, 4))
+        self.assertEqual(layout.fields,
+                         [ (0, 4, "id"), (4, 1, "flag"), (5, 1, None),
+                           (6, 2, "len"), (8, 4, "next") ])
+
+    def test_nested(self):
+        # struct ent { struct rec hdr; int key; }
+        ent = gdb.Type("struct ent", 16, gdb.TYPE_CODE_STRUCT,
+                       fields = [ gdb.Field("hdr", self.rec, 0),
+                                  gdb.Field("key", self.int_type, 96) ])
+        self.assertEqual([ f[2] for f in gdbx.TypeLayout(ent).fields ],
+                         [ "hdr.id", "hdr.flag", None, "hdr.len",
+                           "hdr.next", "key" ])
+
+    def test_fields(self):
+        lines = self.format(gdbx.TypeLayout(self.rec.array(4)), self.data)
+        self.assertEqual(lines[0],
+                         "00000000  00 01 02 03 04 05_06 07  "
+                         "08 09 0a 0b 0c 0d 0e 0f  |................|  "
+                         "[0] +0 id, +4 flag, +5 <pad 1>, +6 len, +8 next; "
+                         "[1] +0 id")
+        self.assertEqual(len(lines), 4)
+
+    def test_offset(self):
+        # A part of a value is labelled as in the whole value.
+        layout = gdbx.TypeLayout(self.rec.array(4))
+        whole = self.format(layout, self.data)
+        self.assertEqual(self.format(layout, self.data[16:], 16), whole[1:])
+        part = self.format(layout, self.data[20:], 20)
+        self.assertTrue(part[0].startswith("00000014  14 15 16 17 18 19 "
+                                           "1a 1b  1c 1d_1e "))
+        self.assertTrue(part[0].endswith("|  [1] +8 next; [2] +0 id, "
+                                         "+4 flag, +5 <pad 1>, +6 len, "
+                                         "+8 next"))
+
+class MemoryCacheTest(MemoryTestCase):
+    base = 0x100000
+    page = gdbx.MEMORY_PAGE_SIZE
+    # A unit of a prime length, so that no two pages are the same
+    unit = "".join([ chr(c) for c in range(251) ])
+
+    class MemoryChanged(object):
+        def __init__(self, address, length):
+            (self.address, self.length) = (address, length)
+
+    def setUp(self):
+        MemoryTestCase.setUp(self)
+        self.region = gdb.add_region(self.base, self.page * 16, self.unit)
+        self.cache = gdbx.memory_cache
+        self.cache_size = gdbx.MEMORY_CACHE_SIZE
+
+    def tearDown(self):
+        self.set_cache_size(self.cache_size)
+        MemoryTestCase.tearDown(self)
+
+    def set_cache_size(self, size):
+        """set gdbx cache-size SIZE"""
+        param = gdb.commands["set gdbx cache-size"]
+        param.value = size
+        param.get_set_string()
+
+    def expected(self, address, length):
+        return self.region.read(address - self.base, length)
+
+    def cached(self):
+        return sorted([ (page - self.base) / self.page
+                        for (inferior, page) in self.cache.pages ])
+
+    def test_page_boundary(self):
+        address = self.base + self.page - 6
+        misses = self.cache.misses
+        self.assertEqual(self.cache.read(address, 12),
+                         self.expected(address, 12))
+        self.assertEqual(self.cached(), [ 0, 1 ])
+        self.assertEqual(self.cache.misses - misses, 2)
+        hits = self.cache.hits
+        self.assertEqual(self.cache.read(address + 2, 8),
+                         self.expected(address + 2, 8))
+        self.assertEqual(self.cache.hits - hits, 2)
+        # A page in the middle is read with the missing pages around it.
+        self.assertEqual(self.cache.read(self.base + 10, self.page * 3),
+                         self.expected(self.base + 10, self.page * 3))
+        self.assertEqual(self.cached(), [ 0, 1, 2, 3 ])
+
+    def test_eviction(self):
+        self.set_cache_size(self.page * 3)
+        for n in (0, 1, 2, 0, 3):
+            address = self.base + self.page * n + 100
+            self.assertEqual(self.cache.read(address, 4),
+                             self.expected(address, 4))
+        # Page 1 is the least recently used one.
+        self.assertEqual(self.cached(), [ 0, 2, 3 ])
+        self.assertEqual(self.cache.size, self.page * 3)
+        # A read larger than the cache bypasses it, and keeps the pages.
+        self.assertEqual(self.cache.read(self.base, self.page * 4),
+                         self.expected(self.base, self.page * 4))
+        self.assertEqual(self.cached(), [ 0, 2, 3 ])
+        # Shrinking the cache drops it.
+        self.set_cache_size(self.page)
+        self.assertEqual((self.cached(), self.cache.size), ([], 0))
+
+    def test_memory_changed(self):
+        address = self.base + self.page * 2 - 2
+        self.cache.read(self.base, self.page * 4)
+        gdb.selected_inferior().write_memory(address, "XXXX")
+        # gdb notifies the write, which drops the pages it overlaps.
+        gdb.events.memory_changed.fire(self.MemoryChanged(address, 4))
+        self.assertEqual(self.cached(), [ 0, 3 ])
+        self.assertEqual(self.cache.read(address - 2, 8),
+                         self.expected(address - 2, 2) + "XXXX" +
+                         self.expected(address + 4, 2))
+
+    def test_resume(self):
+        for event in (gdb.events.cont, gdb.events.exited):
+            self.cache.read(self.base, 16)
+            self.assertEqual(self.cached(), [ 0 ])
+            event.fire()
+            self.assertEqual((self.cached(), self.cache.size), ([], 0))
+
+class SamplingTest(MemoryTestCase):
+    base = 0x100000
+    unit = "".join([ chr(c) for c in range(256) ])
+    settings = ("MAX_BYTES", "SAMPLING", "SAMPLE_BYTES", "SAMPLE_PIECES")
+
+    def setUp(self):
+        MemoryTestCase.setUp(self)
+        self.saved = [ getattr(gdbx, name) for name in self.settings ]
+        (gdbx.MAX_BYTES, gdbx.SAMPLE_BYTES, gdbx.SAMPLE_PIECES) = \
+            (1024, 64, 4)
+        self.region = gdb.add_region(self.base, 4096, self.unit)
+
+    def tearDown(self):
+        for (name, value) in zip(self.settings, self.saved):
+            setattr(gdbx, name, value)
+        MemoryTestCase.tearDown(self)
+
+    def invoke(self, line):
+        """Run the command LINE; returns its output"""
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            gdb.invoke(line)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def dump(self, length):
+        return self.invoke("hexdump memory 0x%x 0x%x ## -C" %
+                           (self.base, self.base + length))
+
+    def test_within_limit(self):
+        for sampling in ("error", "head", "tail", "stride"):
+            gdbx.SAMPLING = sampling
+            self.assertEqual(gdbx.sample_region(self.base, 1024),
+                             [ (self.base, 1024) ])
+        gdbx.MAX_BYTES = 0
+        self.assertEqual(gdbx.sample_region(self.base, 1 << 40),
+                         [ (self.base, 1 << 40) ])
+
+    def test_error(self):
+        gdbx.SAMPLING = "error"
+        self.assertRaises(RuntimeError, gdbx.sample_region, self.base, 1025)
+        self.assertEqual(self.dump(4096),
+                         "hexdump memory: 4096 bytes (0x100000-0x101000) is "
+                         "over the limit of 1024 bytes; see 'help set gdbx "
+                         "max-bytes'\n")
+
+    def test_head(self):
+        gdbx.SAMPLING = "head"
+        self.assertEqual(gdbx.sample_region(self.base, 4096),
+                         [ (self.base, 64) ])
+        lines = self.dump(4096).splitlines()
+        self.assertEqual(lines[1], "==> head 1/1: 0x100000-0x100040, "
+                         "64 bytes <==")
+        self.assertTrue(lines[2].startswith("00000000  00 01 02 03 "))
+        self.assertEqual(lines[-2:], [ "00000040", "--- skipped "
+                                       "0x100040-0x101000 (4032 bytes) ---" ])
+
+    def test_tail(self):
+        gdbx.SAMPLING = "tail"
+        self.assertEqual(gdbx.sample_region(self.base, 4096),
+                         [ (self.base + 4032, 64) ])
+        lines = self.dump(4096).splitlines()
+        self.assertEqual(lines[1], "--- skipped 0x100000-0x100fc0 "
+                         "(4032 bytes) ---")
+        self.assertEqual(lines[3][:10], "00000fc0  ")
+        self.assertEqual(lines[-1], "00001000")
+
+    def test_stride(self):
+        gdbx.SAMPLING = "stride"
+        # 4 pieces of 16 bytes, from the start to the end
+        self.assertEqual([ (address - self.base, size) for (address, size)
+                           in gdbx.sample_region(self.base, 4096) ],
+                         [ (0, 16), (1360, 16), (2720, 16), (4080, 16) ])
+        lines = self.dump(4096).splitlines()
+        self.assertEqual(lines[0], "hexdump memory: 4096 bytes "
+                         "(0x100000-0x101000) is over the limit of 1024 "
+                         "bytes, stride sampling")
+        skipped = [ line for line in lines if line.startswith("---") ]
+        self.assertEqual(skipped, [ "--- skipped 0x100010-0x100550 "
+                                    "(1344 bytes) ---",
+                                    "--- skipped 0x100560-0x100aa0 "
+                                    "(1344 bytes) ---",
+                                    "--- skipped 0x100ab0-0x100ff0 "
+                                    "(1344 bytes) ---" ])
+        # The offsets are of the parts in the whole region.
+        offsets = [ line[:8] for line in lines if line[:1] == "0" ]
+        self.assertEqual(offsets, [ "00000000", "00000010", "00000550",
+                                    "00000560", "00000aa0", "00000ab0",
+                                    "00000ff0", "00001000" ])
+        data = self.region.read(1360, 16)
+        self.assertTrue(" ".join([ "%02x" % ord(c) for c in data[:8] ])
+                        in lines[lines.index("==> stride 2/4: "
+                                             "0x100550-0x100560, "
+                                             "16 bytes <==") + 1])
+
+    def test_stride_background(self):
+        gdbx.SAMPLING = "stride"
+        count = len(gdbx.jobs)
+        self.assertEqual(self.invoke("hexdump memory 0x%x 0x%x &" %
+                                     (self.base, self.base + 4096)),
+                         "hexdump memory: stride sampling cannot run in "
+                         "the background\n")
+        self.assertEqual(len(gdbx.jobs), count)
+
+class MemorySearchTest(MemoryTestCase):
+    base = 0x100000
+
+    def literal(self, label, text):
+        return (label, re.escape(text), text)
+
+    def search(self, patterns, region, chunk_size = None):
+        search = gdbx.MemorySearch(patterns)
+        hits = [ (address - self.base, label, text) for (address, label, text)
+                 in search.search(region.base, region.size, chunk_size) ]
+        return (hits, search)
+
+    def test_literal_across_chunks(self):
+        # The needle straddles the boundary of the first two chunks.
+        size = gdbx.MEMORY_CHUNK_SIZE
+        region = gdb.add_region(self.base, size * 2, "\0", "\0" * (size - 3)
+                                + "needle")
+        (hits, search) = self.search([ self.literal("n", "needle") ], region)
+        self.assertEqual(hits, [ (size - 3, "n", "needle") ])
+        self.assertEqual(search.scanned, region.size)
+
+    def test_regex_across_chunks(self):
+        size = gdbx.MEMORY_CHUNK_SIZE
+        region = gdb.add_region(self.base, size * 2, "\0", "\0" * (size - 2)
+                                + "ab1234")
+        (hits, search) = self.search([ ("r", "ab[0-9]+", None) ], region)
+        self.assertEqual(hits, [ (size - 2, "r", "ab1234") ])
+
+    def test_small_chunks(self):
+        # Every match is reported once, whatever the chunk size is.
+        region = gdb.add_region(self.base, 4096, "the quick brown fox. ")
+        expected = None
+        for chunk_size in (7, 64, 1000, 4096):
+            (hits, search) = self.search([ self.literal("fox", "fox"),
+                                           ("o", "o", None) ],
+                                         region, chunk_size)
+            if expected == None:
+                expected = hits
+            self.assertEqual(hits, expected, "chunks of %d" % chunk_size)
+        units = 4096 / len("the quick brown fox. ")
+        self.assertEqual(len(expected), units * 3)
+
+    def test_overlapping_patterns(self):
+        region = gdb.add_region(self.base, 16, "foxtrot", "", "\0" * 9)
+        (hits, search) = self.search([ ("a", "fox", None),
+                                       ("b", "foxtrot", None),
+                                       ("c", "trot", None) ], region)
+        self.assertEqual(hits, [ (0, "a", "fox"), (0, "b", "foxtrot"),
+                                 (3, "c", "trot") ])
+
+    def test_groups_and_flags(self):
+        # A backreference and an inline flag keep their meaning next to
+        # the other patterns.
+        region = gdb.add_region(self.base, 32, "abab FOX cdcd", "",
+                                "\0" * 19)
+        (hits, search) = self.search([ ("fox", "(?i)fox", None),
+                                       ("rep", r"([a-z]{2})\1", None),
+                                       ("d", "d", None) ], region)
+        self.assertEqual(hits, [ (0, "rep", "abab"), (5, "fox", "FOX"),
+                                 (9, "rep", "cdcd"), (10, "d", "d"),
+                                 (12, "d", "d") ])
+
+    def test_unreadable(self):
+        # The chunks of the gap are skipped, and the search goes on.
+        size = 4096
+        gdb.add_region(self.base, size, "\0", "", "key")
+        gdb.add_region(self.base + size * 3, size, "\0", "key")
+        region = gdb.Region(self.base, size * 4, "\0")
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            (hits, search) = self.search([ self.literal("k", "key") ], region,
+                                         1024)
+            messages = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(hits, [ (size - 3, "k", "key"),
+                                 (size * 3, "k", "key") ])
+        self.assertEqual(search.skipped, size * 2)
+        self.assertEqual(messages, "error: cannot read 0x%x-0x%x, skipped\n"
+                         % (self.base + size, self.base + size * 3))
+
+class StringScannerTest(MemoryTestCase):
+    base = 0x100000
+    encodings = [ ("ascii", "ascii"), ("utf-8", "utf-8"),
+                  ("utf-16le", "utf-16-le") ]
+    unit = ("\0\0hello world\0\x01" +
+            u"\ud55c\uad6d\uc5b4 text".encode("utf-8") + "\0\0" +
+            u"wide!".encode("utf-16-le") + "\0\0\xff\x02abc\0")
+    strings = [ (0x2, "ascii", u"hello world"),
+                (0xf, "utf-8", u"\ud55c\uad6d\uc5b4 text"),
+                (0x1f, "utf-16le", u"wide!") ]
+
+    def scan(self, region, chunk_size = None, minimum = 4):
+        scanner = gdbx.StringScanner(self.encodings, minimum)
+        return [ (address - self.base, name, text) for (address, name, text)
+                 in scanner.scan(region.base, region.size, chunk_size) ]
+
+    def test_encodings(self):
+        region = gdb.add_region(self.base, len(self.unit), self.unit)
+        self.assertEqual(self.scan(region), self.strings)
+
+    def test_minimum(self):
+        region = gdb.add_region(self.base, len(self.unit), self.unit)
+        self.assertEqual(self.scan(region, minimum = 3),
+                         self.strings + [ (0x2d, "ascii", u"abc") ])
+        self.assertEqual(self.scan(region, minimum = 6),
+                         self.strings[:2])
+
+    def test_chunks(self):
+        # The strings cut by the chunks are found whole, once.
+        size = len(self.unit)
+        region = gdb.add_region(self.base, size * 8, self.unit)
+        expected = [ (address + size * i, name, text) for i in range(8)
+                     for (address, name, text) in self.strings ]
+        for chunk_size in (1, 5, 16, 40, size, size * 8):
+            self.assertEqual(self.scan(region, chunk_size), expected,
+                             "chunks of %d" % chunk_size)
+
+class ExportTest(MemoryTestCase):
+    base = 0x100000
+
+    def setUp(self):
+        MemoryTestCase.setUp(self)
+        self.text = gdb.add_region(self.base, 251 * 80,
+                                   "".join([ chr(c) for c in range(251) ]))
+        self.zeros = gdb.add_region(self.base + 0x100000,
+                                    gdbx.MEMORY_CHUNK_SIZE * 2 + 100, "\0")
+        (fd, self.path) = tempfile.mkstemp(prefix="gdbx-test-")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+        MemoryTestCase.tearDown(self)
+
+    def write(self, level):
+        """Export the regions; returns {label: (address, length, bytes)}"""
+        regions = { "zeros": (self.zeros.base, self.zeros.size),
+                    "tail": (self.base + 8000, 8384),
+                    "head": (self.base, 10000),
+                    "inner": (self.base + 100, 50),
+                    "empty": (self.base + 20000, 0) }
+        writer = gdbx.ExportWriter(self.path, level)
+        for (label, (address, length)) in regions.items():
+            writer.add(label, "char [%d]" % length, address, length)
+        writer.close()
+        return dict([ (label, (address, length,
+                               gdb.read(address, length)))
+                      for (label, (address, length)) in regions.items() ])
+
+    def check(self, level):
+        expected = self.write(level)
+        with gdbxexport.ExportFile(self.path) as ex:
+            regions = list(ex)
+            self.assertEqual([ (r.address, r.length) for r in regions ],
+                             sorted([ e[:2] for e in expected.values() ]))
+            for r in regions:
+                (address, length, data) = expected[r.label]
+                self.assertEqual((r.address, r.length), (address, length))
+                self.assertEqual(r.type, u"char [%d]" % length)
+                self.assertEqual(bytes(r.data()), data, r.label)
+            self.assertEqual(ex.find(self.base + 120).label, u"inner")
+            self.assertEqual(ex.find(self.base + 9000).label, u"tail")
+            self.assertEqual(ex.find(self.base + 16384), None)
+            # A read across the regions
+            self.assertEqual(ex.read(self.base + 9990, 100),
+                             gdb.read(self.base + 9990, 100))
+            self.assertRaises(KeyError, ex.read, self.base + 16380, 8)
+            return regions
+
+    def test_raw(self):
+        regions = self.check(0)
+        self.assertFalse([ r for r in regions if r.compressed ])
+
+    def test_zlib(self):
+        regions = dict([ (r.label, r) for r in self.check(6) ])
+        self.assertTrue(regions["zeros"].compressed)
+        self.assertTrue(regions["zeros"].stored < 4096)
+
+class JsonValidatorTest(unittest.TestCase):
+    valid = [ '0', '-0.5e-3', ' "a" ', 'true', 'null', '[]', '{}',
+              '[1, 2.5, -3e10, "x", true, false, null]',
+              '{"a": 1, "b": [1, {"c": "d,e"}], "f": {}}',
+              '{"esc": "\\"\\\\\\/\\b\\f\\n\\r\\t\\u00e9\\uD83D\\uDE00"}',
+              '[[[[[[[[[[1]]]]]]]]]]',
+              '\n[\n  {"id": 42, "tags": ["lazy", "dog"]},\n  {}\n]\n',
+              '[' + ', '.join([ '{"k%d": "v,%d"}' % (i, i)
+                                for i in range(50) ]) + ']',
+              '{"a":1,"b":2,"c":[3,4,5],"d":"\xc3\xa9"}' ]
+    invalid = [ '', ' ', '[1, 2,]', '{"a" 1}', '{"a": 1,}', '{1: 2}',
+                '01', '1.', '.5', '-', '+1', '"\\x"', '"\\u12"', '"abc',
+                '"a\tb"', 'tru', 'nul', 'NaN', 'Infinity', '1 2', '[1] [2]',
+                ']', '[', '{"a": [1, 2}', '[1, {"a": 2]]', '{"a"}',
+                "['a']", '[1 2]' ]
+    sizes = (1, 2, 3, 5, 7, 16, 64, 1024)
+
+    def check(self, text, size, lines = False):
+        """Returns None if TEXT is valid in chunks of SIZE, or the offset
+of the error, and the validator"""
+        validator = gdbx.JsonValidator(lines)
+        try:
+            for chunk in chunked(text, size):
+                validator.feed(chunk)
+            validator.finish()
+        except gdbx.JsonSyntaxError as e:
+            return (e.offset, validator)
+        return (None, validator)
+
+    def constant(self, name):
+        raise ValueError(name)
+
+    def stats(self, value, depth = 1):
+        """Returns the statistics of a decoded value like JsonValidator"""
+        if type(value) is dict:
+            items = value.values()
+            stats = [ 1, len(value), 0, 0 ]
+        elif type(value) is list:
+            items = value
+            stats = [ 0, 0, 1, len(value) ]
+        else:
+            return [ 0, 0, 0, 0, 0, 0 ]
+        stats += [ depth, len(items) ]
+        for item in items:
+            sub = self.stats(item, depth + 1)
+            stats = [ a + b for (a, b) in zip(stats[:4], sub[:4]) ] + \
+                    [ max(stats[4], sub[4]), max(stats[5], sub[5]) ]
+        return stats
+
+    def test_valid(self):
+        for text in self.valid:
+            expected = self.stats(json.loads(text))
+            for size in self.sizes:
+                (offset, v) = self.check(text, size)
+                self.assertEqual(offset, None, "%r in chunks of %d: error "
+                                 "at %s" % (text, size, offset))
+                self.assertEqual([ v.objects, v.members, v.arrays,
+                                   v.elements, v.max_depth, v.largest ],
+                                 expected, "%r in chunks of %d" %
+                                 (text, size))
+
+    def test_invalid(self):
+        for text in self.invalid:
+            # NaN and Infinity are not JSON, though json.loads() takes them
+            self.assertRaises(ValueError, json.loads, text,
+                              parse_constant = self.constant)
+            offsets = set()
+            for size in self.sizes:
+                (offset, v) = self.check(text, size)
+                self.assertNotEqual(offset, None, "%r in chunks of %d" %
+                                    (text, size))
+                offsets.add(offset)
+            self.assertEqual(len(offsets), 1, "%r: errors at %s" %
+                             (text, sorted(offsets)))
+
+    def test_error_position(self):
+        text = '{\n  "a": 1,\n  "b" 2\n}'
+        validator = gdbx.JsonValidator()
+        try:
+            validator.feed(text)
+            validator.finish()
+        except gdbx.JsonSyntaxError as e:
+            self.assertEqual((e.offset, e.line, e.column), (18, 3, 7))
+            self.assertEqual(str(e), "expected ':', got '2'")
+        else:
+            self.fail("no error")
+
+    def test_nul(self):
+        # A NUL byte after the value ends the data.
+        for size in self.sizes:
+            self.assertEqual(self.check('{"a": [1]}\0garbage', size)[0],
+                             None)
+            self.assertEqual(self.check('{"a": [1\0]}', size)[0], 8)
+
+    def test_lines(self):
+        text = '{"a": 1}\n\n[1, 2]\n"x"\n'
+        for size in self.sizes:
+            (offset, v) = self.check(text, size, True)
+            self.assertEqual(offset, None)
+            self.assertEqual(v.records, 3)
+            self.assertEqual(self.check('{"a":\n1}\n', size, True)[0], 5)
+            self.assertEqual(self.check('1 2\n', size, True)[0], 2)
+
+class ToolRunTest(unittest.TestCase):
+    """The frames between gdb and a worker of ToolPool, on a socket pair"""
+    def setUp(self):
+        (self.sock, self.peer) = socket.socketpair()
+        self.worker = gdbx.ToolWorker(self.sock, 0)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def frame(self, kind, data = ""):
+        return gdbx.ToolPool.frame.pack(kind, len(data)) + data
+
+    def request(self, run):
+        """Returns the request of RUN as the worker gets it"""
+        while run.writing():
+            run.write()
+        data = self.peer.recv(65536)
+        (kind, size) = gdbx.ToolPool.frame.unpack_from(data)
+        self.assertEqual(kind, "r")
+        return json.loads(data[gdbx.ToolPool.frame.size:
+                               gdbx.ToolPool.frame.size + size])
+
+    def test_request(self):
+        run = gdbx.ToolRun(self.worker, 0, [ "cat", "-" ], None)
+        request = self.request(run)
+        self.assertEqual(request["argv"], [ "cat", "-" ])
+        self.assertEqual(request["cwd"], os.getcwd())
+        self.assertEqual(request["env"], dict(os.environ))
+        # The worker keeps the environment until it changes.
+        run = gdbx.ToolRun(self.worker, 1, "true", None)
+        request = self.request(run)
+        self.assertEqual(sorted(request.keys()), [ "argv", "stdin" ])
+        os.environ["GDBX_TEST"] = "1"
+        try:
+            run = gdbx.ToolRun(self.worker, 2, "true", None)
+            self.assertEqual(self.request(run)["env"]["GDBX_TEST"], "1")
+        finally:
+            del os.environ["GDBX_TEST"]
+
+    def test_input(self):
+        run = gdbx.ToolRun(self.worker, 0, "cat", iter([ "abc", "de" ]))
+        while run.writing():
+            run.write()
+        data = ""
+        while not data.endswith(self.frame("c")):
+            data += self.peer.recv(65536)
+        # The input follows the request.
+        pos = gdbx.ToolPool.frame.size + \
+              gdbx.ToolPool.frame.unpack_from(data)[1]
+        self.assertEqual(data[pos:], self.frame("i", "abc") +
+                         self.frame("i", "de") + self.frame("c"))
+
+    def test_reply(self):
+        # The frames are parsed however the stream is split.
+        reply = (self.frame("p", "1234") + self.frame("o", "out" * 100) +
+                 self.frame("e", "err") + self.frame("o", "put") +
+                 self.frame("x", "3"))
+        for size in (1, 5, 64, len(reply)):
+            run = gdbx.ToolRun(self.worker, 0, "true", None)
+            self.request(run)
+            done = False
+            for piece in chunked(reply, size):
+                self.assertFalse(done)
+                self.peer.sendall(piece)
+                done = run.read(None)
+            self.assertTrue(done)
+            self.assertEqual((run.pid, run.status), (1234, 3))
+            self.assertEqual("".join(run.out), "out" * 100 + "put")
+            self.assertEqual("".join(run.err), "err")
+
+    def test_exec_failure(self):
+        run = gdbx.ToolRun(self.worker, 0, "nothing", None)
+        self.request(run)
+        self.peer.sendall(self.frame("p", "1") + self.frame("f", "2") +
+                          self.frame("x", "127"))
+        while not run.read(None):
+            pass
+        self.assertEqual(run.failed.errno, 2)
+
+    def test_worker_exit(self):
+        run = gdbx.ToolRun(self.worker, 0, "true", None)
+        self.request(run)
+        self.peer.close()
+        self.assertTrue(run.read(None))
+        self.assertTrue(self.worker.lost)
+        self.assertEqual(run.status, -signal.SIGKILL)
+
+class ToolPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = gdbx.ToolPool(1)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_cat(self):
+        chunks = [ "x" * 100000, "y" * 100000 ]
+        self.assertEqual(self.pool.run([ ([ "/bin/cat" ], iter(chunks)) ]),
+                         [ (0, "".join(chunks), "") ])
+        self.assertEqual(self.pool.run([ ("echo $0 >&2; exit 3", None) ]),
+                         [ (3, "", "/bin/sh\n") ])
+        self.assertRaises(OSError, self.pool.run,
+                          [ ([ "/nonexistent/tool" ], None) ])
+
+    def test_reuse(self):
+        for i in range(3):
+            self.assertEqual(self.pool.run([ ([ "/bin/cat" ],
+                                               iter([ str(i) ])) ]),
+                             [ (0, str(i), "") ])
+        self.assertEqual(len(self.pool.workers), 1)
+        self.assertFalse(self.pool.broken)
+
+    def test_queue(self):
+        # The tools more than the workers wait for a free worker.
+        results = self.pool.run([ ([ "/bin/cat" ], iter([ "a" ])),
+                                  ([ "/bin/cat" ], iter([ "b" ])) ])
+        self.assertEqual(results, [ (0, "a", ""), (0, "b", "") ])
+        self.assertEqual(len(self.pool.workers), 1)
+
+    def test_respawn(self):
+        self.pool.run([ ("true", None) ])
+        pid = self.pool.workers[0].pid
+        # A cancelled tool is killed with its worker.
+        cancel = threading.Event()
+        cancel.set()
+        self.assertRaises(KeyboardInterrupt, self.pool.run,
+                          [ ("sleep 10", None) ], None, cancel)
+        self.assertEqual(self.pool.workers, [])
+        self.assertEqual(self.pool.run([ ([ "/bin/cat" ], iter([ "z" ])) ]),
+                         [ (0, "z", "") ])
+        self.assertNotEqual(self.pool.workers[0].pid, pid)
+
+    def test_lost_worker(self):
+        # The tool of a worker killed while idle fails, and the worker is
+        # replaced for the next tool.
+        self.pool.run([ ("true", None) ])
+        pid = self.pool.workers[0].pid
+        os.kill(pid, signal.SIGKILL)
+        (status, out, err) = self.pool.run([ ("true", None) ])[0]
+        self.assertEqual(status, -signal.SIGKILL)
+        self.assertEqual(self.pool.run([ ("echo ok", None) ]),
+                         [ (0, "ok\n", "") ])
+        self.assertNotEqual(self.pool.workers[0].pid, pid)
+
+if __name__ == "__main__":
+    unittest.main()